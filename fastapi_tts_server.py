@@ -5,28 +5,61 @@ FastAPI server for Chatterbox TTS with Mac support
 import os
 import io
 import base64
+import asyncio
+import functools
+import json
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 import torch
-import torchaudio as ta
 import numpy as np
-from chatterbox.tts import ChatterboxTTS
-import tempfile
+from chatterbox.audio_io import encode_pcm, encode_wav, wav_header
+from chatterbox.tts import ChatterboxTTS, ConditionalsCache, split_sentences
+from chatterbox.models.s3gen.flow_matching import SOLVERS
+from chatterbox.scheduler import TTSScheduler
+from chatterbox.voices import VoiceLibrary
 from typing import Optional
 
 # Global model instance
 model = None
+# Continuous-batching scheduler sharing the model between concurrent requests
+scheduler = None
+# Executor for the blocking work around inference (audio encoding and decoding, voice prompt embedding), so that
+# the event loop stays responsive; T3 and S3Gen themselves run on the scheduler threads
+executor = None
+# Threads running the streaming syntheses, which bypass the scheduler to yield audio as tokens are sampled
+stream_executor = None
+# Longer texts are split into sentence chunks that are synthesized in parallel (see TTSScheduler.submit_long)
+MAX_TEXT_CHARS = int(os.environ.get("CHATTERBOX_MAX_TEXT_CHARS", 100_000))
+# Sentence chunks per request (about 300 characters each); a request's chunks take turns with other requests
+MAX_CHUNKS_PER_REQUEST = int(os.environ.get("CHATTERBOX_MAX_CHUNKS_PER_REQUEST", 400))
+# Synthesis requests that are queued or running at once; more are rejected with 429 instead of piling up
+MAX_PENDING_REQUESTS = int(os.environ.get("CHATTERBOX_MAX_PENDING_REQUESTS", 32))
+pending_requests = 0
+# How often (in seconds) a waiting request checks whether its client has disconnected
+DISCONNECT_POLL_INTERVAL = 0.5
 
 class TTSRequest(BaseModel):
     text: str
+    voice_id: Optional[str] = None
     exaggeration: float = 0.5
     cfg_weight: float = 0.5
     temperature: float = 0.8
     repetition_penalty: float = 1.2
     min_p: float = 0.05
     top_p: float = 1.0
+    flow_steps: int = 10
+    flow_solver: str = "euler"
+
+class TTSStreamRequest(TTSRequest):
+    # "wav" (a WAV header of unknown length, then PCM16 samples) or "pcm" (raw PCM16 little-endian samples)
+    format: str = "wav"
+    # Speech tokens per audio chunk; 25 tokens = 1 s of speech
+    chunk_size: int = 25
 
 class TTSResponse(BaseModel):
     message: str
@@ -47,17 +80,114 @@ def init_model():
             device = "cpu"
             print("Using CPU")
         
-        # Initialize model
-        model = ChatterboxTTS.from_pretrained(device=device)
+        # Initialize model; CHATTERBOX_DTYPE=bfloat16 runs T3 and the S3Gen flow in bf16, and on CPU
+        # CHATTERBOX_T3_INT8=1 runs T3 with int8 weights
+        model = ChatterboxTTS.from_pretrained(
+            device=device,
+            dtype=os.environ.get("CHATTERBOX_DTYPE"),
+            t3_int8=device == "cpu" and os.environ.get("CHATTERBOX_T3_INT8", "0") == "1",
+        )
         print(f"Model loaded successfully on {device}")
 
+        # Persist processed voice prompts across restarts if requested
+        if conds_cache_dir := os.environ.get("CHATTERBOX_CONDS_CACHE_DIR"):
+            model.conds_cache = ConditionalsCache(cache_dir=conds_cache_dir)
+            print(f"Caching voice conditionals in {conds_cache_dir}")
+
+        # Registered voices, selectable by voice_id
+        voices_dir = os.environ.get("CHATTERBOX_VOICES_DIR", "voices")
+        model.voices = VoiceLibrary(voices_dir, device=device)
+        print(f"Loaded {len(model.voices)} voices from {voices_dir}")
+
+def init_executor():
+    """
+    Partition the CPU: CHATTERBOX_TORCH_THREADS sets the PyTorch intra-op threads (shared by the whole process) and
+    CHATTERBOX_IO_WORKERS the threads for blocking pre- and post-processing
+    """
+    global executor, stream_executor
+    if torch_threads := int(os.environ.get("CHATTERBOX_TORCH_THREADS", 0)):
+        torch.set_num_threads(torch_threads)
+    print(f"PyTorch uses {torch.get_num_threads()} threads")
+    if executor is None:
+        io_workers = int(os.environ.get("CHATTERBOX_IO_WORKERS", 2))
+        executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="chatterbox-io")
+    if stream_executor is None:
+        stream_workers = int(os.environ.get("CHATTERBOX_STREAM_WORKERS", 2))
+        stream_executor = ThreadPoolExecutor(max_workers=stream_workers, thread_name_prefix="chatterbox-stream")
+
+def init_scheduler():
+    """
+    Start the batching scheduler; the batch size can be tuned with CHATTERBOX_MAX_BATCH_SIZE and the number of
+    vocoder threads with CHATTERBOX_VOCODE_WORKERS
+    """
+    global scheduler
+    if scheduler is None:
+        max_batch_size = int(os.environ.get("CHATTERBOX_MAX_BATCH_SIZE", 8))
+        vocode_workers = int(os.environ.get("CHATTERBOX_VOCODE_WORKERS", 1))
+        scheduler = TTSScheduler(model, max_batch_size=max_batch_size, vocode_workers=vocode_workers).start()
+        print(f"Scheduler started (max batch size {max_batch_size}, {vocode_workers} vocoder threads)")
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run a blocking call on the executor"""
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+async def submit_long(**kwargs):
+    """Split, tokenize and queue a text off the event loop (see TTSScheduler.submit_long); returns its future"""
+    try:
+        return await run_blocking(scheduler.submit_long, max_chunks=MAX_CHUNKS_PER_REQUEST, **kwargs)
+    except ValueError as e:  # more than MAX_CHUNKS_PER_REQUEST chunks
+        raise HTTPException(status_code=400, detail=str(e))
+
+def reserve_request():
+    """Count a synthesis request against MAX_PENDING_REQUESTS, or reject it with 429 if the server is full"""
+    global pending_requests
+    if pending_requests >= MAX_PENDING_REQUESTS:
+        raise HTTPException(status_code=429, detail="Server busy, try again later", headers={"Retry-After": "1"})
+    pending_requests += 1
+
+def release_request():
+    global pending_requests
+    pending_requests -= 1
+
+@asynccontextmanager
+async def admit_request():
+    """Hold a pending request slot (see reserve_request) for the duration of the block"""
+    reserve_request()
+    try:
+        yield
+    finally:
+        release_request()
+
+async def wait_for_synthesis(future, http_request: Request):
+    """Wait for a scheduler future, cancelling the synthesis if the client disconnects meanwhile"""
+    waiter = asyncio.wrap_future(future)
+    while True:
+        done, _ = await asyncio.wait({waiter}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return waiter.result()
+        if await http_request.is_disconnected():
+            future.cancel()
+            raise HTTPException(status_code=499, detail="Client disconnected")
+
+
+def check_flow_settings(flow_steps: int, flow_solver: str):
+    """Validate the S3Gen flow decoder settings (fewer steps are faster, see ChatterboxTTS.generate)"""
+    if not 1 <= flow_steps <= 50:
+        raise HTTPException(status_code=400, detail="flow_steps must be between 1 and 50")
+    if flow_solver not in SOLVERS:
+        raise HTTPException(status_code=400, detail=f"flow_solver must be one of {', '.join(SOLVERS)}")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    init_executor()
     init_model()
+    init_scheduler()
     yield
     # Shutdown
-    pass
+    scheduler.stop()
+    executor.shutdown()
+    stream_executor.shutdown(wait=False)
 
 # Create FastAPI app with lifespan
 app = FastAPI(
@@ -79,11 +209,13 @@ async def health_check():
     return {
         "status": "healthy" if model is not None else "model_not_loaded",
         "device": "mps" if torch.backends.mps.is_available() else "cpu",
-        "torch_version": torch.__version__
+        "torch_version": torch.__version__,
+        "pending_requests": pending_requests,
+        "max_pending_requests": MAX_PENDING_REQUESTS
     }
 
 @app.post("/synthesize", response_model=TTSResponse)
-async def synthesize_speech(request: TTSRequest):
+async def synthesize_speech(request: TTSRequest, http_request: Request):
     """
     Synthesize speech from text using the default voice
     """
@@ -95,52 +227,63 @@ async def synthesize_speech(request: TTSRequest):
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
-    if len(request.text) > 500:
-        raise HTTPException(status_code=400, detail="Text too long (max 500 characters)")
+    if len(request.text) > MAX_TEXT_CHARS:
+        raise HTTPException(status_code=400, detail=f"Text too long (max {MAX_TEXT_CHARS} characters)")
     
-    try:
-        print(f"Generating speech for: {request.text[:50]}...")
-        
-        # Generate audio
-        wav = model.generate(
-            text=request.text,
-            exaggeration=request.exaggeration,
-            cfg_weight=request.cfg_weight,
-            temperature=request.temperature,
-            repetition_penalty=request.repetition_penalty,
-            min_p=request.min_p,
-            top_p=request.top_p,
-        )
+    check_flow_settings(request.flow_steps, request.flow_solver)
+    
+    async with admit_request():
+        conds = None
+        if request.voice_id is not None:
+            if request.voice_id not in model.voices:
+                raise HTTPException(status_code=404, detail=f"Unknown voice: {request.voice_id}")
+            conds = await run_blocking(model.voices.get, request.voice_id, exaggeration=request.exaggeration)
         
-        # Convert to base64 for JSON response
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-            ta.save(temp_file.name, wav, model.sr)
+        try:
+            print(f"Generating speech for: {request.text[:50]}...")
             
-            with open(temp_file.name, "rb") as audio_file:
-                audio_base64 = base64.b64encode(audio_file.read()).decode()
+            # Generate audio (batched with the other in-flight requests)
+            wav = await wait_for_synthesis(await submit_long(
+                text=request.text,
+                conds=conds,
+                exaggeration=request.exaggeration,
+                cfg_weight=request.cfg_weight,
+                temperature=request.temperature,
+                repetition_penalty=request.repetition_penalty,
+                min_p=request.min_p,
+                top_p=request.top_p,
+                flow_steps=request.flow_steps,
+                flow_solver=request.flow_solver,
+            ), http_request)
             
-            os.unlink(temp_file.name)
-        
-        return TTSResponse(
-            message="Speech synthesized successfully",
-            audio_base64=audio_base64,
-            sample_rate=model.sr
-        )
-        
-    except Exception as e:
-        print(f"Error during synthesis: {e}")
-        raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
+            # Convert to base64 for JSON response
+            audio_base64 = base64.b64encode(await run_blocking(encode_wav, wav, model.sr, subtype="FLOAT")).decode()
+            
+            return TTSResponse(
+                message="Speech synthesized successfully",
+                audio_base64=audio_base64,
+                sample_rate=model.sr
+            )
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error during synthesis: {e}")
+            raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
 
 @app.post("/synthesize_with_voice")
 async def synthesize_with_voice(
     text: str,
+    http_request: Request,
     voice_file: UploadFile = File(...),
     exaggeration: float = 0.5,
     cfg_weight: float = 0.5,
     temperature: float = 0.8,
     repetition_penalty: float = 1.2,
     min_p: float = 0.05,
-    top_p: float = 1.0
+    top_p: float = 1.0,
+    flow_steps: int = 10,
+    flow_solver: str = "euler"
 ):
     """
     Synthesize speech with a custom voice prompt
@@ -153,55 +296,292 @@ async def synthesize_with_voice(
     if not text.strip():
         raise HTTPException(status_code=400, detail="Text cannot be empty")
     
+    if len(text) > MAX_TEXT_CHARS:
+        raise HTTPException(status_code=400, detail=f"Text too long (max {MAX_TEXT_CHARS} characters)")
+    
     # Validate file type
     if not voice_file.filename.lower().endswith(('.wav', '.mp3', '.flac', '.m4a')):
         raise HTTPException(status_code=400, detail="Voice file must be audio format (wav, mp3, flac, m4a)")
     
-    try:
-        # Save uploaded voice file temporarily
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_voice:
-            content = await voice_file.read()
-            temp_voice.write(content)
-            temp_voice_path = temp_voice.name
-        
-        print(f"Generating speech with custom voice for: {text[:50]}...")
-        
-        # Generate audio with voice prompt
-        wav = model.generate(
-            text=text,
-            audio_prompt_path=temp_voice_path,
-            exaggeration=exaggeration,
-            cfg_weight=cfg_weight,
-            temperature=temperature,
-            repetition_penalty=repetition_penalty,
-            min_p=min_p,
-            top_p=top_p,
-        )
-        
-        # Clean up voice file
-        os.unlink(temp_voice_path)
-        
-        # Convert to bytes for streaming response
-        with tempfile.NamedTemporaryFile(suffix=".wav") as temp_output:
-            ta.save(temp_output.name, wav, model.sr)
-            temp_output.seek(0)
-            audio_bytes = temp_output.read()
-        
-        return StreamingResponse(
-            io.BytesIO(audio_bytes),
-            media_type="audio/wav",
-            headers={"Content-Disposition": "attachment; filename=synthesized_speech.wav"}
+    check_flow_settings(flow_steps, flow_solver)
+    
+    async with admit_request():
+        try:
+            voice_bytes = await voice_file.read()
+            
+            print(f"Generating speech with custom voice for: {text[:50]}...")
+            
+            # Embed the voice prompt (decoded in memory) off the event loop, then generate audio with it
+            conds = await run_blocking(model.get_conditionals, voice_bytes, exaggeration)
+            wav = await wait_for_synthesis(await submit_long(
+                text=text,
+                conds=conds,
+                exaggeration=exaggeration,
+                cfg_weight=cfg_weight,
+                temperature=temperature,
+                repetition_penalty=repetition_penalty,
+                min_p=min_p,
+                top_p=top_p,
+                flow_steps=flow_steps,
+                flow_solver=flow_solver,
+            ), http_request)
+            
+            # Encode the WAV file in memory
+            audio_bytes = await run_blocking(encode_wav, wav, model.sr, subtype="FLOAT")
+            
+            return Response(
+                content=audio_bytes,
+                media_type="audio/wav",
+                headers={"Content-Disposition": "attachment; filename=synthesized_speech.wav"}
+            )
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error during synthesis with voice: {e}")
+            raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
+
+def validate_stream_request(request: TTSStreamRequest):
+    """
+    Validate a streaming request; the same checks as /synthesize plus the stream settings. Returns the sentences to
+    synthesize
+    """
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Text cannot be empty")
+    if len(request.text) > MAX_TEXT_CHARS:
+        raise HTTPException(status_code=400, detail=f"Text too long (max {MAX_TEXT_CHARS} characters)")
+    check_flow_settings(request.flow_steps, request.flow_solver)
+    if request.format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail="format must be wav or pcm")
+    if not 5 <= request.chunk_size <= 200:
+        raise HTTPException(status_code=400, detail="chunk_size must be between 5 and 200")
+    if request.voice_id is not None and request.voice_id not in model.voices:
+        raise HTTPException(status_code=404, detail=f"Unknown voice: {request.voice_id}")
+    sentences = split_sentences(request.text)
+    if len(sentences) > MAX_CHUNKS_PER_REQUEST:
+        raise HTTPException(
+            status_code=400, detail=f"Text too long ({len(sentences)} chunks, max {MAX_CHUNKS_PER_REQUEST})"
         )
-        
-    except Exception as e:
-        print(f"Error during synthesis with voice: {e}")
-        # Clean up on error
-        if 'temp_voice_path' in locals():
+    return sentences
+
+def generate_audio_chunks(request: TTSStreamRequest, sentences):
+    """
+    Blocking generator of PCM16 audio chunks for a streaming request: its sentences (see validate_stream_request)
+    are synthesized one after another with ChatterboxTTS.generate_stream
+    """
+    conds = None
+    if request.voice_id is not None:
+        conds = model.voices.get(request.voice_id, exaggeration=request.exaggeration)
+    for sentence in sentences:
+        for wav in model.generate_stream(
+            sentence,
+            conds=conds,
+            exaggeration=request.exaggeration,
+            cfg_weight=request.cfg_weight,
+            temperature=request.temperature,
+            repetition_penalty=request.repetition_penalty,
+            min_p=request.min_p,
+            top_p=request.top_p,
+            chunk_size=request.chunk_size,
+            flow_steps=request.flow_steps,
+            flow_solver=request.flow_solver,
+        ):
+            yield encode_pcm(wav)
+
+async def iterate_in_stream_executor(chunks):
+    """
+    Run a blocking generator on the stream executor and yield its items. The generator runs at most a few items
+    ahead of the consumer, so a slow client holds back the synthesis instead of having it buffered in memory. When
+    the consumer stops early (e.g. the client disconnected), the generator is closed after its current item, which
+    ends the synthesis
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue(maxsize=4)
+    stop = threading.Event()
+    done = object()
+    
+    def put(item):
+        asyncio.run_coroutine_threadsafe(items.put(item), loop).result()
+    
+    def produce():
+        try:
+            for item in chunks:
+                put(item)
+                if stop.is_set():
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            chunks.close()
+            put(done)
+    
+    loop.run_in_executor(stream_executor, produce)
+    try:
+        while (item := await items.get()) is not done:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock a put waiting for room; after that the producer puts at most its current item and `done`
+        while not items.empty():
+            items.get_nowait()
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse holding a pending request slot (see reserve_request), released when the response ends however
+    it ends, including when the client is gone before the body generator even starts
+    """
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            release_request()
+
+@app.post("/synthesize/stream")
+async def synthesize_stream(request: TTSStreamRequest):
+    """
+    Synthesize speech and stream it as it is generated: the WAV header is sent right away, then PCM16 audio chunks
+    (about chunk_size / 25 seconds each) as the model produces them
+    """
+    if model is None:
+        raise HTTPException(status_code=500, detail="Model not initialized")
+    sentences = validate_stream_request(request)
+    
+    print(f"Streaming speech for: {request.text[:50]}...")
+    
+    async def audio_stream():
+        try:
+            if request.format == "wav":
+                yield wav_header(model.sr)
+            chunks = iterate_in_stream_executor(generate_audio_chunks(request, sentences))
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                await chunks.aclose()
+        except Exception as e:
+            # The status line is already sent, so the client sees a truncated stream
+            print(f"Error during streaming synthesis: {e}")
+    
+    reserve_request()
+    return SlotStreamingResponse(
+        audio_stream(),
+        media_type="audio/wav" if request.format == "wav" else "audio/L16",
+        headers={"X-Sample-Rate": str(model.sr)}
+    )
+
+@app.websocket("/synthesize/ws")
+async def synthesize_websocket(websocket: WebSocket):
+    """
+    Bidirectional streaming synthesis. The client sends JSON messages with the /synthesize/stream fields (format
+    is ignored) at any time; they are queued and synthesized in order. For each one the server replies with
+    {"event": "start", "sample_rate": ...}, binary messages of raw PCM16 little-endian audio as it is generated, then
+    {"event": "end"} (or {"event": "error", "detail": ...}). {"event": "cancel"} stops the current synthesis right
+    away, which is answered with {"event": "cancelled"}; closing the socket stops it too
+    """
+    await websocket.accept()
+    queued = asyncio.Queue()  # messages waiting for synthesis; None once the client is gone
+    current = None  # the task streaming the current synthesis
+    closed = False
+    
+    async def receive_messages():
+        """Read the socket while audio is being sent, so that cancellation and disconnects take effect right away"""
+        nonlocal closed
+        try:
+            while True:
+                message = await websocket.receive_text()
+                try:
+                    is_cancel = json.loads(message).get("event") == "cancel"
+                except (ValueError, AttributeError):
+                    is_cancel = False  # reported as an error when its turn comes
+                if not is_cancel:
+                    queued.put_nowait(message)
+                elif current is not None:
+                    current.cancel()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            closed = True
+            if current is not None:
+                current.cancel()
+            queued.put_nowait(None)
+    
+    async def stream(request: TTSStreamRequest, sentences):
+        try:
+            await websocket.send_json({"event": "start", "sample_rate": model.sr, "format": "pcm_s16le"})
+            chunks = iterate_in_stream_executor(generate_audio_chunks(request, sentences))
+            try:
+                async for chunk in chunks:
+                    await websocket.send_bytes(chunk)
+            finally:
+                await chunks.aclose()
+            await websocket.send_json({"event": "end"})
+        except WebSocketDisconnect:
+            raise
+        except Exception as e:
+            print(f"Error during websocket synthesis: {e}")
+            await websocket.send_json({"event": "error", "status_code": 500, "detail": f"Synthesis failed: {e}"})
+    
+    receiver = asyncio.create_task(receive_messages())
+    try:
+        while (message := await queued.get()) is not None:
+            try:
+                request = TTSStreamRequest(**json.loads(message))
+                sentences = validate_stream_request(request)
+                reserve_request()
+            except HTTPException as e:
+                await websocket.send_json({"event": "error", "status_code": e.status_code, "detail": e.detail})
+                continue
+            except (ValueError, TypeError) as e:
+                await websocket.send_json({"event": "error", "status_code": 400, "detail": str(e)})
+                continue
+            
+            current = asyncio.create_task(stream(request, sentences))
             try:
-                os.unlink(temp_voice_path)
-            except:
-                pass
-        raise HTTPException(status_code=500, detail=f"Synthesis failed: {str(e)}")
+                await asyncio.wait({current})
+            finally:
+                release_request()
+            if current.cancelled():
+                if closed:
+                    break
+                await websocket.send_json({"event": "cancelled"})
+            elif isinstance(current.exception(), WebSocketDisconnect):
+                break
+            current = None
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if current is not None:
+            current.cancel()
+        receiver.cancel()
+
+@app.get("/voices")
+async def list_voices():
+    """
+    List the registered voices that can be selected with voice_id
+    """
+    return {"voices": model.voices.ids()}
+
+@app.post("/voices/{voice_id}")
+async def register_voice(voice_id: str, voice_file: UploadFile = File(...)):
+    """
+    Register (or replace) a voice from a reference clip, so later requests can use it by voice_id
+    """
+    if not re.fullmatch(r"[\w\-]+", voice_id):
+        raise HTTPException(status_code=400, detail="Voice id may only contain letters, digits, '_' and '-'")
+    
+    if not voice_file.filename.lower().endswith(('.wav', '.mp3', '.flac', '.m4a')):
+        raise HTTPException(status_code=400, detail="Voice file must be audio format (wav, mp3, flac, m4a)")
+    
+    try:
+        conds = await run_blocking(model.get_conditionals, await voice_file.read())
+        await run_blocking(model.voices.add, voice_id, conds)
+        return {"message": "Voice registered successfully", "voice_id": voice_id}
+    
+    except Exception as e:
+        print(f"Error registering voice: {e}")
+        raise HTTPException(status_code=500, detail=f"Voice registration failed: {str(e)}")
 
 @app.get("/download_audio/{base64_audio}")
 async def download_audio(base64_audio: str):
@@ -0,0 +1,87 @@
+"""
+In-memory audio encoding and decoding, so that servers can go from a waveform to WAV bytes and from uploaded bytes
+to a waveform without round trips through temporary files.
+"""
+import io
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Tuple, Union
+
+import librosa
+import numpy as np
+import torch
+
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+def encode_pcm(wav: Union[torch.Tensor, np.ndarray], subtype="PCM_16") -> bytes:
+    """
+    Encodes a waveform as raw little-endian samples, with interleaved channels.
+
+    Args:
+        wav: samples in [-1, 1], either (T,) or (channels, T) as returned by `ChatterboxTTS.generate`.
+        subtype: "PCM_16" (clipped to [-1, 1]) or "FLOAT" (32 bit float, lossless).
+    """
+    if torch.is_tensor(wav):
+        wav = wav.detach().float().cpu().numpy()
+    wav = np.atleast_2d(wav)
+    if subtype == "PCM_16":
+        data = (np.clip(wav, -1.0, 1.0) * 32767).round().astype("<i2")
+    elif subtype == "FLOAT":
+        data = wav.astype("<f4")
+    else:
+        raise ValueError(f"Unsupported WAV subtype: {subtype}")
+    return data.T.tobytes()
+
+
+def wav_header(sr: int, n_channels=1, subtype="PCM_16", n_bytes=None) -> bytes:
+    """
+    The header of a WAV file holding `n_bytes` of `encode_pcm` data. If `n_bytes` is None, e.g. when streaming
+    audio of unknown length, the sizes are set to their maximum, which decoders read as "until the end of the
+    stream".
+    """
+    format_tag, sample_width = {"PCM_16": (WAVE_FORMAT_PCM, 2), "FLOAT": (WAVE_FORMAT_IEEE_FLOAT, 4)}[subtype]
+    fmt = struct.pack(
+        "<HHIIHH", format_tag, n_channels, sr, sr * n_channels * sample_width, n_channels * sample_width,
+        8 * sample_width,
+    )
+    data_size = 0xFFFFFFFF if n_bytes is None else n_bytes
+    riff_size = 0xFFFFFFFF if n_bytes is None else 4 + (8 + len(fmt)) + (8 + n_bytes)
+    return b"".join([
+        b"RIFF", struct.pack("<I", riff_size), b"WAVE",
+        b"fmt ", struct.pack("<I", len(fmt)), fmt,
+        b"data", struct.pack("<I", data_size),
+    ])
+
+
+def encode_wav(wav: Union[torch.Tensor, np.ndarray], sr: int, subtype="PCM_16") -> bytes:
+    "Encodes a waveform as the bytes of a WAV file; see `encode_pcm` for the arguments."
+    n_channels = 1 if wav.ndim == 1 else wav.shape[0]
+    data = encode_pcm(wav, subtype)
+    return wav_header(sr, n_channels, subtype, len(data)) + data
+
+
+def load_audio(source: Union[str, os.PathLike, bytes], sr=None) -> Tuple[np.ndarray, int]:
+    """
+    Loads mono audio, resampled to `sr` unless it's None, from a file path or from the contents of an audio file
+    (e.g. an upload). Returns the float32 waveform and its sample rate, like `librosa.load`.
+
+    Bytes are decoded in memory when libsndfile supports the format (WAV, FLAC, OGG, MP3); other formats (e.g. M4A)
+    need an external decoder that only reads files, so they go through a temporary file.
+    """
+    if not isinstance(source, bytes):
+        return librosa.load(source, sr=sr)
+    try:
+        return librosa.load(io.BytesIO(source), sr=sr)
+    except Exception:  # not a format libsndfile can decode
+        pass
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_file.write(source)
+    try:
+        return librosa.load(temp_file.name, sr=sr)
+    finally:
+        Path(temp_file.name).unlink()
@@ -0,0 +1,3 @@
+"""
+Benchmarks, runnable as `python -m chatterbox.bench.<name>`.
+"""
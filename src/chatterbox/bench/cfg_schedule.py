@@ -0,0 +1,129 @@
+"""
+Latency versus quality of classifier-free guidance schedules, for T3 and the S3Gen flow decoder.
+
+    python -m chatterbox.bench.cfg_schedule [--ckpt-dir DIR] [--audio-prompt WAV] [--cfg-tokens 50] [--flow-cfg-steps 5]
+
+Compares full guidance, guidance limited to the first `--cfg-tokens` T3 tokens and `--flow-cfg-steps` flow steps,
+and the guidance-free fast mode. For each schedule it reports the T3 and flow latencies, and two quality proxies
+relative to full guidance:
+- T3: the mean negative log-likelihood of the sampled tokens under the fully guided model (teacher-forced), in
+  nats per token; lower means the output is closer to what full guidance would produce.
+- flow: the mean absolute difference to the fully guided mel-spectrogram of the same tokens (the flow noise is
+  fixed, so this only measures the guidance).
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+import torch
+
+from ..models.s3tokenizer import SPEECH_VOCAB_SIZE, drop_invalid_tokens
+from ..tts import ChatterboxTTS
+
+
+def _timed(fn, device):
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    out = fn()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return out, time.perf_counter() - t0
+
+
+@torch.inference_mode()
+def guided_logits(t3, t3_cond, text_tokens, speech_tokens, cfg_weight):
+    """
+    The fully guided T3 logits predicting each of `speech_tokens` (1D, without BOS) from the previous ones
+    (teacher-forced), with the prompt laid out as in `T3.inference_stream`. Returns (len(speech_tokens), vocab).
+    """
+    hp = t3.hp
+    text_tokens = torch.cat([text_tokens, text_tokens])
+    bos = torch.full((2, 1), hp.start_speech_token, dtype=torch.long, device=t3.device)
+    embeds, _ = t3.prepare_input_embeds(
+        t3_cond=t3_cond, text_tokens=text_tokens, speech_tokens=bos, cfg_weight=cfg_weight,
+    )
+    prev = torch.cat([bos[:1], speech_tokens[None, :-1]], dim=1)  # the extra BOS, then the tokens at 1..n-1
+    pos = torch.arange(prev.size(1), device=t3.device)[None]
+    prev_embeds = t3.speech_emb(prev) + t3.speech_pos_emb.get_fixed_embedding(pos)
+    embeds = torch.cat([embeds, prev_embeds.expand(2, -1, -1)], dim=1)
+
+    logits = t3.backend(inputs_embeds=embeds, use_cache=False, num_logits_to_keep=len(speech_tokens)).logits
+    cond, uncond = logits.float().unbind(0)
+    return cond + cfg_weight * (cond - uncond)
+
+
+def guided_nll(t3, t3_cond, text_tokens, speech_tokens, cfg_weight):
+    "Mean negative log-likelihood of `speech_tokens` under fully guided T3, see `guided_logits`."
+    guided = guided_logits(t3, t3_cond, text_tokens, speech_tokens, cfg_weight)
+    nll = -guided.log_softmax(dim=-1).gather(1, speech_tokens[:, None])
+    return nll.mean().item()
+
+
+def run_schedule(model: ChatterboxTTS, conds, text, *, cfg_weight, cfg_tokens, flow_cfg_rate, flow_cfg_steps, seed=0):
+    "Synthesizes `text` with one guidance schedule; returns the speech tokens, the mel and the two latencies."
+    text_tokens = model._tokenize_text(text)
+    if cfg_weight > 0.0:
+        text_tokens = torch.cat([text_tokens, text_tokens])
+    device = str(model.device)
+
+    torch.manual_seed(seed)
+    speech_tokens, t3_time = _timed(lambda: model.t3.inference(
+        t3_cond=conds.t3, text_tokens=text_tokens, cfg_weight=cfg_weight, cfg_tokens=cfg_tokens,
+    )[0], device)
+    speech_tokens = drop_invalid_tokens(speech_tokens)
+    speech_tokens = speech_tokens[speech_tokens < SPEECH_VOCAB_SIZE]
+
+    mel, flow_time = _timed(lambda: model.s3gen.flow_inference(
+        speech_tokens, ref_dict=conds.gen, finalize=True, cfg_rate=flow_cfg_rate, cfg_steps=flow_cfg_steps,
+    ), device)
+    return speech_tokens, mel, t3_time, flow_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ckpt-dir", type=Path, default=None, help="local checkpoint (default: download it)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--audio-prompt", default=None, help="reference voice (default: the built-in voice)")
+    parser.add_argument("--text", default="The quick brown fox jumps over the lazy dog, then takes a long nap in the sun.")
+    parser.add_argument("--cfg-weight", type=float, default=0.5)
+    parser.add_argument("--cfg-tokens", type=int, default=50)
+    parser.add_argument("--flow-cfg-steps", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3, help="seeds per schedule")
+    args = parser.parse_args()
+
+    if args.ckpt_dir is not None:
+        model = ChatterboxTTS.from_local(args.ckpt_dir, args.device)
+    else:
+        model = ChatterboxTTS.from_pretrained(args.device)
+    conds = model.get_conditionals(args.audio_prompt) if args.audio_prompt else model.conds
+    text_tokens = model._tokenize_text(args.text)
+
+    schedules = {
+        "full guidance": dict(cfg_weight=args.cfg_weight, cfg_tokens=None, flow_cfg_rate=None, flow_cfg_steps=None),
+        f"first {args.cfg_tokens} tokens / {args.flow_cfg_steps} steps": dict(
+            cfg_weight=args.cfg_weight, cfg_tokens=args.cfg_tokens, flow_cfg_rate=None, flow_cfg_steps=args.flow_cfg_steps,
+        ),
+        "fast (no guidance)": dict(cfg_weight=0.0, cfg_tokens=None, flow_cfg_rate=0.0, flow_cfg_steps=None),
+    }
+    run_schedule(model, conds, args.text, **schedules["full guidance"])  # warm up
+
+    print(f"{'schedule':<32} {'T3 ms/token':>12} {'flow ms':>9} {'T3 guided NLL':>14} {'mel L1':>8}")
+    for name, schedule in schedules.items():
+        ms_per_token, flow_ms, nlls, mel_l1s = [], [], [], []
+        for seed in range(args.repeats):
+            speech_tokens, mel, t3_time, flow_time = run_schedule(model, conds, args.text, seed=seed, **schedule)
+            ref_mel = model.s3gen.flow_inference(speech_tokens, ref_dict=conds.gen, finalize=True)
+            ms_per_token.append(1000 * t3_time / max(len(speech_tokens), 1))
+            flow_ms.append(1000 * flow_time)
+            nlls.append(guided_nll(model.t3, conds.t3, text_tokens, speech_tokens, args.cfg_weight))
+            mel_l1s.append((mel - ref_mel).abs().mean().item())
+        print(
+            f"{name:<32} {statistics.median(ms_per_token):12.1f} {statistics.median(flow_ms):9.1f} "
+            f"{statistics.mean(nlls):14.3f} {statistics.mean(mel_l1s):8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Cold-start profile: import time and time to first audio, by phase.
+
+    python -m chatterbox.bench.startup [--ckpt-dir DIR] [--device cpu] [--audio-prompt WAV] [--json]
+
+Each measurement runs in a fresh interpreter, since `chatterbox` is already imported by the time this module runs:
+- imports: `python -X importtime -c "import chatterbox.tts"`, as the total and the time spent in the modules of
+  each top-level package (so a package's share doesn't depend on which module happens to import it first);
+- time to first audio: importing torch and `chatterbox.tts`, loading the model (`from_local`, or `from_pretrained`
+  which also checks the Hub), building the conditionals of `--audio-prompt` (skipped for the built-in voice), then
+  T3, S3Gen and the watermark for one sentence.
+Files are read from the page cache after the first run; drop it (or reboot the pod) for truly cold numbers. `--json`
+prints the numbers as one JSON object, for tracking regressions.
+"""
+import argparse
+import json
+import subprocess
+import sys
+from collections import Counter
+from pathlib import Path
+
+import torch
+
+
+# Runs in a fresh interpreter, see `time_to_first_audio`
+_FIRST_AUDIO_SCRIPT = """
+import json, sys, time
+args = json.loads(sys.argv[1])
+phases = {}
+t0 = time.perf_counter()
+def phase(name):
+    global t0
+    t = time.perf_counter()
+    phases[name] = t - t0
+    t0 = t
+
+import torch
+phase("import torch")
+from chatterbox.tts import ChatterboxTTS
+phase("import chatterbox.tts")
+
+if args["ckpt_dir"] is not None:
+    model = ChatterboxTTS.from_local(args["ckpt_dir"], args["device"])
+else:
+    model = ChatterboxTTS.from_pretrained(args["device"])
+phase("load model")
+if args["audio_prompt"] is not None:
+    conds = model.get_conditionals(args["audio_prompt"])
+    phase("conditionals")
+else:
+    conds = model.conds
+
+from chatterbox.models.s3tokenizer import drop_invalid_tokens, SPEECH_VOCAB_SIZE
+with torch.inference_mode():
+    text_tokens = model._tokenize_text(args["text"])
+    speech_tokens = model.t3.inference(
+        t3_cond=conds.t3, text_tokens=torch.cat([text_tokens, text_tokens]), max_new_tokens=args["max_new_tokens"],
+        cfg_weight=0.5,
+    )[0]
+    speech_tokens = drop_invalid_tokens(speech_tokens)
+    speech_tokens = speech_tokens[speech_tokens < SPEECH_VOCAB_SIZE].to(model.device)
+    phase("T3")
+    wav, _ = model.s3gen.inference(speech_tokens=speech_tokens, ref_dict=conds.gen)
+    phase("S3Gen")
+    model.watermarker.apply_watermark(wav.squeeze(0).cpu().numpy(), sample_rate=model.sr)
+    phase("watermark")
+print(json.dumps(phases))
+"""
+
+
+def import_times(module="chatterbox.tts"):
+    "Import time of `module` in a fresh interpreter: the total, and the time per top-level package, in seconds."
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True,
+    ).stderr
+    total, per_package = 0.0, Counter()
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if name.strip() == module and len(name) - len(name.lstrip()) == 1:
+            total = int(cumulative_us) / 1e6
+        per_package[name.strip().split(".")[0]] += int(self_us) / 1e6
+    return total, dict(per_package)
+
+
+def time_to_first_audio(ckpt_dir, device, audio_prompt, text, max_new_tokens):
+    "Seconds per phase, from the start of a fresh interpreter to the first watermarked waveform."
+    args = dict(
+        ckpt_dir=str(ckpt_dir) if ckpt_dir is not None else None, device=device, audio_prompt=audio_prompt,
+        text=text, max_new_tokens=max_new_tokens,
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", _FIRST_AUDIO_SCRIPT, json.dumps(args)], capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ckpt-dir", type=Path, default=None, help="local checkpoint (default: download it)")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--audio-prompt", default=None, help="reference voice (default: the built-in voice)")
+    parser.add_argument("--text", default="Hello, this is the first sentence after a cold start.")
+    parser.add_argument("--max-new-tokens", type=int, default=1000)
+    parser.add_argument("--top", type=int, default=10, help="number of packages to list by import time")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    import_total, per_package = import_times()
+    phases = time_to_first_audio(args.ckpt_dir, args.device, args.audio_prompt, args.text, args.max_new_tokens)
+    top_packages = sorted(per_package.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            "import chatterbox.tts": import_total,
+            "import time by package": dict(top_packages),
+            "time to first audio": phases,
+        }))
+        return
+
+    print(f"import chatterbox.tts: {1000 * import_total:.0f} ms, of which")
+    for package, seconds in top_packages:
+        print(f"  {package:<28} {1000 * seconds:8.0f} ms")
+    print("time to first audio:")
+    for name, seconds in phases.items():
+        print(f"  {name:<28} {1000 * seconds:8.0f} ms")
+    print(f"  {'total':<28} {1000 * sum(phases.values()):8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Speed and fidelity of T3 with int8 weights (`T3.quantize_int8`) against fp32, on CPU.
+
+    python -m chatterbox.bench.t3_int8 [--ckpt-dir DIR] [--max-new-tokens 200] [--save t3_cfg_int8.safetensors]
+
+For both models it reports the weight size and the sampling speed in tokens per second, with the same seeds. The
+int8 model is compared to fp32 with two token agreement metrics:
+- teacher-forced: the fraction of positions of the fp32 samples where both models' guided logits have the same
+  argmax (1.0 means identical greedy predictions);
+- free-running: the mean number of tokens sampled with the same seed before the two models first disagree.
+With `--save`, the quantized weights are written as safetensors, for `ChatterboxTTS.from_local(..., t3_int8=True)`
+(as `t3_cfg_int8.safetensors` in the checkpoint directory).
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+import torch
+from safetensors.torch import save_file
+
+from ..models.t3.inference.quantize import int8_state_dict
+from ..tts import ChatterboxTTS
+from .cfg_schedule import guided_logits
+
+
+def _weight_bytes(state_dict):
+    return sum(t.numel() * t.element_size() for t in state_dict.values())
+
+
+def sample(t3, t3_cond, text_tokens, *, cfg_weight, max_new_tokens, seed):
+    "Samples speech tokens with a fixed seed; returns them (1D) and the sampling time in seconds."
+    torch.manual_seed(seed)
+    t0 = time.perf_counter()
+    speech_tokens = t3.inference(
+        t3_cond=t3_cond, text_tokens=torch.cat([text_tokens, text_tokens]), max_new_tokens=max_new_tokens,
+        cfg_weight=cfg_weight,
+    )[0]
+    return speech_tokens, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ckpt-dir", type=Path, default=None, help="local checkpoint (default: download it)")
+    parser.add_argument("--text", default="The quick brown fox jumps over the lazy dog, then takes a long nap in the sun.")
+    parser.add_argument("--cfg-weight", type=float, default=0.5)
+    parser.add_argument("--max-new-tokens", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3, help="seeds per model")
+    parser.add_argument("--save", type=Path, default=None, help="write the int8 weights to this safetensors file")
+    args = parser.parse_args()
+
+    if args.ckpt_dir is not None:
+        model = ChatterboxTTS.from_local(args.ckpt_dir, "cpu")
+    else:
+        model = ChatterboxTTS.from_pretrained("cpu")
+    t3, t3_cond = model.t3, model.conds.t3
+    text_tokens = model._tokenize_text(args.text)
+    kwargs = dict(cfg_weight=args.cfg_weight, max_new_tokens=args.max_new_tokens)
+
+    results = {}
+    for name in ["fp32", "int8"]:
+        if name == "int8":
+            t3.quantize_int8()
+            weight_bytes = _weight_bytes(int8_state_dict(t3))
+        else:
+            weight_bytes = _weight_bytes(t3.state_dict())
+        sample(t3, t3_cond, text_tokens, seed=0, **kwargs)  # warm up
+        samples, tokens_per_second = [], []
+        for seed in range(args.repeats):
+            speech_tokens, seconds = sample(t3, t3_cond, text_tokens, seed=seed, **kwargs)
+            samples.append(speech_tokens)
+            tokens_per_second.append(len(speech_tokens) / seconds)
+        results[name] = dict(weight_bytes=weight_bytes, samples=samples, tokens_per_second=tokens_per_second)
+        if name == "fp32":
+            # the fp32 predictions on its own samples, for the teacher-forced agreement
+            fp32_argmax = [
+                guided_logits(t3, t3_cond, text_tokens, tokens, args.cfg_weight).argmax(dim=-1) for tokens in samples
+            ]
+
+    int8_argmax = [
+        guided_logits(t3, t3_cond, text_tokens, tokens, args.cfg_weight).argmax(dim=-1)
+        for tokens in results["fp32"]["samples"]
+    ]
+    teacher_forced = torch.cat([a == b for a, b in zip(fp32_argmax, int8_argmax)]).float().mean().item()
+    first_disagreements = []
+    for fp32_tokens, int8_tokens in zip(results["fp32"]["samples"], results["int8"]["samples"]):
+        n = min(len(fp32_tokens), len(int8_tokens))
+        disagree = (fp32_tokens[:n] != int8_tokens[:n]).nonzero()
+        first_disagreements.append(disagree[0, 0].item() if len(disagree) else n)
+
+    print(f"{'model':<6} {'weights MB':>11} {'tokens/s':>9}")
+    for name, result in results.items():
+        print(f"{name:<6} {result['weight_bytes'] / 2**20:11.0f} {statistics.median(result['tokens_per_second']):9.1f}")
+    print(f"teacher-forced argmax agreement: {teacher_forced:.3f}")
+    print(f"tokens before the first disagreement (same seed): {statistics.mean(first_disagreements):.1f}")
+
+    if args.save is not None:
+        save_file(int8_state_dict(t3), args.save)
+        print(f"Saved the int8 weights to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Fixed per-request overhead of T3 inference, for short utterances.
+
+    python -m chatterbox.bench.t3_overhead [--ckpt-dir DIR] [--device cpu] [--compile]
+
+Reports the setup costs that used to be paid on every `T3.inference` call: building a `T3HuggingfaceBackend`
+(now done once at load) and allocating the KV cache (now reused from an idle pool), then the end-to-end latency
+of a short `T3.inference` call, optionally with the per-token forward compiled (`T3.compile_decode_step`).
+Without `--ckpt-dir` the weights are random, which is fine for timing.
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+import torch
+from safetensors.torch import load_file
+
+from ..models.t3 import T3
+from ..models.t3.modules.cond_enc import T3Cond
+
+
+def _timeit(fn, repeats, device):
+    times = []
+    for _ in range(repeats):
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        t0 = time.perf_counter()
+        fn()
+        if device.startswith("cuda"):
+            torch.cuda.synchronize()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ckpt-dir", type=Path, default=None, help="directory with t3_cfg.safetensors")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--text-len", type=int, default=20, help="number of text tokens")
+    parser.add_argument("--max-new-tokens", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--compile", action="store_true", help="also time with `T3.compile_decode_step`")
+    args = parser.parse_args()
+
+    t3 = T3()
+    if args.ckpt_dir is not None:
+        t3_state = load_file(args.ckpt_dir / "t3_cfg.safetensors")
+        if "model" in t3_state.keys():
+            t3_state = t3_state["model"][0]
+        t3.load_state_dict(t3_state)
+    t3.to(args.device).eval()
+    hp = t3.hp
+
+    t3_cond = T3Cond(
+        speaker_emb=torch.randn(1, hp.speaker_embed_size),
+        cond_prompt_speech_tokens=torch.randint(0, 6561, (1, hp.speech_cond_prompt_len)),
+        emotion_adv=0.5 * torch.ones(1, 1, 1),
+    ).to(device=args.device)
+    text_tokens = torch.randint(1, 100, (1, args.text_len))
+    text_tokens[:, 0], text_tokens[:, -1] = hp.start_text_token, hp.stop_text_token
+    text_tokens = torch.cat([text_tokens, text_tokens]).to(args.device)  # CFG
+
+    def infer():
+        with torch.inference_mode():
+            t3.inference(t3_cond=t3_cond, text_tokens=text_tokens, max_new_tokens=args.max_new_tokens, cfg_weight=0.5)
+
+    cache_len = hp.speech_cond_prompt_len + args.text_len + 1000
+    alloc_cache = lambda: t3._acquire_cache(2, cache_len + 256, torch.float32, torch.device(args.device))
+    reuse_cache = lambda: t3._release_cache(t3._acquire_cache(2, cache_len, torch.float32, torch.device(args.device)))
+
+    infer()  # warm up
+    reuse_cache()  # leaves an idle cache of this shape in the pool
+    timings = {
+        "backend construction": _timeit(t3._build_backend, args.repeats, args.device),
+        "kv cache allocation": _timeit(alloc_cache, args.repeats, args.device),
+        "kv cache reuse": _timeit(reuse_cache, args.repeats, args.device),
+        f"inference, {args.max_new_tokens} tokens": _timeit(infer, args.repeats, args.device),
+    }
+    if args.compile:
+        t3.compile_decode_step()
+        infer()  # compile
+        timings[f"inference, {args.max_new_tokens} tokens, compiled"] = _timeit(infer, args.repeats, args.device)
+
+    for name, seconds in timings.items():
+        print(f"{name:<36} {1000 * seconds:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
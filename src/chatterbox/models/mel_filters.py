@@ -0,0 +1,51 @@
+"""
+Mel filterbanks for the feature extractors of the S3 tokenizer, S3Gen and the voice encoder.
+
+`mel_filters` gives the same matrix as `librosa.filters.mel` (Slaney mel scale and normalization), computed with
+numpy alone and cached per configuration: the first call into `librosa.filters` imports most of scipy, which was a
+large part of the model construction time.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+_F_SP = 200.0 / 3  # Hz per mel below 1 kHz
+_MIN_LOG_HZ = 1000.0
+_MIN_LOG_MEL = _MIN_LOG_HZ / _F_SP
+_LOGSTEP = np.log(6.4) / 27.0
+
+
+def hz_to_mel(freqs):
+    freqs = np.asanyarray(freqs, dtype=np.float64)
+    mels = freqs / _F_SP
+    log_t = freqs >= _MIN_LOG_HZ
+    return np.where(log_t, _MIN_LOG_MEL + np.log(np.maximum(freqs, _MIN_LOG_HZ) / _MIN_LOG_HZ) / _LOGSTEP, mels)
+
+
+def mel_to_hz(mels):
+    mels = np.asanyarray(mels, dtype=np.float64)
+    freqs = _F_SP * mels
+    log_t = mels >= _MIN_LOG_MEL
+    return np.where(log_t, _MIN_LOG_HZ * np.exp(_LOGSTEP * (mels - _MIN_LOG_MEL)), freqs)
+
+
+@lru_cache()
+def mel_filters(sr, n_fft, n_mels=128, fmin=0.0, fmax=None) -> np.ndarray:
+    "(n_mels, 1 + n_fft // 2) float32 filterbank, equal to `librosa.filters.mel` with the same arguments. Read-only."
+    if fmax is None:
+        fmax = float(sr) / 2
+    fftfreqs = np.fft.rfftfreq(n=n_fft, d=1.0 / sr)
+    mel_f = mel_to_hz(np.linspace(hz_to_mel(fmin), hz_to_mel(fmax), n_mels + 2))
+    fdiff = np.diff(mel_f)
+    ramps = np.subtract.outer(mel_f, fftfreqs)
+
+    weights = np.zeros((n_mels, 1 + n_fft // 2), dtype=np.float32)
+    for i in range(n_mels):
+        # lower and upper slopes of the triangle of band i
+        lower = -ramps[i] / fdiff[i]
+        upper = ramps[i + 2] / fdiff[i + 1]
+        weights[i] = np.maximum(0, np.minimum(lower, upper))
+    weights *= (2.0 / (mel_f[2:n_mels + 2] - mel_f[:n_mels]))[:, None]  # Slaney normalization (constant energy)
+    weights.flags.writeable = False
+    return weights
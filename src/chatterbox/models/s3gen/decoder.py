@@ -230,7 +230,34 @@ class ConditionalDecoder(nn.Module):
                 if m.bias is not None:
                     nn.init.constant_(m.bias, 0)
 
-    def forward(self, x, mask, mu, t, spks=None, cond=None):
+    def prepare(self, mask, mu, spks=None, cond=None):
+        """The step-invariant part of `forward`, which an ODE solver computes once and passes to every step.
+
+        Args:
+            mask, mu, spks, cond: as in `forward`.
+
+        Returns:
+            dict with the conditioning channels packed after `x`, and the mask and attention bias of every
+            resolution (the mid and up blocks reuse the down blocks' ones).
+        """
+        cond_channels = [mu]
+        if spks is not None:
+            cond_channels.append(repeat(spks, "b c -> b c t", t=mu.shape[-1]))
+        if cond is not None:
+            cond_channels.append(cond)
+
+        masks = [mask]
+        for _ in self.down_blocks[:-1]:
+            masks.append(masks[-1][:, :, ::2])
+        attn_biases = []
+        for level_mask in masks:
+            attn_mask = add_optional_chunk_mask(
+                level_mask.transpose(1, 2), level_mask.bool(), False, False, 0, self.static_chunk_size, -1,
+            )
+            attn_biases.append(mask_to_bias(attn_mask == 1, mu.dtype))
+        return dict(cond_channels=pack(cond_channels, "b * t")[0], masks=masks, attn_biases=attn_biases)
+
+    def forward(self, x, mask, mu, t, spks=None, cond=None, static=None):
         """Forward pass of the UNet1DConditional model.
 
         Args:
@@ -239,6 +266,7 @@ class ConditionalDecoder(nn.Module):
             t (_type_): shape (batch_size)
             spks (_type_, optional): shape: (batch_size, condition_channels). Defaults to None.
             cond (_type_, optional): placeholder for future use. Defaults to None.
+            static (dict, optional): `prepare(mask, mu, spks, cond)`, if already computed.
 
         Raises:
             ValueError: _description_
@@ -247,27 +275,19 @@ class ConditionalDecoder(nn.Module):
         Returns:
             _type_: _description_
         """
+        if static is None:
+            static = self.prepare(mask, mu, spks, cond)
+        masks, attn_biases = static["masks"], static["attn_biases"]
 
-        t = self.time_embeddings(t).to(t.dtype)
+        t = self.time_embeddings(t).to(x.dtype)
         t = self.time_mlp(t)
 
-        x = pack([x, mu], "b * t")[0]
-
-        if spks is not None:
-            spks = repeat(spks, "b c -> b c t", t=x.shape[-1])
-            x = pack([x, spks], "b * t")[0]
-        if cond is not None:
-            x = pack([x, cond], "b * t")[0]
+        x = pack([x, static["cond_channels"]], "b * t")[0]
 
         hiddens = []
-        masks = [mask]
-        for resnet, transformer_blocks, downsample in self.down_blocks:
-            mask_down = masks[-1]
+        for mask_down, attn_mask, (resnet, transformer_blocks, downsample) in zip(masks, attn_biases, self.down_blocks):
             x = resnet(x, mask_down, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            # attn_mask = torch.matmul(mask_down.transpose(1, 2).contiguous(), mask_down)
-            attn_mask = add_optional_chunk_mask(x, mask_down.bool(), False, False, 0, self.static_chunk_size, -1)
-            attn_mask = mask_to_bias(attn_mask == 1, x.dtype)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -277,16 +297,11 @@ class ConditionalDecoder(nn.Module):
             x = rearrange(x, "b t c -> b c t").contiguous()
             hiddens.append(x)  # Save hidden states for skip connections
             x = downsample(x * mask_down)
-            masks.append(mask_down[:, :, ::2])
-        masks = masks[:-1]
-        mask_mid = masks[-1]
+        mask_mid, attn_mask = masks[-1], attn_biases[-1]
 
         for resnet, transformer_blocks in self.mid_blocks:
             x = resnet(x, mask_mid, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            # attn_mask = torch.matmul(mask_mid.transpose(1, 2).contiguous(), mask_mid)
-            attn_mask = add_optional_chunk_mask(x, mask_mid.bool(), False, False, 0, self.static_chunk_size, -1)
-            attn_mask = mask_to_bias(attn_mask == 1, x.dtype)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
@@ -295,15 +310,11 @@ class ConditionalDecoder(nn.Module):
                 )
             x = rearrange(x, "b t c -> b c t").contiguous()
 
-        for resnet, transformer_blocks, upsample in self.up_blocks:
-            mask_up = masks.pop()
+        for mask_up, attn_mask, (resnet, transformer_blocks, upsample) in zip(masks[::-1], attn_biases[::-1], self.up_blocks):
             skip = hiddens.pop()
             x = pack([x[:, :, :skip.shape[-1]], skip], "b * t")[0]
             x = resnet(x, mask_up, t)
             x = rearrange(x, "b c t -> b t c").contiguous()
-            # attn_mask = torch.matmul(mask_up.transpose(1, 2).contiguous(), mask_up)
-            attn_mask = add_optional_chunk_mask(x, mask_up.bool(), False, False, 0, self.static_chunk_size, -1)
-            attn_mask = mask_to_bias(attn_mask == 1, x.dtype)
             for transformer_block in transformer_blocks:
                 x = transformer_block(
                     hidden_states=x,
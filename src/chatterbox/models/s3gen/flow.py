@@ -77,6 +77,10 @@ class MaskedDiffWithXvec(torch.nn.Module):
         self.length_regulator = length_regulator
         self.only_mask_loss = only_mask_loss
 
+    @property
+    def dtype(self):
+        return self.spk_embed_affine_layer.weight.dtype
+
     def forward(
             self,
             batch: dict,
@@ -131,9 +135,8 @@ class MaskedDiffWithXvec(torch.nn.Module):
                   prompt_feat_len,
                   embedding,
                   flow_cache):
-        if self.fp16 is True:
-            prompt_feat = prompt_feat.half()
-            embedding = embedding.half()
+        prompt_feat = prompt_feat.to(self.dtype)
+        embedding = embedding.to(self.dtype)
 
         assert token.shape[0] == 1
         # xvec projection
@@ -230,8 +233,10 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
         self.token_mel_ratio = token_mel_ratio
         self.pre_lookahead_len = pre_lookahead_len
 
-        # FIXME: this was missing - just putting it in as false
-        self.fp16 = False
+    @property
+    def dtype(self):
+        "The dtype the flow runs in (e.g. bf16, see `ChatterboxTTS.from_local`); the fp32 prompt is cast to it."
+        return self.spk_embed_affine_layer.weight.dtype
 
     @torch.inference_mode()
     def inference(self,
@@ -242,41 +247,167 @@ class CausalMaskedDiffWithXvec(torch.nn.Module):
                   prompt_feat,
                   prompt_feat_len,
                   embedding,
-                  finalize):
-        if self.fp16 is True:
-            prompt_feat = prompt_feat.half()
-            embedding = embedding.half()
+                  finalize,
+                  n_timesteps=10,
+                  solver=None,
+                  cfg_rate=None,
+                  cfg_steps=None):
+        """
+        Generates the mel-spectrograms of a batch of utterances, each with its own prompt and speaker: `token`
+        (B, T) and `prompt_token` (B, T_p) are padded on the right with their lengths in `token_len` and
+        `prompt_token_len`, `prompt_feat` (B, T_mel_p, 80) likewise with `prompt_feat_len` (None if B == 1), and
+        `embedding` is (B, 192). The encoder, the flow decoder (2B rows with guidance) and their masks all work on
+        the padded batch; both are causal or masked, so a row's mel doesn't depend on the others.
 
-        assert token.shape[0] == 1
+        Returns the generated mel frames (B, 80, T_mel), padded on the right, and their lengths (B,).
+        """
+        prompt_feat = prompt_feat.to(self.dtype)
+        embedding = embedding.to(self.dtype)
+
+        B = token.size(0)
+        if prompt_feat_len is None:
+            assert B == 1, "prompt_feat_len is required for batches"
+            prompt_feat_len = torch.tensor([prompt_feat.size(1)])
+        prompt_token_len = prompt_token_len.to(token.device)
+        token_len = token_len.to(token.device)
         # xvec projection
         embedding = F.normalize(embedding, dim=1)
         embedding = self.spk_embed_affine_layer(embedding)
 
-        # concat text and prompt_text
-        token, token_len = torch.concat([prompt_token, token], dim=1), prompt_token_len + token_len
+        # concat text and prompt_text, per row
+        if B == 1:
+            token = torch.concat([prompt_token, token], dim=1)
+        else:
+            token = torch.nn.utils.rnn.pad_sequence([
+                torch.concat([prompt_token[i, :prompt_token_len[i]], token[i, :token_len[i]]])
+                for i in range(B)
+            ], batch_first=True)
+        token_len = prompt_token_len + token_len
         mask = (~make_pad_mask(token_len)).unsqueeze(-1).to(embedding)
         token = self.input_embedding(torch.clamp(token, min=0)) * mask
 
         # text encode
-        h, h_lengths = self.encoder(token, token_len)
+        h, h_masks = self.encoder(token, token_len)
+        h_len = h_masks.squeeze(1).sum(dim=1)
         if finalize is False:
-            h = h[:, :-self.pre_lookahead_len * self.token_mel_ratio]
-        mel_len1, mel_len2 = prompt_feat.shape[1], h.shape[1] - prompt_feat.shape[1]
+            h_len = h_len - self.pre_lookahead_len * self.token_mel_ratio
+            h = h[:, :int(h_len.max())]
+        mel_len1 = prompt_feat_len.to(h_len.device)
+        mel_len2 = h_len - mel_len1
         h = self.encoder_proj(h)
 
         # get conditions
-        conds = torch.zeros([1, mel_len1 + mel_len2, self.output_size], device=token.device).to(h.dtype)
-        conds[:, :mel_len1] = prompt_feat
+        conds = torch.zeros([B, h.size(1), self.output_size], device=token.device).to(h.dtype)
+        for i in range(B):
+            conds[i, :mel_len1[i]] = prompt_feat[i, :mel_len1[i]]
         conds = conds.transpose(1, 2)
 
-        mask = (~make_pad_mask(torch.tensor([mel_len1 + mel_len2]))).to(h)
+        mask = (~make_pad_mask(h_len, h.size(1))).to(h)
         feat, _ = self.decoder(
             mu=h.transpose(1, 2).contiguous(),
             mask=mask.unsqueeze(1),
             spks=embedding,
             cond=conds,
-            n_timesteps=10
+            n_timesteps=n_timesteps,
+            solver=solver,
+            cfg_rate=cfg_rate,
+            cfg_steps=cfg_steps,
         )
-        feat = feat[:, :, mel_len1:]
-        assert feat.shape[2] == mel_len2
-        return feat.float(), None  # NOTE jrm: why are they returning None here?
+        if B == 1:
+            feat = feat[:, :, int(mel_len1[0]):]
+        else:
+            # drop each row's prompt frames, keeping the rows left-aligned
+            feat = torch.nn.utils.rnn.pad_sequence([
+                feat[i, :, mel_len1[i]:h_len[i]].T for i in range(B)
+            ], batch_first=True).transpose(1, 2)
+        assert feat.shape[2] == mel_len2.max()
+        return feat.float(), mel_len2
+
+    @torch.inference_mode()
+    def inference_incremental(self,
+                              token,
+                              prompt_token,
+                              prompt_token_len,
+                              prompt_feat,
+                              prompt_feat_len,
+                              embedding,
+                              cache=None,
+                              finalize=False,
+                              n_timesteps=10,
+                              solver=None,
+                              cfg_rate=None,
+                              cfg_steps=None,
+                              context_len=50):
+        """
+        Incremental version of `inference` for streaming token input: `token` holds the tokens that follow the ones
+        passed to the previous calls, and `cache` is what the previous call returned (None for the first one).
+
+        The encoder runs chunk by chunk on the new tokens with cached attention state (see
+        `UpsampleConformerEncoder.forward_chunk`), and the flow decoder only solves the new mel frames, conditioned
+        on the prompt mel and on the last `context_len` generated frames. Each call therefore costs the same however
+        long the utterance already is, whereas `inference` on growing token prefixes is quadratic. The mel frames
+        differ from `inference`'s: the encoder doesn't see future chunks, and the decoder only sees the context.
+
+        Returns the mel frames of the new tokens (if not `finalize`, the last `pre_lookahead_len` tokens only serve
+        as lookahead and are decoded by the next call), and the cache for the next call.
+        """
+        assert token.shape[0] == 1
+        if cache is None:
+            prompt_feat = prompt_feat.to(self.dtype)
+            embedding = embedding.to(self.dtype)
+            # xvec projection
+            embedding = F.normalize(embedding, dim=1)
+            embedding = self.spk_embed_affine_layer(embedding)
+            cache = dict(
+                spks=embedding,
+                prompt_feat=prompt_feat,
+                encoder=None,
+                n_tokens=0,  # tokens passed so far, including the prompt
+                mu=prompt_feat.new_zeros(1, 0, self.output_size),  # encoder output of the whole utterance
+                mel=prompt_feat.new_zeros(1, self.output_size, 0),  # the last generated frames
+                n_mel=0,  # frames generated so far
+            )
+            token = torch.concat([prompt_token, token], dim=1)
+        prompt_feat = cache["prompt_feat"]
+
+        # text encode
+        h, encoder_cache = self.encoder.forward_chunk(
+            self.input_embedding(torch.clamp(token, min=0)), cache["encoder"], finalize=finalize,
+        )
+        mu = torch.concat([cache["mu"], self.encoder_proj(h)], dim=1)
+        cache = dict(cache, encoder=encoder_cache, n_tokens=cache["n_tokens"] + token.size(1), mu=mu)
+        mel_len1 = prompt_feat.shape[1]
+        start, end = mel_len1 + cache["n_mel"], mu.size(1)
+        if end <= start:
+            return mu.new_zeros(1, self.output_size, 0).float(), cache
+
+        # the window to solve: the prompt, the context, and the new frames
+        context_start = max(start - context_len, mel_len1)
+        frame_ids = torch.cat([torch.arange(mel_len1), torch.arange(context_start, end)]).to(mu.device)
+        n_context = start - context_start
+
+        # get conditions
+        conds = torch.zeros([1, len(frame_ids), self.output_size], device=mu.device).to(mu.dtype)
+        conds[:, :mel_len1] = prompt_feat
+        conds = conds.transpose(1, 2)
+        if n_context > 0:
+            conds[:, :, mel_len1:mel_len1 + n_context] = cache["mel"][:, :, -n_context:]
+
+        mask = torch.ones(1, 1, len(frame_ids), device=mu.device, dtype=mu.dtype)
+        feat, _ = self.decoder(
+            mu=mu[:, frame_ids].transpose(1, 2).contiguous(),
+            mask=mask,
+            spks=cache["spks"],
+            cond=conds,
+            n_timesteps=n_timesteps,
+            solver=solver,
+            cfg_rate=cfg_rate,
+            cfg_steps=cfg_steps,
+            frame_ids=frame_ids,
+        )
+        feat = feat[:, :, mel_len1 + n_context:]
+        assert feat.shape[2] == end - start
+        mel = torch.concat([cache["mel"], feat.to(mu.dtype)], dim=2)
+        cache["mel"] = mel[:, :, max(mel.shape[2] - context_len, 0):]
+        cache["n_mel"] += feat.shape[2]
+        return feat.float(), cache
@@ -18,6 +18,9 @@ from .matcha.flow_matching import BASECFM
 from .configs import CFM_PARAMS
 
 
+SOLVERS = ("euler", "heun", "midpoint", "multistep")
+
+
 class ConditionalCFM(BASECFM):
     def __init__(self, in_channels, cfm_params, n_spks=1, spk_emb_dim=64, estimator: torch.nn.Module = None):
         super().__init__(
@@ -35,7 +38,7 @@ class ConditionalCFM(BASECFM):
         self.lock = threading.Lock()
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, prompt_len=0, flow_cache=torch.zeros(1, 80, 0, 2)):
+    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, prompt_len=0, flow_cache=torch.zeros(1, 80, 0, 2), solver=None, cfg_rate=None, cfg_steps=None):
         """Forward diffusion
 
         Args:
@@ -43,11 +46,12 @@ class ConditionalCFM(BASECFM):
                 shape: (batch_size, n_feats, mel_timesteps)
             mask (torch.Tensor): output_mask
                 shape: (batch_size, 1, mel_timesteps)
-            n_timesteps (int): number of diffusion steps
+            n_timesteps (int): number of ODE steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            solver, cfg_rate, cfg_steps: see `solve`
 
         Returns:
             sample: generated mel-spectrogram
@@ -67,11 +71,15 @@ class ConditionalCFM(BASECFM):
         t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=mu.dtype)
         if self.t_scheduler == 'cosine':
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
-        return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond), flow_cache
+        return self.solve(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, solver=solver, cfg_rate=cfg_rate, cfg_steps=cfg_steps), flow_cache
 
-    def solve_euler(self, x, t_span, mu, mask, spks, cond):
+    def solve_euler(self, x, t_span, mu, mask, spks, cond, cfg_rate=None, cfg_steps=None):
+        "Fixed euler solver for ODEs, see `solve`."
+        return self.solve(x, t_span, mu, mask, spks, cond, solver="euler", cfg_rate=cfg_rate, cfg_steps=cfg_steps)
+
+    def solve(self, x, t_span, mu, mask, spks, cond, solver=None, cfg_rate=None, cfg_steps=None):
         """
-        Fixed euler solver for ODEs.
+        Fixed-step ODE solvers, from the noise at t=0 to the mel-spectrogram at t=1.
         Args:
             x (torch.Tensor): random noise
             t_span (torch.Tensor): n_timesteps interpolated
@@ -83,56 +91,122 @@ class ConditionalCFM(BASECFM):
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            solver (str, optional): one of `SOLVERS`, defaults to `self.solver`:
+                - "euler": first order, one estimator pass per step.
+                - "heun", "midpoint": second order, two passes per step; 5 steps cost as much as 10 euler steps
+                    but are usually more accurate.
+                - "multistep": second order Adams-Bashforth (the flow matching counterpart of DPM-Solver++(2M)),
+                    one pass per step: it extrapolates from the previous step's velocity.
+            cfg_rate (float, optional): classifier-free guidance rate. Defaults to `self.inference_cfg_rate`; 0
+                disables guidance, which halves the estimator batch.
+            cfg_steps (int, optional): only guide the first `cfg_steps` steps, and run the later ones (which
+                mostly refine details) on the conditional branch alone. Defaults to all steps.
+        """
+        solver = solver or self.solver
+        assert solver in SOLVERS, f"unknown solver: {solver}"
+        cfg_rate = self.inference_cfg_rate if cfg_rate is None else cfg_rate
+        cfg_steps = len(t_span) - 1 if cfg_steps is None else cfg_steps
+        if cfg_rate == 0:
+            cfg_steps = 0
+        velocity = self._velocity_fn(x, mu, mask, spks, cond, cfg_rate)
+
+        v_prev = h_prev = None
+        for step in range(1, len(t_span)):
+            t, h = t_span[step - 1:step], t_span[step] - t_span[step - 1]
+            guided = step <= cfg_steps
+            v = velocity(x, t, guided)
+            if solver == "euler":
+                x = x + h * v
+            elif solver == "heun":
+                x_pred = x + h * v
+                x = x + 0.5 * h * (v + velocity(x_pred, t + h, guided))
+            elif solver == "midpoint":
+                x_mid = x + 0.5 * h * v
+                x = x + h * velocity(x_mid, t + 0.5 * h, guided)
+            elif v_prev is None:  # multistep, first step
+                x = x + h * v
+            else:
+                r = h / (2 * h_prev)
+                x = x + h * ((1 + r) * v - r * v_prev)
+            v_prev, h_prev = v, h
+
+        return x.float()
+
+    def _velocity_fn(self, x, mu, mask, spks, cond, cfg_rate):
         """
-        t, _, dt = t_span[0], t_span[-1], t_span[1] - t_span[0]
-        t = t.unsqueeze(dim=0)
+        Returns `velocity(x, t, guided)`: the estimated flow at `x` and time `t` (a (1,) tensor), with classifier-free
+        guidance if `guided`, else from the conditional branch alone.
 
-        # I am storing this because I can later plot it by putting a debugger here and saving it to a file
-        # Or in future might add like a return_all_steps flag
-        sol = []
+        With guidance, the estimator runs on 2B rows: the B conditional rows, then their B unconditional rows.
 
+        The estimator runs in the dtype of `mu` (e.g. bf16), while the time and the returned velocity stay in the
+        dtype of `x`, so that a low-precision estimator doesn't degrade the sinusoidal time embedding or the
+        solver's integration.
+        """
+        B, dtype = x.size(0), mu.dtype
         # Do not use concat, it may cause memory format changed and trt infer with wrong results!
-        x_in = torch.zeros([2, 80, x.size(2)], device=x.device, dtype=x.dtype)
-        mask_in = torch.zeros([2, 1, x.size(2)], device=x.device, dtype=x.dtype)
-        mu_in = torch.zeros([2, 80, x.size(2)], device=x.device, dtype=x.dtype)
-        t_in = torch.zeros([2], device=x.device, dtype=x.dtype)
-        spks_in = torch.zeros([2, 80], device=x.device, dtype=x.dtype)
-        cond_in = torch.zeros([2, 80, x.size(2)], device=x.device, dtype=x.dtype)
-        for step in range(1, len(t_span)):
-            # Classifier-Free Guidance inference introduced in VoiceBox
-            x_in[:] = x
-            mask_in[:] = mask
-            mu_in[0] = mu
-            t_in[:] = t.unsqueeze(0)
-            spks_in[0] = spks
-            cond_in[0] = cond
-            dphi_dt = self.forward_estimator(
-                x_in, mask_in,
-                mu_in, t_in,
-                spks_in,
-                cond_in
+        x_in = torch.zeros([2 * B, 80, x.size(2)], device=x.device, dtype=dtype)
+        mask_in = torch.zeros([2 * B, 1, x.size(2)], device=x.device, dtype=dtype)
+        mu_in = torch.zeros([2 * B, 80, x.size(2)], device=x.device, dtype=dtype)
+        t_in = torch.zeros([2 * B], device=x.device, dtype=x.dtype)
+        spks_in = torch.zeros([2 * B, 80], device=x.device, dtype=dtype)
+        cond_in = torch.zeros([2 * B, 80, x.size(2)], device=x.device, dtype=dtype)
+        # mask / mu / spks / cond don't change across steps: fill them once (the unconditional rows stay zero),
+        # and let the estimator precompute its masks and conditioning channels once per batch size
+        mask_in[:B] = mask
+        mask_in[B:] = mask
+        mu_in[:B] = mu
+        spks_in[:B] = spks
+        cond_in[:B] = cond
+        statics = {}
+
+        def estimate(batch_size):
+            prepare = getattr(self.estimator, "prepare", None)
+            if prepare is not None and batch_size not in statics:
+                statics[batch_size] = prepare(mask_in[:batch_size], mu_in[:batch_size], spks_in[:batch_size], cond_in[:batch_size])
+            return self.forward_estimator(
+                x_in[:batch_size], mask_in[:batch_size],
+                mu_in[:batch_size], t_in[:batch_size],
+                spks_in[:batch_size],
+                cond_in[:batch_size],
+                static=statics.get(batch_size),
             )
-            dphi_dt, cfg_dphi_dt = torch.split(dphi_dt, [x.size(0), x.size(0)], dim=0)
-            dphi_dt = ((1.0 + self.inference_cfg_rate) * dphi_dt - self.inference_cfg_rate * cfg_dphi_dt)
-            x = x + dt * dphi_dt
-            t = t + dt
-            sol.append(x)
-            if step < len(t_span) - 1:
-                dt = t_span[step + 1] - t
 
-        return sol[-1].float()
+        def velocity(x, t, guided):
+            if guided:
+                # Classifier-Free Guidance inference introduced in VoiceBox
+                x_in[:B] = x
+                x_in[B:] = x
+                t_in[:] = t
+                dphi_dt = estimate(2 * B)
+                dphi_dt, cfg_dphi_dt = torch.split(dphi_dt.to(x.dtype), [B, B], dim=0)
+                return ((1.0 + cfg_rate) * dphi_dt - cfg_rate * cfg_dphi_dt)
+
+            # Unguided: the conditional branch only
+            x_in[:B] = x
+            t_in[:B] = t
+            dphi_dt = estimate(B)
+            # a TensorRT estimator writes its output into `x_in`, which the next call overwrites
+            if dphi_dt.dtype != x.dtype:
+                return dphi_dt.to(x.dtype)
+            return dphi_dt if isinstance(self.estimator, torch.nn.Module) else dphi_dt.clone()
 
-    def forward_estimator(self, x, mask, mu, t, spks, cond):
+        return velocity
+
+    def forward_estimator(self, x, mask, mu, t, spks, cond, static=None):
         if isinstance(self.estimator, torch.nn.Module):
+            if static is not None:
+                return self.estimator.forward(x, mask, mu, t, spks, cond, static=static)
             return self.estimator.forward(x, mask, mu, t, spks, cond)
         else:
+            batch_size = x.size(0)  # 2B with CFG, B for unguided steps
             with self.lock:
-                self.estimator.set_input_shape('x', (2, 80, x.size(2)))
-                self.estimator.set_input_shape('mask', (2, 1, x.size(2)))
-                self.estimator.set_input_shape('mu', (2, 80, x.size(2)))
-                self.estimator.set_input_shape('t', (2,))
-                self.estimator.set_input_shape('spks', (2, 80))
-                self.estimator.set_input_shape('cond', (2, 80, x.size(2)))
+                self.estimator.set_input_shape('x', (batch_size, 80, x.size(2)))
+                self.estimator.set_input_shape('mask', (batch_size, 1, x.size(2)))
+                self.estimator.set_input_shape('mu', (batch_size, 80, x.size(2)))
+                self.estimator.set_input_shape('t', (batch_size,))
+                self.estimator.set_input_shape('spks', (batch_size, 80))
+                self.estimator.set_input_shape('cond', (batch_size, 80, x.size(2)))
                 # run trt engine
                 self.estimator.execute_v2([x.contiguous().data_ptr(),
                                            mask.contiguous().data_ptr(),
@@ -188,10 +262,12 @@ class ConditionalCFM(BASECFM):
 class CausalConditionalCFM(ConditionalCFM):
     def __init__(self, in_channels=240, cfm_params=CFM_PARAMS, n_spks=1, spk_emb_dim=80, estimator=None):
         super().__init__(in_channels, cfm_params, n_spks, spk_emb_dim, estimator)
-        self.rand_noise = torch.randn([1, 80, 50 * 300])
+        # Fixed noise, from its own generator: it isn't in the checkpoint, and the global RNG state at this point
+        # depends on how the model was constructed (e.g. whether the weights were randomly initialized first)
+        self.rand_noise = torch.randn([1, 80, 50 * 300], generator=torch.Generator().manual_seed(0))
 
     @torch.inference_mode()
-    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None):
+    def forward(self, mu, mask, n_timesteps, temperature=1.0, spks=None, cond=None, solver=None, cfg_rate=None, cfg_steps=None, frame_ids=None):
         """Forward diffusion
 
         Args:
@@ -199,20 +275,30 @@ class CausalConditionalCFM(ConditionalCFM):
                 shape: (batch_size, n_feats, mel_timesteps)
             mask (torch.Tensor): output_mask
                 shape: (batch_size, 1, mel_timesteps)
-            n_timesteps (int): number of diffusion steps
+            n_timesteps (int): number of ODE steps
             temperature (float, optional): temperature for scaling noise. Defaults to 1.0.
             spks (torch.Tensor, optional): speaker ids. Defaults to None.
                 shape: (batch_size, spk_emb_dim)
             cond: Not used but kept for future purposes
+            solver, cfg_rate, cfg_steps: see `solve`
+            frame_ids (torch.Tensor, optional): positions of the frames of `mu` in the utterance, which select their
+                (fixed) noise, when solving a window of it. Defaults to 0 .. mel_timesteps - 1.
+                shape: (mel_timesteps,)
+            All the rows of a batch start from the same noise, so a row's output doesn't depend on the batch.
+            The ODE is integrated in fp32 whatever the dtype of `mu` and of the estimator.
 
         Returns:
             sample: generated mel-spectrogram
                 shape: (batch_size, n_feats, mel_timesteps)
         """
 
-        z = self.rand_noise[:, :, :mu.size(2)].to(mu.device).to(mu.dtype) * temperature
+        if frame_ids is None:
+            z = self.rand_noise[:, :, :mu.size(2)]
+        else:
+            z = self.rand_noise[:, :, frame_ids.cpu() % self.rand_noise.size(2)]
+        z = z.to(mu.device, torch.float32).expand(mu.size(0), -1, -1) * temperature
         # fix prompt and overlap part mu and z
-        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=mu.dtype)
+        t_span = torch.linspace(0, 1, n_timesteps + 1, device=mu.device, dtype=torch.float32)
         if self.t_scheduler == 'cosine':
             t_span = 1 - torch.cos(t_span * 0.5 * torch.pi)
-        return self.solve_euler(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond), None
+        return self.solve(z, t_span=t_span, mu=mu, mask=mask, spks=spks, cond=cond, solver=solver, cfg_rate=cfg_rate, cfg_steps=cfg_steps), None
@@ -19,7 +19,6 @@
 
 from typing import Dict, Optional, List
 import numpy as np
-from scipy.signal import get_window
 import torch
 import torch.nn.functional as F
 from torch.nn import Conv1d
@@ -197,21 +196,48 @@ class SineGen(torch.nn.Module):
         uv = (f0 > self.voiced_threshold).type(torch.float32)
         return uv
 
+    def _cycles(self, f0):
+        # phase increment of each harmonic, in cycles per sample
+        F_mat = torch.zeros((f0.size(0), self.harmonic_num + 1, f0.size(-1))).to(f0.device)
+        for i in range(self.harmonic_num + 1):
+            F_mat[:, i: i + 1, :] = f0 * (i + 1) / self.sampling_rate
+        return F_mat
+
+    def initial_phase(self, batch_size, device):
+        """
+        Random initial phase of each harmonic (the fundamental starts at 0), in cycles: [B, harmonic_num + 1, 1].
+        """
+        u_dist = Uniform(low=-np.pi, high=np.pi)
+        phase_vec = u_dist.sample(sample_shape=(batch_size, self.harmonic_num + 1, 1)).to(device)
+        phase_vec[:, 0, :] = 0
+        return phase_vec / (2 * np.pi)
+
+    @torch.no_grad()
+    def phase_after(self, f0, phase):
+        """
+        The phase, in cycles, of each harmonic at the end of `f0` [B, 1, sample_len] if it started at `phase`.
+        """
+        return (phase + self._cycles(f0).sum(dim=-1, keepdim=True)) % 1
+
     @torch.no_grad()
-    def forward(self, f0):
+    def forward(self, f0, phase=None):
         """
         :param f0: [B, 1, sample_len], Hz
+        :param phase: [B, harmonic_num + 1, 1], the phase in cycles to continue from (see `phase_after`), or None
+            to start from a random one
         :return: [B, 1, sample_len]
         """
 
-        F_mat = torch.zeros((f0.size(0), self.harmonic_num + 1, f0.size(-1))).to(f0.device)
-        for i in range(self.harmonic_num + 1):
-            F_mat[:, i: i + 1, :] = f0 * (i + 1) / self.sampling_rate
+        F_mat = self._cycles(f0)
 
-        theta_mat = 2 * np.pi * (torch.cumsum(F_mat, dim=-1) % 1)
-        u_dist = Uniform(low=-np.pi, high=np.pi)
-        phase_vec = u_dist.sample(sample_shape=(f0.size(0), self.harmonic_num + 1, 1)).to(F_mat.device)
-        phase_vec[:, 0, :] = 0
+        if phase is None:
+            theta_mat = 2 * np.pi * (torch.cumsum(F_mat, dim=-1) % 1)
+            u_dist = Uniform(low=-np.pi, high=np.pi)
+            phase_vec = u_dist.sample(sample_shape=(f0.size(0), self.harmonic_num + 1, 1)).to(F_mat.device)
+            phase_vec[:, 0, :] = 0
+        else:
+            theta_mat = 2 * np.pi * ((torch.cumsum(F_mat, dim=-1) + phase) % 1)
+            phase_vec = 0
 
         # generate sine waveforms
         sine_waves = self.sine_amp * torch.sin(theta_mat + phase_vec)
@@ -264,16 +290,17 @@ class SourceModuleHnNSF(torch.nn.Module):
         self.l_linear = torch.nn.Linear(harmonic_num + 1, 1)
         self.l_tanh = torch.nn.Tanh()
 
-    def forward(self, x):
+    def forward(self, x, phase=None):
         """
         Sine_source, noise_source = SourceModuleHnNSF(F0_sampled)
         F0_sampled (batchsize, length, 1)
         Sine_source (batchsize, length, 1)
         noise_source (batchsize, length 1)
+        phase: harmonic phases to continue from, see `SineGen.forward`
         """
         # source for harmonic branch
         with torch.no_grad():
-            sine_wavs, uv, _ = self.l_sin_gen(x.transpose(1, 2))
+            sine_wavs, uv, _ = self.l_sin_gen(x.transpose(1, 2), phase)
             sine_wavs = sine_wavs.transpose(1, 2)
             uv = uv.transpose(1, 2)
         sine_merge = self.l_tanh(self.l_linear(sine_wavs))
@@ -376,9 +403,16 @@ class HiFTGenerator(nn.Module):
         self.ups.apply(init_weights)
         self.conv_post.apply(init_weights)
         self.reflection_pad = nn.ReflectionPad1d((1, 0))
-        self.stft_window = torch.from_numpy(get_window("hann", istft_params["n_fft"], fftbins=True).astype(np.float32))
+        self.stft_window = torch.hann_window(istft_params["n_fft"], periodic=True, dtype=torch.float64).float()
         self.f0_predictor = f0_predictor
 
+        # streaming, see `stream_inference`
+        self.upsample_scale = int(np.prod(upsample_rates) * istft_params["hop_len"])  # samples per mel frame
+        self.f0_context = 5  # receptive field of `ConvRNNF0Predictor`, in mel frames on each side
+        self.stream_context = 16  # the decoder's receptive field is 15 mel frames on each side
+        self.stream_lookahead = self.stream_context + self.f0_context
+        self.stream_fade = self.upsample_scale
+
     def remove_weight_norm(self):
         print('Removing weight norm...')
         for l in self.ups:
@@ -472,3 +506,80 @@ class HiFTGenerator(nn.Module):
             s[:, :, :cache_source.shape[2]] = cache_source
         generated_speech = self.decode(x=speech_feat, s=s)
         return generated_speech, s
+
+    @torch.inference_mode()
+    def stream_inference(self, speech_feat: torch.Tensor, cache: Optional[dict] = None, finalize: bool = False):
+        """
+        Vocodes a mel-spectrogram that arrives in chunks, in bounded memory. `speech_feat` [B, 80, T] holds the
+        frames that follow the ones passed to the previous calls, and `cache` is what the previous call returned
+        (None for the first chunk).
+
+        Each call vocodes a window of buffered frames: up to `stream_context` already vocoded frames on the left,
+        the new ones, and `stream_lookahead` frames on the right whose audio is held back until the next call (or
+        `finalize`). The source excitation of each sample is generated once, continuing the harmonic phases where
+        the previous chunk stopped, and cached so that overlapping windows see the same excitation. With the default
+        context and lookahead, which cover the receptive fields of the F0 predictor and of the decoder, the audio
+        therefore matches `inference` on the whole mel-spectrogram up to rounding (and to the random noise of the
+        excitation). The first `stream_fade` samples of each chunk are cross-faded with the previous window's
+        audio, which only matters if the lookahead is lowered to reduce latency.
+
+        Returns the new audio [B, T_wav] and the cache for the next call (None if `finalize`).
+        """
+        scale = self.upsample_scale
+        if cache is None:
+            cache = dict(
+                mel=speech_feat[:, :, :0],
+                n_done=0,  # leading frames of `mel` that were already vocoded
+                source=speech_feat.new_zeros(speech_feat.size(0), 1, 0),  # final excitation of the leading frames
+                phase=self.m_source.l_sin_gen.initial_phase(speech_feat.size(0), speech_feat.device),
+                tail=None,  # the previous window's audio for the first samples after `n_done`
+                n_out=0,  # samples returned so far
+            )
+        mel = torch.cat([cache["mel"], speech_feat], dim=2)
+        n_frames, n_done = mel.size(2), cache["n_done"]
+        end = n_frames if finalize else max(n_frames - self.stream_lookahead, n_done)
+        if end == n_done:
+            return mel.new_zeros(mel.size(0), 0), (None if finalize else dict(cache, mel=mel))
+
+        # mel->f0->source, for the frames without a final excitation yet
+        n_src = cache["source"].size(2) // scale
+        f0 = self.f0_predictor(mel)
+        s = self.f0_upsamp(f0[:, None]).transpose(1, 2)[:, n_src * scale:]  # bs,n,t
+        s_new, _, _ = self.m_source(s, phase=cache["phase"])
+        source = torch.cat([cache["source"], s_new.transpose(1, 2)], dim=2)
+
+        # mel+source->speech
+        wav = self.decode(x=mel, s=source)
+        output = wav[:, n_done * scale:end * scale]
+        if cache["tail"] is not None:
+            n_fade = min(cache["tail"].size(1), output.size(1))
+            fade_in = (1 - torch.cos(torch.linspace(0, np.pi, n_fade + 2, device=wav.device)[1:-1])) / 2
+            output = output.clone()
+            output[:, :n_fade] = output[:, :n_fade] * fade_in + cache["tail"][:, :n_fade] * (1 - fade_in)
+        if finalize:
+            return output, None
+
+        # the excitation is final where the F0 predictor saw its whole context
+        src_end = max(n_frames - self.f0_context, n_src)
+        phase = self.m_source.l_sin_gen.phase_after(s[:, :(src_end - n_src) * scale].transpose(1, 2), cache["phase"])
+        keep = max(end - self.stream_context, 0)
+        cache = dict(
+            mel=mel[:, :, keep:],
+            n_done=end - keep,
+            source=source[:, :, keep * scale:src_end * scale],
+            phase=phase,
+            tail=wav[:, end * scale:end * scale + self.stream_fade],
+            n_out=cache["n_out"] + output.size(1),
+        )
+        return output, cache
+
+    def chunked_inference(self, speech_feat: torch.Tensor, chunk_len: int = 500):
+        """
+        `inference` for long inputs, in bounded memory: vocodes `chunk_len` mel frames at a time with
+        `stream_inference` and yields the audio of each chunk.
+        """
+        cache = None
+        for start in range(0, speech_feat.size(2), chunk_len):
+            finalize = start + chunk_len >= speech_feat.size(2)
+            wav, cache = self.stream_inference(speech_feat[:, :, start:start + chunk_len], cache, finalize=finalize)
+            yield wav
@@ -156,6 +156,67 @@ class S3Token2Mel(torch.nn.Module):
             embedding=ref_x_vector,
         )
 
+    def embed_refs(
+        self,
+        ref_wavs,
+        ref_sr: int,
+        device="auto",
+    ):
+        """
+        Batched version of `embed_ref` for a list of 1D reference waveforms (e.g. when registering many voices).
+        The S3 tokenizer runs on the whole padded batch. CAMPPlus pools over padding, so it only batches
+        references of the same length; typically most of them, since references are capped at 10s by the caller.
+
+        Returns:
+            a list of `embed_ref` dicts, one per reference.
+        """
+        device = self.device if device == "auto" else device
+        ref_wavs = [
+            (torch.from_numpy(wav).float() if isinstance(wav, np.ndarray) else wav).to(device) for wav in ref_wavs
+        ]
+        ref_wavs_24 = ref_wavs
+        if ref_sr != S3GEN_SR:
+            ref_wavs_24 = [get_resampler(ref_sr, S3GEN_SR, device)(wav) for wav in ref_wavs]
+        ref_wavs_16 = [get_resampler(ref_sr, S3_SR, device)(wav).to(device) for wav in ref_wavs]
+
+        # Speaker embeddings, batched by length
+        ref_x_vectors = [None] * len(ref_wavs)
+        by_len = {}
+        for i, wav in enumerate(ref_wavs_16):
+            by_len.setdefault(wav.size(0), []).append(i)
+        for idxs in by_len.values():
+            x_vectors = self.speaker_encoder.inference([ref_wavs_16[i] for i in idxs])
+            for i, x_vector in zip(idxs, x_vectors):
+                ref_x_vectors[i] = x_vector[None]
+
+        # Tokenize the 16khz references
+        ref_speech_tokens, ref_speech_token_lens = self.tokenizer(ref_wavs_16)
+
+        ref_dicts = []
+        for i, wav_24 in enumerate(ref_wavs_24):
+            ref_mels_24 = self.mel_extractor(wav_24[None]).transpose(1, 2).to(device)
+            # Make sure mel_len = 2 * stoken_len (happens when the input is not padded to multiple of 40ms)
+            n_tokens = min(int(ref_speech_token_lens[i]), ref_mels_24.shape[1] // 2)
+            ref_dicts.append(dict(
+                prompt_token=ref_speech_tokens[i:i + 1, :n_tokens].to(device),
+                prompt_token_len=torch.LongTensor([n_tokens]).to(ref_speech_token_lens.device),
+                prompt_feat=ref_mels_24,
+                prompt_feat_len=None,
+                embedding=ref_x_vectors[i],
+            ))
+        return ref_dicts
+
+    def _cast_ref_dict(self, ref_dict: dict):
+        # type/device casting (all values will be numpy if it's from a prod API call); cast into a new dict,
+        # since the caller's dict may be shared between concurrent requests
+        ref_dict = dict(ref_dict)
+        for rk in list(ref_dict):
+            if isinstance(ref_dict[rk], np.ndarray):
+                ref_dict[rk] = torch.from_numpy(ref_dict[rk])
+            if torch.is_tensor(ref_dict[rk]):
+                ref_dict[rk] = ref_dict[rk].to(self.device)
+        return ref_dict
+
     def forward(
         self,
         speech_tokens: torch.LongTensor,
@@ -165,6 +226,10 @@ class S3Token2Mel(torch.nn.Module):
         # pre-computed ref embedding (prod API)
         ref_dict: Optional[dict] = None,
         finalize: bool = False,
+        n_timesteps: int = 10,
+        solver: Optional[str] = None,
+        cfg_rate: Optional[float] = None,
+        cfg_steps: Optional[int] = None,
     ):
         """
         Generate waveforms from S3 speech tokens and a reference waveform, which the speaker timbre is inferred from.
@@ -181,18 +246,17 @@ class S3Token2Mel(torch.nn.Module):
         - `ref_wav`: reference waveform (`torch.Tensor` with shape=[B=1, T])
         - `ref_sr`: reference sample rate
         - `finalize`: whether streaming is finished or not. Note that if False, the last 3 tokens will be ignored.
+        - `n_timesteps`, `solver`: number of ODE steps of the flow decoder and its solver (see `ConditionalCFM.solve`);
+          fewer steps of a second order solver can match the default 10 euler steps.
+        - `cfg_rate`, `cfg_steps`: classifier-free guidance schedule of the flow decoder, see
+          `ConditionalCFM.solve`. `cfg_rate=0` disables guidance, `cfg_steps=K` only guides the first K steps.
         """
         assert (ref_wav is None) ^ (ref_dict is None), f"Must provide exactly one of ref_wav or ref_dict (got {ref_wav} and {ref_dict})"
 
         if ref_dict is None:
             ref_dict = self.embed_ref(ref_wav, ref_sr)
         else:
-            # type/device casting (all values will be numpy if it's from a prod API call)
-            for rk in list(ref_dict):
-                if isinstance(ref_dict[rk], np.ndarray):
-                    ref_dict[rk] = torch.from_numpy(ref_dict[rk])
-                if torch.is_tensor(ref_dict[rk]):
-                    ref_dict[rk] = ref_dict[rk].to(self.device)
+            ref_dict = self._cast_ref_dict(ref_dict)
 
         if len(speech_tokens.shape) == 1:
             speech_tokens = speech_tokens.unsqueeze(0)
@@ -204,6 +268,10 @@ class S3Token2Mel(torch.nn.Module):
             token=speech_tokens,
             token_len=speech_token_lens,
             finalize=finalize,
+            n_timesteps=n_timesteps,
+            solver=solver,
+            cfg_rate=cfg_rate,
+            cfg_steps=cfg_steps,
             **ref_dict,
         )
         return output_mels
@@ -243,11 +311,19 @@ class S3Token2Wav(S3Token2Mel):
         ref_sr: Optional[int],
         # pre-computed ref embedding (prod API)
         ref_dict: Optional[dict] = None,
-        finalize: bool = False
+        finalize: bool = False,
+        n_timesteps: int = 10,
+        solver: Optional[str] = None,
+        cfg_rate: Optional[float] = None,
+        cfg_steps: Optional[int] = None,
     ):
-        output_mels = super().forward(speech_tokens, ref_wav=ref_wav, ref_sr=ref_sr, ref_dict=ref_dict, finalize=finalize)
+        output_mels = super().forward(
+            speech_tokens, ref_wav=ref_wav, ref_sr=ref_sr, ref_dict=ref_dict, finalize=finalize,
+            n_timesteps=n_timesteps, solver=solver, cfg_rate=cfg_rate, cfg_steps=cfg_steps,
+        )
 
-        # TODO jrm: ignoring the speed control (mel interpolation) and the HiFTGAN caching mechanisms for now.
+        # TODO jrm: ignoring the speed control (mel interpolation) for now. For the HiFTGAN caching mechanism,
+        # see `stream_inference`.
         hift_cache_source = torch.zeros(1, 1, 0).to(self.device)
 
         output_wavs, *_ = self.mel2wav.inference(speech_feat=output_mels, cache_source=hift_cache_source)
@@ -268,8 +344,15 @@ class S3Token2Wav(S3Token2Mel):
         # pre-computed ref embedding (prod API)
         ref_dict: Optional[dict] = None,
         finalize: bool = False,
+        n_timesteps: int = 10,
+        solver: Optional[str] = None,
+        cfg_rate: Optional[float] = None,
+        cfg_steps: Optional[int] = None,
     ):
-        return super().forward(speech_tokens, ref_wav=ref_wav, ref_sr=ref_sr, ref_dict=ref_dict, finalize=finalize)
+        return super().forward(
+            speech_tokens, ref_wav=ref_wav, ref_sr=ref_sr, ref_dict=ref_dict, finalize=finalize,
+            n_timesteps=n_timesteps, solver=solver, cfg_rate=cfg_rate, cfg_steps=cfg_steps,
+        )
 
     @torch.inference_mode()
     def hift_inference(self, speech_feat, cache_source: torch.Tensor = None):
@@ -288,11 +371,157 @@ class S3Token2Wav(S3Token2Mel):
         ref_dict: Optional[dict] = None,
         cache_source: torch.Tensor = None, # NOTE: this arg is for streaming, it can probably be removed here
         finalize: bool = True,
+        n_timesteps: int = 10,
+        solver: Optional[str] = None,
+        cfg_rate: Optional[float] = None,
+        cfg_steps: Optional[int] = None,
+        hift_chunk_len: Optional[int] = None,
     ):
-        output_mels = self.flow_inference(speech_tokens, ref_wav=ref_wav, ref_sr=ref_sr, ref_dict=ref_dict, finalize=finalize)
-        output_wavs, output_sources = self.hift_inference(output_mels, cache_source)
+        """
+        Synthesizes the audio of `speech_tokens`. If `hift_chunk_len` is set, the vocoder runs on that many mel
+        frames at a time (see `HiFTGenerator.chunked_inference`), which bounds its memory use on long outputs;
+        `output_sources` is None in that case.
+        """
+        output_mels = self.flow_inference(
+            speech_tokens, ref_wav=ref_wav, ref_sr=ref_sr, ref_dict=ref_dict, finalize=finalize,
+            n_timesteps=n_timesteps, solver=solver, cfg_rate=cfg_rate, cfg_steps=cfg_steps,
+        )
+        if hift_chunk_len is not None:
+            output_wavs = torch.cat(list(self.mel2wav.chunked_inference(output_mels, hift_chunk_len)), dim=1)
+            output_sources = None
+        else:
+            output_wavs, output_sources = self.hift_inference(output_mels, cache_source)
 
         # NOTE: ad-hoc method to reduce "spillover" from the reference clip.
         output_wavs[:, :len(self.trim_fade)] *= self.trim_fade
 
         return output_wavs, output_sources
+
+    @torch.inference_mode()
+    def inference_batch(
+        self,
+        speech_tokens,
+        ref_dicts,
+        n_timesteps: int = 10,
+        solver: Optional[str] = None,
+        cfg_rate: Optional[float] = None,
+        cfg_steps: Optional[int] = None,
+    ):
+        """
+        Batched version of `inference` for N complete utterances, e.g. the finished outputs of a T3 batch: the
+        flow encoder, the flow decoder and the vocoder each run once over the padded batch.
+
+        Args
+        ----
+        - `speech_tokens`: list of N 1D token tensors
+        - `ref_dicts`: list of N pre-computed ref embeddings (see `embed_ref`), one per utterance
+        - `n_timesteps`, `solver`, `cfg_rate`, `cfg_steps`: flow decoder settings, see `S3Token2Mel.forward`
+
+        Returns
+        -------
+        - list of N waveforms [1, T_wav]. The mels match `inference`'s; the audio may differ slightly in the last
+          frames of the shorter utterances, where the (non-causal) vocoder sees the padding.
+        """
+        assert len(speech_tokens) == len(ref_dicts), "need exactly one ref_dict per utterance"
+        ref_dicts = [self._cast_ref_dict(ref_dict) for ref_dict in ref_dicts]
+        pad = torch.nn.utils.rnn.pad_sequence
+
+        output_mels, mel_lens = self.flow.inference(
+            token=pad([tokens.to(self.device) for tokens in speech_tokens], batch_first=True),
+            token_len=torch.LongTensor([len(tokens) for tokens in speech_tokens]).to(self.device),
+            prompt_token=pad([ref_dict["prompt_token"][0] for ref_dict in ref_dicts], batch_first=True),
+            prompt_token_len=torch.LongTensor([ref_dict["prompt_token"].size(1) for ref_dict in ref_dicts]),
+            prompt_feat=pad([ref_dict["prompt_feat"][0] for ref_dict in ref_dicts], batch_first=True),
+            prompt_feat_len=torch.LongTensor([ref_dict["prompt_feat"].size(1) for ref_dict in ref_dicts]),
+            embedding=torch.cat([ref_dict["embedding"] for ref_dict in ref_dicts]),
+            finalize=True,
+            n_timesteps=n_timesteps,
+            solver=solver,
+            cfg_rate=cfg_rate,
+            cfg_steps=cfg_steps,
+        )
+        output_wavs, _ = self.hift_inference(output_mels)
+
+        # NOTE: ad-hoc method to reduce "spillover" from the reference clip.
+        output_wavs[:, :len(self.trim_fade)] *= self.trim_fade
+
+        scale = self.mel2wav.upsample_scale
+        return [output_wavs[i:i + 1, :int(mel_len) * scale] for i, mel_len in enumerate(mel_lens)]
+
+    @torch.inference_mode()
+    def stream_inference(
+        self,
+        speech_tokens,
+        ref_dict: dict,
+        token_offset: int = 0,
+        cache: Optional[dict] = None,
+        finalize: bool = False,
+        n_timesteps: int = 10,
+        solver: Optional[str] = None,
+        cfg_rate: Optional[float] = None,
+        cfg_steps: Optional[int] = None,
+        incremental: bool = False,
+    ):
+        """
+        Vocode one chunk of a growing speech token sequence (CosyVoice2-style streaming).
+
+        By default, the flow decoder is re-run on all tokens received so far, and only the mel frames after
+        `token_offset` (i.e. the ones not emitted by previous calls) are kept. With `incremental`, it only
+        processes the new tokens instead, with cached encoder state (see `CausalMaskedDiffWithXvec.inference_incremental`):
+        the cost of a chunk no longer grows with the utterance, at the price of chunk-causal encoder attention.
+        The mel frames are then passed on to `HiFTGenerator.stream_inference`, which holds back the audio of the
+        last `mel2wav.stream_lookahead` frames until the next call so that chunk boundaries match the
+        whole-utterance output.
+
+        Args
+        ----
+        - `speech_tokens`: all S3 speech tokens so far [B=1, T]
+        - `ref_dict`: pre-computed ref embedding (see `embed_ref`)
+        - `token_offset`: number of leading tokens that were already vocoded by previous calls (not needed with
+          `incremental`, where the cache keeps track of it)
+        - `cache`: the cache returned by the previous call, or None for the first chunk
+        - `finalize`: whether this is the last chunk. If False, the last `pre_lookahead_len` tokens are only
+          used as lookahead and will be vocoded by the next call.
+        - `n_timesteps`, `solver`, `cfg_rate`, `cfg_steps`: flow decoder settings, see `S3Token2Mel.forward`
+        - `incremental`: whether to run the flow incrementally; use the same value for all the chunks
+
+        Returns
+        -------
+        - `output_wavs`: the new audio [B=1, T_wav]
+        - `cache`: the cache to pass to the next call (None if `finalize`)
+        """
+        cache = cache or dict(flow=None, hift=None)
+        if incremental:
+            if len(speech_tokens.shape) == 1:
+                speech_tokens = speech_tokens.unsqueeze(0)
+            n_tokens = 0 if cache["flow"] is None else cache["flow"]["n_tokens"] - ref_dict["prompt_token"].shape[1]
+            output_mels, flow_cache = self.flow.inference_incremental(
+                token=speech_tokens[:, n_tokens:].to(self.device),
+                cache=cache["flow"],
+                finalize=finalize,
+                n_timesteps=n_timesteps,
+                solver=solver,
+                cfg_rate=cfg_rate,
+                cfg_steps=cfg_steps,
+                **self._cast_ref_dict(ref_dict),
+            )
+        else:
+            output_mels = self.flow_inference(
+                speech_tokens, ref_dict=ref_dict, finalize=finalize, n_timesteps=n_timesteps, solver=solver,
+                cfg_rate=cfg_rate, cfg_steps=cfg_steps,
+            )
+            output_mels = output_mels[:, :, token_offset * self.flow.token_mel_ratio:]
+            flow_cache = None
+
+        hift_cache = cache["hift"]
+        n_out = 0 if hift_cache is None else hift_cache["n_out"]
+        output_wavs, hift_cache = self.mel2wav.stream_inference(output_mels, hift_cache, finalize=finalize)
+
+        # NOTE: ad-hoc method to reduce "spillover" from the reference clip.
+        n_trim = min(len(self.trim_fade) - n_out, output_wavs.size(1))
+        if n_trim > 0:
+            output_wavs[:, :n_trim] *= self.trim_fade[n_out:n_out + n_trim]
+
+        if finalize:
+            return output_wavs, None
+        return output_wavs, dict(flow=flow_cache, hift=hift_cache)
@@ -15,7 +15,7 @@
 # limitations under the License.
 # Modified from ESPnet(https://github.com/espnet/espnet)
 """Encoder definition."""
-from typing import Tuple
+from typing import List, Optional, Tuple
 
 import torch
 from torch import nn
@@ -276,7 +276,9 @@ class UpsampleConformerEncoder(torch.nn.Module):
                                               decoding_chunk_size,
                                               self.static_chunk_size,
                                               num_decoding_left_chunks)
-        # lookahead + conformer encoder
+        # lookahead + conformer encoder; zero the padding first, so that the lookahead of a row's last tokens sees
+        # the same zeros in a padded batch as at the end of the sequence
+        xs = xs * mask_pad.transpose(1, 2)
         xs = self.pre_lookahead_layer(xs)
         xs = self.forward_layers(xs, chunk_masks, pos_emb, mask_pad)
 
@@ -316,3 +318,78 @@ class UpsampleConformerEncoder(torch.nn.Module):
         for layer in self.up_encoders:
             xs, chunk_masks, _, _ = layer(xs, chunk_masks, pos_emb, mask_pad)
         return xs
+
+    @torch.inference_mode()
+    def forward_chunk(
+        self,
+        xs: torch.Tensor,
+        cache: Optional[dict] = None,
+        finalize: bool = False,
+    ) -> Tuple[torch.Tensor, dict]:
+        """Incremental version of `forward` for streaming input.
+
+        Each call encodes the new input frames that have their lookahead as one chunk: they attend to each other
+        and to all previous chunks, through the keys / values of every layer cached in `cache`, but not to later
+        frames, as with a chunk mask (see `add_optional_chunk_mask`). Unlike `forward`, whose attention has full
+        context, the output therefore depends on how the input is split into chunks.
+
+        Args:
+            xs: the new input frames (B=1, T, D), following the ones passed to the previous calls
+            cache: the cache returned by the previous call, None for the first one
+            finalize: whether `xs` ends the input. Otherwise, its last `pre_lookahead_layer.pre_lookahead_len`
+                frames are only used as lookahead, and encoded by the next call.
+        Returns:
+            the output for the newly encoded input frames (B=1, T' * up_layer.stride, D), and the cache for the
+            next call
+        """
+        lookahead = self.pre_lookahead_layer.pre_lookahead_len
+        left_context = self.pre_lookahead_layer.conv2.kernel_size[0] - 1
+        if cache is None:
+            cache = dict(
+                xs=xs.new_zeros(xs.size(0), 0, self._output_size),  # embedded frames, not all encoded yet
+                n_left=0,  # leading frames of `xs` that are only there as left context of `pre_lookahead_layer`
+                att=[None] * len(self.encoders),
+                up_left=xs.new_zeros(xs.size(0), 2, self._output_size),  # left context of `up_layer`
+                up_att=[None] * len(self.up_encoders),
+            )
+        if self.global_cmvn is not None:
+            xs = self.global_cmvn(xs)
+        xs, _, _ = self.embed(xs, torch.ones(xs.size(0), 1, xs.size(1), dtype=torch.bool, device=xs.device))
+        xs = torch.cat([cache["xs"], xs], dim=1)
+        n_left = cache["n_left"]
+        end = xs.size(1) if finalize else xs.size(1) - lookahead
+        if end <= n_left:
+            return xs.new_zeros(xs.size(0), 0, self._output_size), dict(cache, xs=xs)
+
+        # lookahead + conformer encoder
+        ys = self.pre_lookahead_layer(xs)[:, n_left:end]
+        ys, att = self._forward_chunk_layers(self.encoders, self.embed, ys, cache["att"])
+
+        # upsample + conformer encoder
+        up_left = torch.cat([cache["up_left"], ys], dim=1)
+        ys = F.interpolate(up_left.transpose(1, 2), scale_factor=float(self.up_layer.stride), mode="nearest")
+        ys = self.up_layer.conv(ys).transpose(1, 2).contiguous()
+        ys, _, _ = self.up_embed(ys, torch.ones(ys.size(0), 1, ys.size(1), dtype=torch.bool, device=ys.device))
+        ys, up_att = self._forward_chunk_layers(self.up_encoders, self.up_embed, ys, cache["up_att"])
+
+        if self.normalize_before:
+            ys = self.after_norm(ys)
+        n_left = min(end, left_context)
+        cache = dict(xs=xs[:, end - n_left:], n_left=n_left, att=att, up_left=up_left[:, -2:], up_att=up_att)
+        return ys, cache
+
+    def _forward_chunk_layers(self, layers: nn.ModuleList, embed: nn.Module, xs: torch.Tensor,
+                              att_caches: List[Optional[torch.Tensor]]):
+        cache_t = 0 if att_caches[0] is None else att_caches[0].size(2)
+        key_len = cache_t + xs.size(1)
+        if hasattr(embed.pos_enc, "extend_pe"):
+            embed.pos_enc.extend_pe(xs.new_zeros(1, key_len))
+        pos_emb = embed.position_encoding(offset=0, size=key_len)
+        mask = torch.ones(xs.size(0), xs.size(1), key_len, dtype=torch.bool, device=xs.device)
+        new_att_caches = []
+        for layer, att_cache in zip(layers, att_caches):
+            if att_cache is None:
+                att_cache = torch.zeros((0, 0, 0, 0), device=xs.device)
+            xs, _, att_cache, _ = layer(xs, mask, pos_emb, att_cache=att_cache)
+            new_att_caches.append(att_cache)
+        return xs, new_att_caches
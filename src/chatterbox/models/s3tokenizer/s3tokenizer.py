@@ -1,7 +1,6 @@
 from typing import List, Tuple
 
 import numpy as np
-import librosa
 import torch
 import torch.nn.functional as F
 from s3tokenizer.utils import padding
@@ -10,6 +9,8 @@ from s3tokenizer.model_v2 import (
     ModelConfig,
 )
 
+from ..mel_filters import mel_filters
+
 
 # Sampling rate of the inputs to S3TokenizerV2
 S3_SR = 16_000
@@ -36,14 +37,14 @@ class S3Tokenizer(S3TokenizerV2):
         super().__init__(name)
 
         self.n_fft = 400
-        _mel_filters = librosa.filters.mel(
+        _mel_filters = mel_filters(
             sr=S3_SR,
             n_fft=self.n_fft,
             n_mels=config.n_mels
         )
         self.register_buffer(
             "_mel_filters",
-            torch.FloatTensor(_mel_filters),
+            torch.tensor(_mel_filters),
         )
 
         self.register_buffer(
@@ -10,6 +10,48 @@ from types import MethodType
 logger = logging.getLogger(__name__)
 
 
+class AttentionSpy:
+    """
+    Handle returned by `add_attention_spy`; `remove()` restores the original attention layer.
+    """
+    def __init__(self, target_layer, hook_handle):
+        self.target_layer = target_layer
+        self.hook_handle = hook_handle
+
+    def remove(self):
+        self.hook_handle.remove()
+        # drop the instance-level patch, falling back to the class' forward
+        del self.target_layer.forward
+
+
+def add_attention_spy(tfmr, layer_idx, callback):
+    """
+    Calls `callback(attn_weights)` with the (B, H, S, S_past+S) attention weights of a single layer of `tfmr` on
+    every forward. Only that layer falls back to the eager attention path; the others keep the optimized kernels.
+    """
+
+    def attention_forward_hook(module, input, output):
+        """
+        See `LlamaAttention.forward`; the output is a 3-tuple: `attn_output, attn_weights, past_key_value`.
+        NOTE:
+        - When `output_attentions=True`, `LlamaSdpaAttention.forward` calls `LlamaAttention.forward`.
+        - `attn_output` has shape [B, H, T0, T0] for the 0th entry, and [B, H, 1, T0+i] for the rest i-th.
+        """
+        callback(output[1])
+
+    target_layer = tfmr.layers[layer_idx].self_attn
+    hook_handle = target_layer.register_forward_hook(attention_forward_hook)
+
+    # Backup original forward
+    original_forward = target_layer.forward
+    def patched_forward(self, *args, **kwargs):
+        kwargs['output_attentions'] = True
+        return original_forward(*args, **kwargs)
+
+    target_layer.forward = MethodType(patched_forward, target_layer)
+    return AttentionSpy(target_layer, hook_handle)
+
+
 @dataclass
 class AlignmentAnalysisResult:
     # was this frame detected as being part of a noisy beginning chunk with potential hallucinations?
@@ -64,27 +106,15 @@ class AlignmentStreamAnalyzer:
         (credit: jrm)
         """
 
-        def attention_forward_hook(module, input, output):
-            """
-            See `LlamaAttention.forward`; the output is a 3-tuple: `attn_output, attn_weights, past_key_value`.
-            NOTE:
-            - When `output_attentions=True`, `LlamaSdpaAttention.forward` calls `LlamaAttention.forward`.
-            - `attn_output` has shape [B, H, T0, T0] for the 0th entry, and [B, H, 1, T0+i] for the rest i-th.
-            """
-            step_attention = output[1].cpu() # (B, 16, N, N)
+        def attention_forward_hook(step_attention):
+            step_attention = step_attention.cpu() # (B, 16, N, N)
             self.last_aligned_attn = step_attention[0].mean(0) # (N, N)
 
-        target_layer = tfmr.layers[alignment_layer_idx].self_attn
-        hook_handle = target_layer.register_forward_hook(attention_forward_hook)
-
-        # Backup original forward
-        original_forward = target_layer.forward
-        def patched_forward(self, *args, **kwargs):
-            kwargs['output_attentions'] = True
-            return original_forward(*args, **kwargs)
+        self._attention_spy = add_attention_spy(tfmr, alignment_layer_idx, attention_forward_hook)
 
-        # TODO: how to unpatch it?
-        target_layer.forward = MethodType(patched_forward, target_layer)
+    def remove(self):
+        "Unpatches the attention layer; the analyzer can't be stepped afterwards."
+        self._attention_spy.remove()
 
     def step(self, logits):
         """
@@ -0,0 +1,243 @@
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from transformers.cache_utils import DynamicCache
+
+from ..modules.cond_enc import T3Cond
+from .sampler import T3Sampler
+
+
+@dataclass
+class T3Request:
+    """
+    A single utterance decoded by a `T3DecodeBatch`.
+
+    `text_tokens` is a 1D tensor including the start / stop text tokens, and `t3_cond` has batch size 1.
+    `user_data` is not used by T3 and lets the caller attach e.g. a future or the S3Gen conditionals.
+    Setting `cancelled` makes the batch drop the request at its next step.
+    With CFG, `cfg_tokens` limits guidance to the first tokens, after which the request's unconditional row leaves
+    the batch.
+    """
+    t3_cond: T3Cond
+    text_tokens: Tensor
+    cfg_weight: float = 0.5
+    temperature: float = 0.8
+    min_p: float = 0.05
+    top_p: float = 1.0
+    repetition_penalty: float = 1.2
+    max_new_tokens: int = 1000
+    cfg_tokens: Optional[int] = None
+    user_data: Any = None
+    cancelled: bool = False
+
+    # decoding state, owned by the batch
+    generated: Optional[Tensor] = field(default=None, repr=False)  # (1, 1 + n), starts with BOS
+    finished: bool = False
+    guided: bool = False  # whether the request still has its unconditional row
+
+    @property
+    def n_rows(self):
+        return 2 if self.guided else 1
+
+    @property
+    def speech_tokens(self) -> Tensor:
+        "1D tensor of the speech tokens predicted so far (without BOS, with the EOS if reached)"
+        return self.generated[0, 1:]
+
+
+class T3DecodeBatch:
+    """
+    Iteration-level ("continuous") batching for T3: requests can join the running batch between any two
+    decoding steps and leave it as soon as they are done, instead of waiting for the longest utterance of a
+    fixed batch.
+
+    Each request occupies one row of the shared KV cache, or two adjacent rows [cond, uncond] with CFG.
+    Requests are prefilled on their own and merged into the batch by left-padding the cache to a common length;
+    padding is masked out, and each row keeps its own rotary positions so that it decodes exactly as it would
+    unbatched.
+    """
+
+    def __init__(self, t3):
+        self.t3 = t3
+        self.backend = t3.backend
+        self.requests: List[T3Request] = []
+        self.cache: Optional[DynamicCache] = None
+        self.attention_mask: Optional[Tensor] = None  # (R, L)
+        self.position_ids: Optional[Tensor] = None  # (R, 1) position of the last input of each row
+        self.logits: Optional[Tensor] = None  # (R, V) next-token logits of each row
+        self.sampler: Optional[T3Sampler] = None  # one row per request
+
+    def __len__(self):
+        return len(self.requests)
+
+    @torch.inference_mode()
+    def add(self, request: T3Request):
+        """
+        Prefills `request` and adds it to the batch; its first token is sampled by the next `step`.
+        """
+        t3, hp = self.t3, self.t3.hp
+        device = t3.device
+
+        tokens = torch.atleast_2d(request.text_tokens).to(dtype=torch.long, device=device)
+        assert tokens.size(0) == 1, "requests are unbatched"
+        assert (tokens == hp.start_text_token).any(), "missing start_text_token"
+        assert (tokens == hp.stop_text_token).any(), "missing stop_text_token"
+
+        # Same prompt layout as `T3.inference_stream`
+        bos_token = torch.tensor([[hp.start_speech_token]], dtype=torch.long, device=device)
+        cfg = request.cfg_weight > 0.0 and request.cfg_tokens != 0
+        if cfg:
+            tokens = torch.cat([tokens, tokens], dim=0)
+        prefix = t3.cond_prefix(request.t3_cond)
+        embeds, _ = t3.prepare_input_embeds(
+            t3_cond=request.t3_cond,
+            text_tokens=tokens,
+            speech_tokens=bos_token.expand(tokens.size(0), 1),
+            cfg_weight=request.cfg_weight if cfg else 0.0,
+            cond_emb=prefix.cond_emb,
+        )
+        if cfg:
+            bos_embed = t3.speech_emb(bos_token) + t3.speech_pos_emb.get_fixed_embedding(0)
+            embeds = torch.cat([embeds, bos_embed.expand(2, -1, -1)], dim=1)
+
+        # Only the text and BOS positions need a prefill; the conditioning prefix is cached per voice
+        output = self.backend(
+            inputs_embeds=embeds[:, len(prefix):],
+            past_key_values=prefix.to_dynamic(embeds.size(0)),
+            use_cache=True,
+            return_dict=True,
+            num_logits_to_keep=1,
+        )
+
+        request.generated = bos_token.clone()
+        request.finished = False
+        request.guided = cfg
+        sampler = T3Sampler(
+            1,
+            hp.speech_tokens_dict_size,
+            temperature=request.temperature,
+            min_p=request.min_p,
+            top_p=request.top_p,
+            repetition_penalty=request.repetition_penalty,
+            cfg_weight=request.cfg_weight,
+            device=device,
+        )
+        sampler.observe(bos_token)
+        if self.sampler is None:
+            self.sampler = sampler
+        else:
+            self.sampler.append(sampler)
+
+        R, L = embeds.shape[:2]
+        mask = torch.ones(R, L, dtype=torch.long, device=device)
+        position_ids = torch.full((R, 1), L - 1, dtype=torch.long, device=device)
+        self._merge(output.past_key_values, mask, position_ids, output.logits[:, -1])
+        self.requests.append(request)
+
+    def _merge(self, cache: DynamicCache, mask: Tensor, position_ids: Tensor, logits: Tensor):
+        if not self.requests:
+            self.cache, self.attention_mask, self.position_ids, self.logits = cache, mask, position_ids, logits
+            return
+
+        # Left-pad both the batch and the newcomer to a common length
+        L_old, L_new = self.attention_mask.size(1), mask.size(1)
+        L = max(L_old, L_new)
+        pad_kv = lambda t, n: F.pad(t, (0, 0, n, 0)) if n else t  # (B, heads, seq, head_dim)
+        for layer in range(len(self.cache.key_cache)):
+            self.cache.key_cache[layer] = torch.cat([
+                pad_kv(self.cache.key_cache[layer], L - L_old), pad_kv(cache.key_cache[layer], L - L_new),
+            ])
+            self.cache.value_cache[layer] = torch.cat([
+                pad_kv(self.cache.value_cache[layer], L - L_old), pad_kv(cache.value_cache[layer], L - L_new),
+            ])
+        self.cache._seen_tokens = L
+        self.attention_mask = torch.cat([F.pad(self.attention_mask, (L - L_old, 0)), F.pad(mask, (L - L_new, 0))])
+        self.position_ids = torch.cat([self.position_ids, position_ids])
+        self.logits = torch.cat([self.logits, logits])
+
+    @torch.inference_mode()
+    def step(self) -> List[T3Request]:
+        """
+        Samples one token for every request, retires the ones that are done and runs one backbone forward for
+        the others.
+
+        Returns:
+            the requests that finished during this step (EOS or `max_new_tokens` reached).
+        """
+        t3, hp = self.t3, self.t3.hp
+        device = self.logits.device
+
+        # Sample all requests at once; without CFG a request's "uncond" row is its cond row (and its weight is 0)
+        cond_rows, uncond_rows, row = [], [], 0
+        for request in self.requests:
+            cond_rows.append(row)
+            uncond_rows.append(row + request.n_rows - 1)
+            row += request.n_rows
+        sampled = self.sampler(
+            self.logits[torch.tensor(cond_rows, device=device)],
+            self.logits[torch.tensor(uncond_rows, device=device)],
+        )  # (N, 1)
+
+        done, running = [], []
+        keep_requests, keep_rows, next_tokens, speech_pos = [], [], [], []
+        for i, (request, token) in enumerate(zip(self.requests, sampled.view(-1).tolist())):
+            request.generated = torch.cat([request.generated, sampled[i:i + 1]], dim=1)
+            n_generated = request.generated.size(1) - 1
+            if request.cancelled:
+                continue
+            if token == hp.stop_speech_token or n_generated >= request.max_new_tokens:
+                request.finished = True
+                done.append(request)
+            else:
+                running.append(request)
+                keep_requests.append(i)
+                if request.guided and request.cfg_tokens is not None and n_generated >= request.cfg_tokens:
+                    request.guided = False  # drop the unconditional row from now on
+                keep_rows.extend(range(cond_rows[i], cond_rows[i] + request.n_rows))
+                next_tokens.append(sampled[i:i + 1].expand(request.n_rows, 1))
+                speech_pos.extend([n_generated] * request.n_rows)
+        self.requests = running
+
+        if not running:
+            self.cache = self.attention_mask = self.position_ids = self.logits = self.sampler = None
+            return done
+
+        if len(keep_rows) < len(self.position_ids):
+            self.sampler.select(torch.tensor(keep_requests, dtype=torch.long, device=device))
+            keep = torch.tensor(keep_rows, dtype=torch.long, device=device)
+            for layer in range(len(self.cache.key_cache)):
+                self.cache.key_cache[layer] = self.cache.key_cache[layer].index_select(0, keep)
+                self.cache.value_cache[layer] = self.cache.value_cache[layer].index_select(0, keep)
+            self.attention_mask = self.attention_mask.index_select(0, keep)
+            self.position_ids = self.position_ids.index_select(0, keep)
+
+            # Drop the columns that only held padding for the retired rows
+            n_pad = int((self.attention_mask.sum(dim=0) == 0).long().cumprod(dim=0).sum())
+            if n_pad:
+                for layer in range(len(self.cache.key_cache)):
+                    self.cache.key_cache[layer] = self.cache.key_cache[layer][:, :, n_pad:]
+                    self.cache.value_cache[layer] = self.cache.value_cache[layer][:, :, n_pad:]
+                self.attention_mask = self.attention_mask[:, n_pad:]
+                self.cache._seen_tokens = self.attention_mask.size(1)
+
+        next_tokens = torch.cat(next_tokens)  # (R, 1)
+        speech_pos = torch.tensor(speech_pos, dtype=torch.long, device=next_tokens.device)[:, None]
+        inputs_embeds = t3.speech_emb(next_tokens) + t3.speech_pos_emb.get_fixed_embedding(speech_pos)
+
+        self.attention_mask = F.pad(self.attention_mask, (0, 1), value=1)
+        self.position_ids = self.position_ids + 1
+        output = self.backend(
+            inputs_embeds=inputs_embeds,
+            attention_mask=self.attention_mask,
+            position_ids=self.position_ids,
+            past_key_values=self.cache,
+            use_cache=True,
+            return_dict=True,
+            num_logits_to_keep=1,
+        )
+        self.cache = output.past_key_values
+        self.logits = output.logits[:, -1]
+        return done
@@ -0,0 +1,92 @@
+"""
+Int8 weights for T3 on CPU.
+
+Decoding at batch sizes 1-2 reads every backbone weight once per token, so it's bound by memory bandwidth; int8
+weights read a quarter of the fp32 bytes. The Linear layers of the Llama blocks and `speech_head` are replaced by
+dynamically quantized ones (int8 weights with one scale per output channel, activations quantized on the fly by
+the fbgemm / onednn kernels). The embeddings, norms and conditioning encoder stay fp32: an embedding lookup only
+reads the rows it needs, and they're a small part of the weights.
+
+`int8_state_dict` / `load_int8_state_dict` persist the quantized model as plain tensors (int8 weights plus their
+scales, and the fp32 rest), so that it can be saved with safetensors.
+"""
+from typing import Dict, List
+
+import torch
+from torch import nn, Tensor
+from torch.ao.nn.quantized.dynamic import Linear as DynamicQuantizedLinear
+from torch.ao.quantization import per_channel_dynamic_qconfig
+
+
+def int8_linear_names(t3) -> List[str]:
+    "Names of the Linear layers of `t3` that are quantized, whether they already are or not."
+    return [
+        name for name, module in t3.named_modules()
+        if (name.startswith("tfmr.") or name == "speech_head") and isinstance(module, (nn.Linear, DynamicQuantizedLinear))
+    ]
+
+
+def _replace(t3, name, module):
+    parent, _, attr = name.rpartition(".")
+    setattr(t3.get_submodule(parent), attr, module)
+
+
+def quantize_linears(t3):
+    "Quantizes the fp32 weights of the Linear layers in `int8_linear_names`, in place."
+    for name in int8_linear_names(t3):
+        linear = t3.get_submodule(name)
+        if isinstance(linear, DynamicQuantizedLinear):
+            continue
+        assert linear.weight.device.type == "cpu", "int8 inference is CPU only"
+        assert linear.weight.dtype == torch.float32, "quantize from fp32 weights"
+        linear.qconfig = per_channel_dynamic_qconfig
+        _replace(t3, name, DynamicQuantizedLinear.from_float(linear))
+
+
+def int8_state_dict(t3) -> Dict[str, Tensor]:
+    """
+    The state dict of a quantized T3 as plain tensors: `<layer>.weight` (int8), `<layer>.weight_scale` and
+    `<layer>.weight_zero_point` (per output channel) and `<layer>.bias` for the quantized layers, and the usual
+    entries for everything else.
+    """
+    names = int8_linear_names(t3)
+    state = {}
+    for name in names:
+        linear = t3.get_submodule(name)
+        assert isinstance(linear, DynamicQuantizedLinear), f"{name} is not quantized"
+        weight, bias = linear.weight(), linear.bias()
+        state[f"{name}.weight"] = weight.int_repr()
+        state[f"{name}.weight_scale"] = weight.q_per_channel_scales().float()
+        state[f"{name}.weight_zero_point"] = weight.q_per_channel_zero_points().int()
+        if bias is not None:
+            state[f"{name}.bias"] = bias.detach()
+    prefixes = tuple(f"{name}." for name in names)
+    for key, value in t3.state_dict().items():
+        if not key.startswith(prefixes):
+            state[key] = value
+    return {key: value.contiguous() for key, value in state.items()}
+
+
+def load_int8_state_dict(t3, state_dict: Dict[str, Tensor]):
+    """
+    Loads an `int8_state_dict` into a T3 on CPU, quantizing its Linear layers in place. The other tensors are
+    taken over rather than copied, so the T3 may have been constructed under `models.utils.init_empty_weights`.
+    """
+    names = int8_linear_names(t3)
+    prefixes = tuple(f"{name}." for name in names)
+    missing, unexpected = t3.load_state_dict(
+        {key: value for key, value in state_dict.items() if not key.startswith(prefixes)}, strict=False, assign=True,
+    )
+    assert not unexpected, f"unexpected keys: {unexpected}"
+    assert all(key.startswith(prefixes) for key in missing), f"missing keys: {missing}"
+
+    for name in names:
+        scales = state_dict[f"{name}.weight_scale"].double()
+        zero_points = state_dict[f"{name}.weight_zero_point"].long()
+        int8_weight = state_dict[f"{name}.weight"]
+        # re-quantizing the dequantized weight gives back the same integers
+        dequantized = (int8_weight.float() - zero_points[:, None]) * scales[:, None].float()
+        weight = torch.quantize_per_channel(dequantized, scales, zero_points, 0, torch.qint8)
+        qlinear = DynamicQuantizedLinear(int8_weight.size(1), int8_weight.size(0), dtype=torch.qint8)
+        qlinear.set_weight_bias(weight, state_dict.get(f"{name}.bias"))
+        _replace(t3, name, qlinear)
@@ -0,0 +1,94 @@
+from typing import Optional, Sequence, Union
+
+import torch
+from torch import Tensor
+
+
+Param = Union[float, Sequence[float], Tensor]
+
+
+class T3Sampler:
+    """
+    Batched next-token sampler for T3, replacing the chain of HF logits processors: CFG mixing, temperature,
+    repetition penalty, min-p and top-p are applied to all rows at once, with a single softmax.
+
+    Every parameter can be a scalar shared by all rows or one value per row, so that batched requests can each
+    have their own settings. The repetition penalty reads a preallocated (N, vocab) buffer of token counts instead
+    of the growing sequence of generated ids, and top-p only sorts the vocabulary if some row has `top_p < 1`.
+
+    The processing order (and the outputs, up to float rounding) match `RepetitionPenaltyLogitsProcessor`,
+    `MinPLogitsWarper` and `TopPLogitsWarper` as they were used in `T3.inference`.
+    """
+
+    def __init__(
+        self,
+        n_rows: int,
+        vocab_size: int,
+        *,
+        temperature: Param=0.8,
+        min_p: Param=0.05,
+        top_p: Param=1.0,
+        repetition_penalty: Param=1.2,
+        cfg_weight: Param=0.0,
+        device=None,
+    ):
+        row_param = lambda p: torch.as_tensor(p, dtype=torch.float, device=device).expand(n_rows).reshape(n_rows, 1)
+        self.temperature = row_param(temperature)
+        self.min_p = row_param(min_p)
+        self.top_p = row_param(top_p)
+        self.repetition_penalty = row_param(repetition_penalty)
+        self.cfg_weight = row_param(cfg_weight)
+        self.token_counts = torch.zeros(n_rows, vocab_size, dtype=torch.int32, device=device)
+
+    def __len__(self):
+        return self.token_counts.size(0)
+
+    def observe(self, tokens: Tensor):
+        "Counts (N, k) tokens towards the repetition penalty, e.g. the BOS token before the first step."
+        self.token_counts.scatter_add_(1, tokens, torch.ones_like(tokens, dtype=torch.int32))
+
+    def append(self, other: 'T3Sampler'):
+        "Adds the rows of `other` after the rows of this sampler (in place)."
+        for name in ("temperature", "min_p", "top_p", "repetition_penalty", "cfg_weight", "token_counts"):
+            setattr(self, name, torch.cat([getattr(self, name), getattr(other, name)]))
+
+    def select(self, rows: Tensor):
+        "Keeps only the given rows (in place)."
+        for name in ("temperature", "min_p", "top_p", "repetition_penalty", "cfg_weight", "token_counts"):
+            setattr(self, name, getattr(self, name).index_select(0, rows))
+
+    def __call__(self, logits: Tensor, uncond_logits: Optional[Tensor]=None) -> Tensor:
+        """
+        Args:
+            logits: (N, vocab) logits for the next token (the conditional rows with CFG).
+            uncond_logits: optional (N, vocab) unconditional logits for CFG; rows with `cfg_weight == 0` are
+                unaffected.
+        Returns:
+            (N, 1) sampled tokens, which are also counted towards the repetition penalty.
+        """
+        logits = logits.float()
+        if uncond_logits is not None:
+            logits = logits + self.cfg_weight * (logits - uncond_logits.float())
+
+        logits = logits / self.temperature
+
+        # Repetition penalty: scale down the logits of the tokens seen so far
+        penalty = self.repetition_penalty
+        penalized = torch.where(logits < 0, logits * penalty, logits / penalty)
+        logits = torch.where(self.token_counts > 0, penalized, logits)
+
+        # Min-p: drop the tokens less likely than `min_p` times the top token
+        probs = torch.softmax(logits, dim=-1)
+        probs = probs.masked_fill(probs < self.min_p * probs.amax(dim=-1, keepdim=True), 0)
+
+        # Top-p: keep the smallest set of tokens with a cumulative probability above `top_p`
+        if (self.top_p < 1.0).any():
+            probs = probs / probs.sum(dim=-1, keepdim=True)
+            sorted_probs, sorted_idx = torch.sort(probs, dim=-1)
+            sorted_remove = sorted_probs.cumsum(dim=-1) <= (1 - self.top_p)
+            sorted_remove[:, -1] = False  # always keep the top token
+            probs = probs.masked_fill(sorted_remove.scatter(1, sorted_idx, sorted_remove), 0)
+
+        next_tokens = torch.multinomial(probs, num_samples=1)  # (N, 1)
+        self.observe(next_tokens)
+        return next_tokens
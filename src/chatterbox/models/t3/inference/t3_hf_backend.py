@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from typing import Optional
 
 import torch
@@ -5,6 +6,8 @@ from torch import nn as nn
 from transformers import LlamaConfig, LlamaModel, LlamaPreTrainedModel, GenerationMixin
 from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
 
+from .alignment_stream_analyzer import add_attention_spy
+
 
 class T3HuggingfaceBackend(LlamaPreTrainedModel, GenerationMixin):
     """
@@ -73,34 +76,46 @@ class T3HuggingfaceBackend(LlamaPreTrainedModel, GenerationMixin):
     def forward(
         self,
         inputs_embeds: torch.Tensor,
+        attention_mask: Optional[torch.Tensor]=None,
+        position_ids: Optional[torch.LongTensor]=None,
         past_key_values: Optional[torch.Tensor]=None,
+        cache_position: Optional[torch.LongTensor]=None,
         use_cache=True,
         output_attentions=False,
-        output_hidden_states=True,
+        output_hidden_states=False,
         return_dict=True,
+        num_logits_to_keep: int=0,
     ):
         """
         This is a method used by huggingface's generate() method.
         Overridden here to apply our custom layer norm and speech logit projection layers.
 
-        :param inputs_embeds: (B, S, C) float32 tensor of conditioning inputs. If past key values are given,
-        S should be 1.
+        :param inputs_embeds: (B, S, C) float32 tensor of inputs, following the positions already in the cache.
+        :param attention_mask: optional (B, S_past + S) padding mask, for left-padded batches.
+        :param position_ids: optional (B, S) rotary positions, for left-padded batches.
+        :param cache_position: (S,) indices written in the cache; required with a preallocated `StaticCache`.
+        :param num_logits_to_keep: only compute the logits of the last N positions (0 for all of them); sampling
+        only needs the last one. To inspect attentions, prefer `capture_attention` over `output_attentions`, which
+        disables the SDPA kernels in every layer.
         """
-        is_large_input = inputs_embeds.size(1) != 1
-        has_cache = past_key_values is not None and len(past_key_values) > 0
-        assert not (is_large_input and has_cache)
+        # A prefill may continue a cache that already holds a prefix (e.g. the cached conditioning). A preallocated
+        # cache may also hold stale entries from a previous call; they're masked out past `cache_position`.
         assert return_dict
-        assert output_hidden_states
 
         tfmr_out = self.model(
             inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
             past_key_values=past_key_values,
+            cache_position=cache_position,
             use_cache=use_cache,
             output_attentions=output_attentions,
             output_hidden_states=output_hidden_states,
             return_dict=True,
         )
-        hidden_states = tfmr_out.hidden_states[-1]  # (B, seq, dim)
+        hidden_states = tfmr_out.last_hidden_state  # (B, seq, dim)
+        if num_logits_to_keep:
+            hidden_states = hidden_states[:, -num_logits_to_keep:]
 
         logits = self.speech_head(hidden_states)
         # assert inputs_embeds.size(0) == 1 # (disabled for CFG)
@@ -114,3 +129,16 @@ class T3HuggingfaceBackend(LlamaPreTrainedModel, GenerationMixin):
             hidden_states=tfmr_out.hidden_states,
             attentions=tfmr_out.attentions,
         )
+
+    @contextmanager
+    def capture_attention(self, layer_idx: int):
+        """
+        Records the attention weights of a single layer during the enclosed forward passes; the other layers keep
+        using the SDPA kernels. Yields a list that receives one (B, H, S, kv_len) tensor per forward.
+        """
+        attentions = []
+        spy = add_attention_spy(self.model, layer_idx, attentions.append)
+        try:
+            yield attentions
+        finally:
+            spy.remove()
@@ -1,6 +1,9 @@
 # Copyright (c) 2025 Resemble AI
 # MIT License
+import copy
 import logging
+import threading
+from dataclasses import replace
 from typing import Union, Optional, List
 
 from tqdm import tqdm
@@ -8,7 +11,7 @@ import torch
 import torch.nn.functional as F
 from torch import nn, Tensor
 from transformers import LlamaModel, LlamaConfig
-from transformers.generation.logits_process import MinPLogitsWarper, RepetitionPenaltyLogitsProcessor, TopPLogitsWarper
+from transformers.cache_utils import DynamicCache, StaticCache
 
 from .modules.learned_pos_emb import LearnedPositionEmbeddings
 
@@ -16,6 +19,8 @@ from .modules.cond_enc import T3CondEnc, T3Cond
 from .modules.t3_config import T3Config
 from .llama_configs import LLAMA_CONFIGS
 from .inference.t3_hf_backend import T3HuggingfaceBackend
+from .inference.sampler import T3Sampler
+from .inference.prefix_cache import CondPrefix, CondPrefixCache
 from ..utils import AttrDict
 
 
@@ -28,6 +33,15 @@ def _ensure_BOT_EOT(text_tokens: Tensor, hp):
     assert (text_tokens == hp.stop_text_token).int().sum() >= B, "missing stop_text_token"
 
 
+def _first_rows(cache: StaticCache, n_rows) -> StaticCache:
+    "A view of the first `n_rows` rows of a preallocated cache; updates are written into the original's memory."
+    view = copy.copy(cache)
+    view.key_cache = [k[:n_rows] for k in cache.key_cache]
+    view.value_cache = [v[:n_rows] for v in cache.value_cache]
+    view.batch_size = n_rows
+    return view
+
+
 class T3(nn.Module):
     """
     Token-To-Token (T3) TTS model using huggingface transformer models as backbones,
@@ -62,19 +76,34 @@ class T3(nn.Module):
         # logit projection
         self.text_head = nn.Linear(self.cfg.hidden_size, hp.text_tokens_dict_size, bias=False)
         self.speech_head = nn.Linear(self.cfg.hidden_size, hp.speech_tokens_dict_size, bias=False)
-        self.compiled = False
+
+        # The inference wrapper shares the modules above; it's kept out of the module tree (and the state dict),
+        # where it would duplicate the backbone. See `compile_decode_step` for `decode_step`.
+        object.__setattr__(self, "backend", self._build_backend())
+        object.__setattr__(self, "decode_step", self.backend)
+
+        # Idle kv caches kept for reuse, since allocating one per call is a large part of the fixed latency
+        self.max_idle_caches = 2
+        self._idle_caches = []
+        self._idle_caches_lock = threading.Lock()
+
+        # Conditioning prefix keys / values per voice and exaggeration, see `cond_prefix`
+        self.cond_prefixes = CondPrefixCache()
 
     @property
     def device(self):
-        return self.speech_head.weight.device
+        return self.speech_emb.weight.device
 
     def prepare_conditioning(self, t3_cond: T3Cond):
         """
         Token cond data needs to be embedded, so that needs to be here instead of in `T3CondEnc`.
         """
         if t3_cond.cond_prompt_speech_tokens is not None and t3_cond.cond_prompt_speech_emb is None:
-            t3_cond.cond_prompt_speech_emb = self.speech_emb(t3_cond.cond_prompt_speech_tokens) + \
+            # embed into a copy: the caller's conditionals may be shared between concurrent requests
+            t3_cond = replace(t3_cond, cond_prompt_speech_emb=(
+                self.speech_emb(t3_cond.cond_prompt_speech_tokens) +
                 self.speech_pos_emb(t3_cond.cond_prompt_speech_tokens)
+            ))
         return self.cond_enc(t3_cond)  # (B, len_cond, dim)
 
     def prepare_input_embeds(
@@ -84,9 +113,11 @@ class T3(nn.Module):
         text_tokens: torch.LongTensor,
         speech_tokens: torch.LongTensor,
         cfg_weight: float = 0.0,
+        cond_emb: Optional[Tensor] = None,
     ):
         # prepare input embeddings (skip backbone tranformer embeddings)
-        cond_emb = self.prepare_conditioning(t3_cond)  # (B, len_cond, dim)
+        if cond_emb is None:
+            cond_emb = self.prepare_conditioning(t3_cond)  # (B, len_cond, dim)
         text_emb = self.text_emb(text_tokens)  # (B, len_text, dim)
         if cfg_weight > 0.0:
             text_emb[1].zero_()  # CFG uncond
@@ -201,7 +232,19 @@ class T3(nn.Module):
         return loss_text, loss_speech
 
     @torch.inference_mode()
-    def inference(
+    def inference(self, **kwargs):
+        """
+        Runs the full sampling loop and returns all predicted speech tokens, including the trailing
+        `stop_speech_token` if one was sampled. See `inference_stream` for the arguments.
+
+        Returns:
+            (B, num_tokens) long tensor of predicted speech tokens.
+        """
+        predicted = list(self.inference_stream(**kwargs))
+        return torch.cat(predicted, dim=1)  # shape: (B, num_tokens)
+
+    @torch.inference_mode()
+    def inference_stream(
         self,
         *,
         t3_cond: T3Cond,
@@ -222,63 +265,45 @@ class T3(nn.Module):
         length_penalty=1.0,
         repetition_penalty=1.2,
         cfg_weight=0,
+        cfg_tokens: Optional[int]=None,
     ):
         """
+        Generator version of `inference`: yields each sampled speech token as soon as it is predicted,
+        so that downstream stages (e.g. S3Gen) can start working before the utterance is complete.
+
         Args:
             text_tokens: a 1D (unbatched) or 2D (batched) tensor.
+            cfg_tokens: with CFG, only guide the first `cfg_tokens` tokens; the unconditional rows are then
+                dropped, which halves the batch for the rest of the utterance. Defaults to guiding every token,
+                and 0 is the same as `cfg_weight=0`.
+        Yields:
+            (B, 1) long tensors; the last one is the `stop_speech_token` if EOS was reached.
         """
         # Validate / sanitize inputs
         assert prepend_prompt_speech_tokens is None, "not implemented"
         _ensure_BOT_EOT(text_tokens, self.hp)
         text_tokens = torch.atleast_2d(text_tokens).to(dtype=torch.long, device=self.device)
+        if cfg_weight > 0.0 and cfg_tokens == 0:
+            # Not a single guided token: same as no CFG, so drop the unconditional rows before the prefill
+            text_tokens = text_tokens[:text_tokens.size(0) // 2]
+            cfg_weight = 0.0
 
         # Default initial speech to a single start-of-speech token
         if initial_speech_tokens is None:
             initial_speech_tokens = self.hp.start_speech_token * torch.ones_like(text_tokens[:, :1])
 
+        # The conditioning prefix is shared by all rows; reuse its embeddings and keys / values if it's cached
+        prefix = self.cond_prefix(t3_cond) if t3_cond.speaker_emb.size(0) == 1 else None
+
         # Prepare custom input embeds
         embeds, len_cond = self.prepare_input_embeds(
             t3_cond=t3_cond,
             text_tokens=text_tokens,
             speech_tokens=initial_speech_tokens,
             cfg_weight=cfg_weight,
+            cond_emb=prefix.cond_emb if prefix is not None else None,
         )
 
-        # In order to use the standard HF generate method, we need to extend some methods to inject our custom logic
-        # Note the llama-specific logic. Other tfmr types can be added later.
-
-        self.compiled = False
-
-        # TODO? synchronize the expensive compile function
-        # with self.compile_lock:
-        if not self.compiled:
-            patched_model = T3HuggingfaceBackend(
-                config=self.cfg,
-                llama=self.tfmr,
-                speech_enc=self.speech_emb,
-                speech_head=self.speech_head,
-                alignment_stream_analyzer=None,
-            )
-            self.patched_model = patched_model
-            self.compiled = True
-
-        # # Run normal generate method, which calls our custom extended methods
-        # return self.patched_model.generate(
-        #     inputs=initial_speech_tokens,
-        #     decoder_cond=embeds,
-        #     bos_token_id=self.hp.start_speech_token,
-        #     eos_token_id=(self.hp.stop_speech_token if stop_on_eos else -1),
-        #     pad_token_id=self.hp.stop_speech_token,
-        #     max_new_tokens=max_new_tokens or self.hp.max_speech_tokens,
-        #     num_return_sequences=num_return_sequences,
-        #     temperature=temperature,
-        #     min_p=min_p,
-        #     length_penalty=length_penalty,
-        #     repetition_penalty=repetition_penalty,
-        #     do_sample=do_sample,
-        #     # cache_implementation=None if not self.compiled else "static",
-        # )
-
         device = embeds.device
 
         bos_token = torch.tensor([[self.hp.start_speech_token]], dtype=torch.long, device=device)
@@ -294,78 +319,314 @@ class T3(nn.Module):
         else:
             inputs_embeds = embeds
 
-        # Track generated token ids; start with the BOS token.
-        generated_ids = bos_token.clone()
-        predicted = []  # To store the predicted tokens
-
-        # Instantiate the logits processors.
-        min_p_warper = MinPLogitsWarper(min_p=min_p)
-        top_p_warper = TopPLogitsWarper(top_p=top_p)
-        repetition_penalty_processor = RepetitionPenaltyLogitsProcessor(penalty=float(repetition_penalty))
-
-        # ---- Initial Forward Pass (no kv_cache yet) ----
-        output = self.patched_model(
+        yield from self._sample_stream(
             inputs_embeds=inputs_embeds,
-            past_key_values=None,
-            use_cache=True,
-            output_attentions=True,
-            output_hidden_states=True,
-            return_dict=True,
+            attention_mask=None,
+            prefix=prefix,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            min_p=min_p,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            cfg_weight=cfg_weight,
+            cfg_tokens=cfg_tokens,
         )
-        # Initialize kv_cache with the full context.
-        past = output.past_key_values
 
-        # ---- Generation Loop using kv_cache ----
-        for i in tqdm(range(max_new_tokens), desc="Sampling", dynamic_ncols=True):
-            logits = output.logits[:, -1, :]
+    @torch.inference_mode()
+    def inference_batch(
+        self,
+        *,
+        t3_conds: List[T3Cond],
+        text_tokens: List[Tensor],
+        max_new_tokens=None,
+        temperature=0.8,
+        min_p=0.05,
+        top_p=1.00,
+        repetition_penalty=1.2,
+        cfg_weight=0,
+        cfg_tokens: Optional[int]=None,
+    ):
+        """
+        Batched version of `inference` for N independent requests, so the backbone forward is shared
+        between them. The prompts are left-padded to a common length and masked out, and decoding runs
+        until every row has produced a `stop_speech_token`.
+
+        Args:
+            t3_conds: N conditionals with batch size 1, one per request.
+            text_tokens: N 1D text token tensors, each including the start / stop text tokens.
+            temperature, min_p, top_p, repetition_penalty: either shared by all requests or one value per request.
+            cfg_tokens: see `inference_stream`.
+        Returns:
+            list of N 1D long tensors of predicted speech tokens, each ending with the `stop_speech_token`
+            if EOS was reached.
+        """
+        assert len(t3_conds) == len(text_tokens), "need exactly one T3Cond per text"
+        device = self.device
+        if cfg_tokens == 0:
+            cfg_weight = 0.0
+
+        bos_token = torch.tensor([[self.hp.start_speech_token]], dtype=torch.long, device=device)
+        bos_embed = self.speech_emb(bos_token) + self.speech_pos_emb.get_fixed_embedding(0)  # (1, 1, dim)
 
-            # CFG
+        # Build each request's prompt on its own (conditioning lengths may differ between voices)
+        cond_seqs, uncond_seqs = [], []
+        for t3_cond, tokens in zip(t3_conds, text_tokens):
+            tokens = torch.atleast_2d(tokens).to(dtype=torch.long, device=device)
+            _ensure_BOT_EOT(tokens, self.hp)
+            if cfg_weight > 0.0:
+                tokens = torch.cat([tokens, tokens], dim=0)  # Need two seqs for CFG
+            embeds, _ = self.prepare_input_embeds(
+                t3_cond=t3_cond,
+                text_tokens=tokens,
+                speech_tokens=bos_token.expand(tokens.size(0), 1),
+                cfg_weight=cfg_weight,
+            )
             if cfg_weight > 0.0:
-                logits_cond = logits[0:1]
-                logits_uncond = logits[1:2]
-                logits = logits_cond + cfg_weight * (logits_cond - logits_uncond)
+                # same prompt layout as `inference_stream`
+                embeds = torch.cat([embeds, bos_embed.expand(2, -1, -1)], dim=1)
+                uncond_seqs.append(embeds[1])
+            cond_seqs.append(embeds[0])
+
+        # Rows are ordered [cond_0 .. cond_N-1, uncond_0 .. uncond_N-1]; left-pad to a common length.
+        seqs = cond_seqs + uncond_seqs
+        max_len = max(seq.size(0) for seq in seqs)
+        inputs_embeds = torch.zeros(len(seqs), max_len, self.dim, dtype=seqs[0].dtype, device=device)
+        attention_mask = torch.zeros(len(seqs), max_len, dtype=torch.long, device=device)
+        for i, seq in enumerate(seqs):
+            inputs_embeds[i, max_len - seq.size(0):] = seq
+            attention_mask[i, max_len - seq.size(0):] = 1
+
+        predicted = list(self._sample_stream(
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            min_p=min_p,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            cfg_weight=cfg_weight,
+            cfg_tokens=cfg_tokens,
+        ))
+        predicted = torch.cat(predicted, dim=1)  # (N, num_tokens)
 
-            logits = logits.squeeze(1)
+        # Trim each row after its first EOS (finished rows keep emitting EOS as padding)
+        outputs = []
+        for row in predicted:
+            eos = (row == self.hp.stop_speech_token).nonzero()
+            outputs.append(row[:eos[0, 0] + 1] if len(eos) else row)
+        return outputs
 
-            # Apply temperature scaling.
-            if temperature != 1.0:
-                logits = logits / temperature
+    @torch.inference_mode()
+    def cond_prefix(self, t3_cond: T3Cond) -> CondPrefix:
+        """
+        Returns the conditioning embeddings of `t3_cond` (batch size 1) and their keys / values in the backbone,
+        from `self.cond_prefixes` or computed and cached on a miss. Call `self.cond_prefixes.clear()` after
+        changing the weights.
+        """
+        key = self.cond_prefixes.key(t3_cond, self.speech_emb.weight.dtype)
+        prefix = self.cond_prefixes.get(key)
+        if prefix is None:
+            cond_emb = self.prepare_conditioning(t3_cond)  # (1, len_cond, dim)
+            assert cond_emb.size(0) == 1, "the conditioning prefix is cached per voice (batch size 1)"
+            cache = DynamicCache()
+            self.backend(inputs_embeds=cond_emb, past_key_values=cache, use_cache=True, num_logits_to_keep=1)
+            prefix = CondPrefix(cond_emb, cache.key_cache, cache.value_cache)
+            self.cond_prefixes.put(key, prefix)
+        return prefix
+
+    def _build_backend(self):
+        """
+        Wraps the backbone in a `T3HuggingfaceBackend`. Called once from `__init__`: the wrapper holds no
+        per-call state, so every inference call (including concurrent ones) shares `self.backend`.
+        """
+        # In order to use the standard HF generate method, we need to extend some methods to inject our custom logic
+        # Note the llama-specific logic. Other tfmr types can be added later.
+        return T3HuggingfaceBackend(
+            config=self.cfg,
+            llama=self.tfmr,
+            speech_enc=self.speech_emb,
+            speech_head=self.speech_head,
+            alignment_stream_analyzer=None,
+        )
 
-            # Apply repetition penalty and top‑p filtering.
-            logits = repetition_penalty_processor(generated_ids, logits)
-            logits = min_p_warper(None, logits)
-            logits = top_p_warper(None, logits)
+    def compile_decode_step(self, **compile_kwargs):
+        """
+        Compiles the per-token forward of the sampling loop with `torch.compile` (kwargs are passed on to it).
+        The prefill stays eager, since its length changes with every prompt.
+        """
+        object.__setattr__(self, "decode_step", torch.compile(self.backend, **compile_kwargs))
 
-            # Convert logits to probabilities and sample the next token.
-            probs = torch.softmax(logits, dim=-1)
-            next_token = torch.multinomial(probs, num_samples=1)  # shape: (B, 1)
+    def quantize_int8(self, state_dict=None):
+        """
+        Switches the Linear layers of the backbone and `speech_head` to int8 weights for CPU inference (see
+        `inference.quantize`), in place. Without `state_dict` the current fp32 weights are quantized; otherwise all
+        weights are loaded from it, as saved from `inference.quantize.int8_state_dict`. Call
+        `compile_decode_step` again afterwards if it was compiled.
+        """
+        from .inference.quantize import quantize_linears, load_int8_state_dict  # imports torch.ao.quantization
 
-            predicted.append(next_token)
-            generated_ids = torch.cat([generated_ids, next_token], dim=1)
+        if state_dict is None:
+            quantize_linears(self)
+        else:
+            load_int8_state_dict(self, state_dict)
+        object.__setattr__(self, "backend", self._build_backend())
+        object.__setattr__(self, "decode_step", self.backend)
+        self.cond_prefixes.clear()
 
-            # Check for EOS token.
-            if next_token.view(-1) == self.hp.stop_speech_token:
-                break
+    def _acquire_cache(self, batch_size, max_cache_len, dtype, device) -> StaticCache:
+        """
+        Returns an idle `StaticCache` of the right shape, or allocates one; hand it back with `_release_cache`.
+        Lengths are rounded up so that caches can be reused across prompts. Stale entries from a previous call
+        don't need clearing: they always lie past `cache_position`, where the causal mask hides them.
+        """
+        max_cache_len = -(-max_cache_len // 256) * 256
+        with self._idle_caches_lock:
+            for i, cache in enumerate(self._idle_caches):
+                layer = cache.key_cache[0]
+                if (cache.batch_size, cache.max_cache_len, layer.dtype, layer.device) == \
+                        (batch_size, max_cache_len, dtype, device):
+                    return self._idle_caches.pop(i)
+        return StaticCache(
+            config=self.cfg,
+            batch_size=batch_size,
+            max_cache_len=max_cache_len,
+            device=device,
+            dtype=dtype,
+        )
 
-            # Get embedding for the new token.
-            next_token_embed = self.speech_emb(next_token)
-            next_token_embed = next_token_embed + self.speech_pos_emb.get_fixed_embedding(i + 1)
+    def _release_cache(self, cache: StaticCache):
+        with self._idle_caches_lock:
+            self._idle_caches.append(cache)
+            while len(self._idle_caches) > self.max_idle_caches:
+                self._idle_caches.pop(0)
 
-            #  For CFG
-            if cfg_weight > 0.0:
-                next_token_embed = torch.cat([next_token_embed, next_token_embed])
+    def _sample_stream(
+        self,
+        *,
+        inputs_embeds: Tensor,
+        attention_mask: Optional[Tensor],
+        max_new_tokens,
+        temperature,
+        min_p,
+        top_p,
+        repetition_penalty,
+        cfg_weight,
+        cfg_tokens: Optional[int]=None,
+        prefix: Optional[CondPrefix]=None,
+    ):
+        """
+        The sampling loop shared by `inference_stream` and `inference_batch`.
+
+        Args:
+            inputs_embeds: (B, T, dim) prompt embeddings, ending with the BOS speech embedding. With CFG, the
+                first B/2 rows are conditional and the last B/2 are the matching unconditional rows.
+            attention_mask: optional (B, T) mask for left-padded prompts.
+            cfg_tokens: with CFG, the number of tokens to guide before dropping the unconditional rows.
+            prefix: optional `CondPrefix` matching the first positions of `inputs_embeds` (not with
+                `attention_mask`); its cached keys / values are used instead of prefilling those positions.
+        Yields:
+            (B or B/2 with CFG, 1) long tensors; rows that already produced an EOS keep producing EOS.
+        """
+        backend, decode_step = self.backend, self.decode_step
+
+        max_new_tokens = max_new_tokens or self.hp.max_speech_tokens
+        device = inputs_embeds.device
+        guided = cfg_weight > 0.0
+        n_rows = inputs_embeds.size(0) // 2 if guided else inputs_embeds.size(0)
+
+        # Rotary positions must skip the left padding, so that each row sees the positions it would have unbatched.
+        position_ids = None
+        if attention_mask is not None:
+            position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+
+        finished = torch.zeros(n_rows, dtype=torch.bool, device=device)
+
+        # The sampler counts the generated tokens for the repetition penalty; start with the BOS token.
+        sampler = T3Sampler(
+            n_rows,
+            self.hp.speech_tokens_dict_size,
+            temperature=temperature,
+            min_p=min_p,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            cfg_weight=cfg_weight,
+            device=device,
+        )
+        sampler.observe(torch.full((n_rows, 1), self.hp.start_speech_token, dtype=torch.long, device=device))
 
-            # Forward pass with only the new token and the cached past.
-            output = self.patched_model(
-                inputs_embeds=next_token_embed,
+        # Preallocate the kv_cache for the whole utterance; each step writes its keys / values in place at
+        # `cache_position` instead of growing every layer's cache by concatenation.
+        past = self._acquire_cache(
+            inputs_embeds.size(0), inputs_embeds.size(1) + max_new_tokens, inputs_embeds.dtype, device,
+        )
+        step_past = past  # the rows being decoded, see `_first_rows`
+        try:
+            cache_position = torch.arange(inputs_embeds.size(1), device=device)
+            if prefix is not None:
+                assert attention_mask is None, "a cached prefix can't be combined with left padding"
+                prefix.fill(past)
+                cache_position = cache_position[len(prefix):]
+
+            # ---- Initial Forward Pass (empty kv_cache, or just the cached prefix) ----
+            output = backend(
+                inputs_embeds=inputs_embeds[:, cache_position[0]:],
+                attention_mask=attention_mask,
+                position_ids=position_ids,
                 past_key_values=past,
-                output_attentions=True,
-                output_hidden_states=True,
+                cache_position=cache_position,
+                use_cache=True,
+                num_logits_to_keep=1,
                 return_dict=True,
             )
-            # Update the kv_cache.
-            past = output.past_key_values
-
-        # Concatenate all predicted tokens along the sequence dimension.
-        predicted_tokens = torch.cat(predicted, dim=1)  # shape: (B, num_tokens)
-        return predicted_tokens
+            # ---- Generation Loop using kv_cache ----
+            for i in tqdm(range(max_new_tokens), desc="Sampling", dynamic_ncols=True):
+                logits = output.logits[:, -1, :]
+
+                # CFG, temperature, repetition penalty, min-p and top-p, then sample the next token.
+                if guided:
+                    next_token = sampler(logits[:n_rows], logits[n_rows:])  # shape: (B, 1)
+                else:
+                    next_token = sampler(logits)
+
+                # Rows that are already done keep emitting EOS
+                next_token = next_token.masked_fill(finished[:, None], self.hp.stop_speech_token)
+
+                yield next_token
+
+                # Check for EOS token.
+                finished |= next_token.view(-1) == self.hp.stop_speech_token
+                if finished.all():
+                    break
+
+                # Get embedding for the new token.
+                next_token_embed = self.speech_emb(next_token)
+                next_token_embed = next_token_embed + self.speech_pos_emb.get_fixed_embedding(i + 1)
+
+                # Past `cfg_tokens`, drop the unconditional rows and decode the conditional ones alone
+                if guided and cfg_tokens is not None and i + 1 >= cfg_tokens:
+                    guided = False
+                    step_past = _first_rows(past, n_rows)
+                    if attention_mask is not None:
+                        attention_mask, position_ids = attention_mask[:n_rows], position_ids[:n_rows]
+
+                #  For CFG
+                if guided:
+                    next_token_embed = torch.cat([next_token_embed, next_token_embed])
+
+                if attention_mask is not None:
+                    attention_mask = F.pad(attention_mask, (0, 1), value=1)
+                    position_ids = position_ids[:, -1:] + 1
+                cache_position = cache_position[-1:] + 1
+
+                # Forward pass with only the new token and the cached past.
+                output = decode_step(
+                    inputs_embeds=next_token_embed,
+                    attention_mask=attention_mask,
+                    position_ids=position_ids,
+                    past_key_values=step_past,
+                    cache_position=cache_position,
+                    num_logits_to_keep=1,
+                    return_dict=True,
+                )
+        finally:
+            self._release_cache(past)
@@ -1,4 +1,50 @@
+from contextlib import contextmanager
+
+import torch
+from torch import nn
+
+
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
         super(AttrDict, self).__init__(*args, **kwargs)
         self.__dict__ = self
+
+
+@contextmanager
+def init_empty_weights():
+    """
+    Modules constructed in this context have their parameters on the meta device: they take no memory and their
+    random initialization is a no-op, until `load_weights` assigns the checkpoint tensors to them. Buffers and other
+    tensors computed in `__init__` (rotary frequencies, positional encodings, filterbanks, fixed noise) are created
+    as usual, since checkpoints don't hold all of them. Not thread-safe: it patches `nn.Module.register_parameter`.
+    """
+    register_parameter = nn.Module.register_parameter
+
+    def register_empty_parameter(module, name, param):
+        if param is not None:
+            param = nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+        register_parameter(module, name, param)
+
+    nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
+
+def load_weights(module: nn.Module, state_dict, strict=True):
+    """
+    Loads `state_dict` into a module constructed under `init_empty_weights`, taking over its tensors rather than
+    copying them: tensors from `safetensors.torch.load_file` are memory-mapped, so the weights are read from the
+    page cache on first use and never held twice. Modules whose parameters are all missing from a non-strict load
+    are initialized with their `reset_parameters`, as if they had been constructed normally.
+    """
+    module.load_state_dict(state_dict, strict=strict, assign=True)
+    for submodule in module.modules():
+        params = list(submodule.parameters(recurse=False))
+        if any(p.is_meta for p in params):
+            assert all(p.is_meta for p in params) and hasattr(submodule, "reset_parameters"), \
+                f"missing weights in {type(submodule).__name__}"
+            submodule.to_empty(device="cpu", recurse=False)
+            submodule.reset_parameters()
+    return module
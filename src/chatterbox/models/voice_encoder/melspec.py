@@ -1,14 +1,15 @@
 from functools import lru_cache
 
-from scipy import signal
 import numpy as np
 import librosa
 
+from ..mel_filters import mel_filters
+
 
 @lru_cache()
 def mel_basis(hp):
     assert hp.fmax <= hp.sample_rate // 2
-    return librosa.filters.mel(
+    return mel_filters(
         sr=hp.sample_rate,
         n_fft=hp.n_fft,
         n_mels=hp.num_mels,
@@ -18,6 +19,7 @@ def mel_basis(hp):
 
 def preemphasis(wav, hp):
     assert hp.preemphasis != 0
+    from scipy import signal  # slow to import, and preemphasis is off by default
     wav = signal.lfilter([1, -hp.preemphasis], [1], wav)
     wav = np.clip(wav, -1, 1)
     return wav
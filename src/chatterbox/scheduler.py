@@ -0,0 +1,283 @@
+import itertools
+import logging
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, InvalidStateError
+
+import torch
+
+from .models.t3.inference.decode_batch import T3DecodeBatch, T3Request
+from .tts import ChatterboxTTS, Conditionals, crossfade_join, split_sentences
+
+
+logger = logging.getLogger(__name__)
+
+
+class _FairQueue:
+    """
+    Queue of pending requests that serves groups round-robin: each `submit` is its own group, and the chunks of a
+    `submit_long` share one, so a long text is admitted one chunk per turn instead of ahead of every later request.
+    """
+
+    def __init__(self):
+        self._groups = OrderedDict()  # group id -> deque of requests, in turn order
+        self._cond = threading.Condition()
+
+    def put_group(self, group_id, requests):
+        with self._cond:
+            self._groups.setdefault(group_id, deque()).extend(requests)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        "Pops the next request of the group whose turn it is; raises `queue.Empty` after `timeout`."
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._groups, timeout):
+                raise queue.Empty
+            group_id, requests = next(iter(self._groups.items()))
+            request = requests.popleft()
+            if requests:
+                self._groups.move_to_end(group_id)
+            else:
+                del self._groups[group_id]
+            return request
+
+    def get_nowait(self):
+        return self.get(timeout=0)
+
+    def empty(self):
+        with self._cond:
+            return not self._groups
+
+
+class TTSScheduler:
+    """
+    Continuous-batching front end for a shared `ChatterboxTTS` model, for serving concurrent requests.
+
+    A decode thread admits queued requests into a running `T3DecodeBatch` between decoding steps (up to
+    `max_batch_size` at once) and retires them as soon as they emit EOS. Finished token sequences are handed to
+    `vocode_workers` vocoder threads that run S3Gen and the watermarker, so the T3 batch keeps decoding meanwhile;
+    requests that finish while a vocoder thread is busy are vocoded together in one batched S3Gen pass. Queued
+    requests are admitted round-robin per `submit` / `submit_long` call, so the chunks of a long text take turns
+    with later requests.
+
+    `submit` is thread-safe and returns a `concurrent.futures.Future` resolving to a (1, T) waveform; in async code
+    wrap it with `asyncio.wrap_future`. The future stays pending until it is resolved, so it can be cancelled at any
+    time: a queued request is dropped, a decoding one leaves the T3 batch at its next step, and a finished one is
+    not vocoded.
+    """
+
+    def __init__(self, model: ChatterboxTTS, max_batch_size=8, vocode_workers=1):
+        assert max_batch_size >= 1 and vocode_workers >= 1
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.vocode_workers = vocode_workers
+        self._pending = _FairQueue()
+        self._group_ids = itertools.count()
+        self._finished = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        assert not self._threads, "already started"
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._decode_loop, name="chatterbox-t3", daemon=True)] + [
+            threading.Thread(target=self._vocode_loop, name=f"chatterbox-s3gen-{i}", daemon=True)
+            for i in range(self.vocode_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        "Stops the worker threads, if started; requests that are still pending or decoding are cancelled."
+        if self._threads:
+            self._stop.set()
+            self._threads[0].join()
+            for _ in range(self.vocode_workers):
+                self._finished.put(None)
+            for thread in self._threads[1:]:
+                thread.join()
+            self._threads = []
+        while not self._pending.empty():
+            self._pending.get_nowait().user_data[0].cancel()
+
+    def submit(self, text, conds: Conditionals = None, **kwargs) -> Future:
+        """
+        Queues one utterance; same keyword arguments as `ChatterboxTTS.generate` plus `max_new_tokens`, with the
+        voice given as `conds` (see `ChatterboxTTS.get_conditionals`) instead of an audio prompt path. Defaults to
+        `model.conds`.
+        """
+        request = self._make_request(text, conds, **kwargs)
+        self._pending.put_group(next(self._group_ids), [request])
+        return request.user_data[0]
+
+    def _make_request(
+        self,
+        text,
+        conds: Conditionals = None,
+        repetition_penalty=1.2,
+        min_p=0.05,
+        top_p=1.0,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        max_new_tokens=1000,
+        cfg_tokens=None,
+        flow_cfg_rate=None,
+        flow_cfg_steps=None,
+        flow_steps=10,
+        flow_solver=None,
+    ) -> T3Request:
+        model = self.model
+        if conds is None:
+            assert model.conds is not None, "Please `prepare_conditionals` first or specify `conds`"
+            conds = model.conds
+
+        future = Future()
+        return T3Request(
+            t3_cond=model._with_exaggeration(conds.t3, exaggeration),
+            text_tokens=model._tokenize_text(text)[0],
+            cfg_weight=cfg_weight,
+            temperature=temperature,
+            min_p=min_p,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            max_new_tokens=max_new_tokens,
+            cfg_tokens=cfg_tokens,
+            user_data=(future, conds.gen, dict(
+                n_timesteps=flow_steps, solver=flow_solver, cfg_rate=flow_cfg_rate, cfg_steps=flow_cfg_steps,
+            )),
+        )
+
+    def submit_long(self, text, max_chunk_chars=300, crossfade_ms=50, max_chunks=None, **kwargs) -> Future:
+        """
+        Queues text of any length (see `ChatterboxTTS.generate_long`): its sentence chunks are submitted as separate
+        requests, so they are decoded in the same T3 batch and vocoded as each one finishes. The chunks are admitted
+        one per turn with the other queued requests. The returned future resolves to their cross-faded
+        concatenation; cancelling it cancels the chunks that aren't done yet. Raises `ValueError` if the text splits
+        into more than `max_chunks` chunks. The other arguments are the same as in `submit`.
+        """
+        chunks = split_sentences(text, max_chunk_chars)
+        assert chunks, "text is empty"
+        if max_chunks is not None and len(chunks) > max_chunks:
+            raise ValueError(f"Text too long ({len(chunks)} chunks, max {max_chunks})")
+        requests = [self._make_request(chunk, **kwargs) for chunk in chunks]
+        self._pending.put_group(next(self._group_ids), requests)
+        chunk_futures = [request.user_data[0] for request in requests]
+        future = Future()
+        remaining = [len(chunk_futures)]
+        lock = threading.Lock()
+
+        def on_chunk_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            try:
+                wavs = [chunk_future.result() for chunk_future in chunk_futures]
+                future.set_result(crossfade_join(wavs, int(crossfade_ms * self.model.sr / 1000)))
+            except InvalidStateError:  # cancelled meanwhile
+                pass
+            except BaseException as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        def on_done(_):
+            if future.cancelled():
+                for chunk_future in chunk_futures:
+                    chunk_future.cancel()
+
+        future.add_done_callback(on_done)
+        for chunk_future in chunk_futures:
+            chunk_future.add_done_callback(on_chunk_done)
+        return future
+
+    def _decode_loop(self):
+        batch = T3DecodeBatch(self.model.t3)
+        while not self._stop.is_set():
+            # Admit new requests; only block (briefly, to notice `stop`) when there is nothing to decode
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self._pending.get(timeout=0.1) if len(batch) == 0 else self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                future = request.user_data[0]
+                if future.cancelled():
+                    continue
+                try:
+                    batch.add(request)
+                except Exception as e:
+                    logger.exception("T3 prefill failed")
+                    _set_exception(future, e)
+
+            if len(batch) == 0:
+                continue
+
+            for request in batch.requests:
+                request.cancelled = request.user_data[0].cancelled()
+
+            try:
+                finished = batch.step()
+            except Exception as e:
+                logger.exception("T3 decoding step failed")
+                for request in batch.requests:
+                    _set_exception(request.user_data[0], e)
+                batch = T3DecodeBatch(self.model.t3)
+                continue
+
+            for request in finished:
+                self._finished.put(request)
+
+        for request in batch.requests:
+            _set_exception(request.user_data[0], RuntimeError("scheduler stopped"))
+
+    def _vocode_loop(self):
+        stopping = False
+        while not stopping:
+            # Vocode all the requests that finished meanwhile in one S3Gen batch (per flow decoder setting)
+            requests = [self._finished.get()]
+            while len(requests) < self.max_batch_size:
+                try:
+                    requests.append(self._finished.get_nowait())
+                except queue.Empty:
+                    break
+            if None in requests:
+                stopping = True
+                for _ in range(requests.count(None) - 1):
+                    self._finished.put(None)  # the other vocoder threads' stop signals
+                requests = [request for request in requests if request is not None]
+
+            by_flow_kwargs = {}
+            for request in requests:
+                if not request.user_data[0].cancelled():
+                    by_flow_kwargs.setdefault(tuple(sorted(request.user_data[2].items())), []).append(request)
+            for flow_kwargs, batch in by_flow_kwargs.items():
+                self._vocode(batch, dict(flow_kwargs))
+
+    def _vocode(self, requests, flow_kwargs):
+        try:
+            with torch.inference_mode():
+                wavs = self.model._tokens_to_wav_batch(
+                    [request.speech_tokens for request in requests],
+                    [request.user_data[1] for request in requests],
+                    **flow_kwargs,
+                )
+        except Exception as e:
+            logger.exception("S3Gen vocoding failed")
+            for request in requests:
+                _set_exception(request.user_data[0], e)
+            return
+        for request, wav in zip(requests, wavs):
+            try:
+                request.user_data[0].set_result(wav)
+            except InvalidStateError:  # cancelled meanwhile
+                pass
+
+
+def _set_exception(future: Future, exception):
+    "Fails `future` unless it was cancelled meanwhile."
+    try:
+        future.set_exception(exception)
+    except InvalidStateError:
+        pass
@@ -1,19 +1,28 @@
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Callable, List, Union
 
 import librosa
 import torch
-import perth
 import torch.nn.functional as F
 from huggingface_hub import hf_hub_download
 from safetensors.torch import load_file
 
+from .audio_io import load_audio
 from .models.t3 import T3
-from .models.s3tokenizer import S3_SR, drop_invalid_tokens
+from .models.s3tokenizer import S3_SR, SPEECH_VOCAB_SIZE, drop_invalid_tokens
 from .models.s3gen import S3GEN_SR, S3Gen
 from .models.tokenizers import EnTokenizer
 from .models.voice_encoder import VoiceEncoder
 from .models.t3.modules.cond_enc import T3Cond
+from .models.utils import init_empty_weights, load_weights
 
 
 REPO_ID = "ResembleAI/chatterbox"
@@ -61,6 +70,51 @@ def punc_norm(text: str) -> str:
     return text
 
 
+def split_sentences(text: str, max_chars=300) -> List[str]:
+    """
+    Splits long text into chunks of whole sentences of at most `max_chars` characters, for
+    `ChatterboxTTS.generate_long`. Longer sentences are split at clause boundaries, then between words, and words
+    longer than `max_chars` are cut, so that no chunk exceeds it.
+    """
+    def pieces(text, pattern):
+        return [piece for piece in re.split(pattern, text) if piece]
+
+    def split(sentence):
+        if len(sentence) <= max_chars:
+            return [sentence]
+        clauses = pieces(sentence, r"(?<=[,;:—–])\s+")
+        if len(clauses) == 1:
+            words = sentence.split(" ")
+            return [word[i:i + max_chars] for word in words for i in range(0, len(word), max_chars)]
+        return [part for clause in clauses for part in split(clause)]
+
+    text = " ".join(text.split())
+    sentences = pieces(text, r"(?<=[.!?…])\s+|(?<=[.!?…][\"')”’])\s+")
+
+    chunks = []
+    for part in (part for sentence in sentences for part in split(sentence)):
+        if chunks and len(chunks[-1]) + 1 + len(part) <= max_chars:
+            chunks[-1] += " " + part
+        else:
+            chunks.append(part)
+    return chunks
+
+
+def crossfade_join(wavs: List[torch.Tensor], n_fade: int) -> torch.Tensor:
+    "Concatenates (1, T) waveforms, cross-fading consecutive ones over `n_fade` samples."
+    pieces, tail = [], wavs[0]
+    for wav in wavs[1:]:
+        n = min(n_fade, tail.size(1), wav.size(1))
+        if n > 0:
+            fade_in = (1 - torch.cos(math.pi * (torch.arange(n, device=wav.device) + 0.5) / n)) / 2
+            pieces.append(tail[:, :-n])
+            wav = torch.cat([tail[:, -n:] * (1 - fade_in) + wav[:, :n] * fade_in, wav[:, n:]], dim=1)
+        else:
+            pieces.append(tail)
+        tail = wav
+    return torch.cat(pieces + [tail], dim=1)
+
+
 @dataclass
 class Conditionals:
     """
@@ -103,6 +157,58 @@ class Conditionals:
         return cls(T3Cond(**kwargs['t3']), kwargs['gen'])
 
 
+class ConditionalsCache:
+    """
+    Content-addressed LRU cache of `Conditionals`, so that a reference voice is only processed once.
+
+    Entries are keyed by a hash of the reference audio bytes plus the settings that affect the conditionals
+    (see `key`). The exaggeration is not part of the key; callers apply it to the cached `T3Cond`. Up to
+    `max_items` entries are kept in memory; if `cache_dir` is given, every entry is also saved there with
+    `Conditionals.save`, and memory misses fall back to it.
+    """
+
+    def __init__(self, max_items=32, cache_dir=None):
+        self.max_items = max_items
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(audio_bytes: bytes, **fields) -> str:
+        h = hashlib.sha256(audio_bytes)
+        h.update(repr(sorted(fields.items())).encode())
+        return h.hexdigest()
+
+    def get(self, key, device="cpu"):
+        "Returns the cached `Conditionals` on `device`, or None."
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        if self.cache_dir is None or not (fpath := self.cache_dir / f"{key}.pt").exists():
+            return None
+        conds = Conditionals.load(fpath).to(device)
+        self._remember(key, conds)
+        return conds
+
+    def put(self, key, conds: Conditionals):
+        self._remember(key, conds)
+        if self.cache_dir is not None:
+            # write then rename, so that concurrent readers never see a partial file
+            tmp_fpath = self.cache_dir / f"{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+            conds.save(tmp_fpath)
+            os.replace(tmp_fpath, self.cache_dir / f"{key}.pt")
+
+    def _remember(self, key, conds):
+        with self._lock:
+            self._items[key] = conds
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
 class ChatterboxTTS:
     ENC_COND_LEN = 6 * S3_SR
     DEC_COND_LEN = 10 * S3GEN_SR
@@ -111,7 +217,7 @@ class ChatterboxTTS:
         self,
         t3: T3,
         s3gen: S3Gen,
-        ve: VoiceEncoder,
+        ve: Union[VoiceEncoder, Callable[[], VoiceEncoder]],
         tokenizer: EnTokenizer,
         device: str,
         conds: Conditionals = None,
@@ -119,15 +225,47 @@ class ChatterboxTTS:
         self.sr = S3GEN_SR  # sample rate of synthesized audio
         self.t3 = t3
         self.s3gen = s3gen
-        self.ve = ve
+        self._ve = ve  # or a function loading it on first use, see `ve`
+        self._ve_lock = threading.Lock()
         self.tokenizer = tokenizer
         self.device = device
         self.conds = conds
+        self.conds_cache = ConditionalsCache()
+        self.voices: 'VoiceLibrary' = None  # see `chatterbox.voices`
+        import perth  # slow to import (scipy.signal), so only when a model is created
         self.watermarker = perth.PerthImplicitWatermarker()
 
+    @property
+    def ve(self) -> VoiceEncoder:
+        "The voice encoder, only needed to build conditionals from reference audio; loaded on first use if lazy."
+        if not isinstance(self._ve, VoiceEncoder):
+            with self._ve_lock:
+                if not isinstance(self._ve, VoiceEncoder):
+                    self._ve = self._ve()
+        return self._ve
+
     @classmethod
-    def from_local(cls, ckpt_dir, device) -> 'ChatterboxTTS':
+    def from_local(cls, ckpt_dir, device, dtype=None, t3_int8=False, lazy_ve=False) -> 'ChatterboxTTS':
+        """
+        Loads the model from a checkpoint directory. With `dtype` (e.g. `torch.bfloat16` or "bfloat16"), T3 and
+        the S3Gen flow (encoder and CFM estimator) run in that dtype, which halves their weight memory and memory
+        bandwidth (fast on CPUs with AMX / AVX512-BF16 and on recent GPUs). The small or numerically sensitive
+        parts stay fp32: the voice encoder, the S3 tokenizer and speaker encoder, the flow's ODE integration and
+        the HiFT vocoder with its STFT / iSTFT.
+
+        With `t3_int8` (CPU only, fp32), the Linear layers of T3's backbone and its speech head run with int8
+        weights (see `T3.quantize_int8`). They're loaded from `t3_cfg_int8.safetensors` if the checkpoint has one
+        (save `int8_state_dict(model.t3)` from `chatterbox.models.t3.inference.quantize` there), and quantized
+        from the fp32 weights otherwise.
+
+        The modules are constructed without initializing their weights, which are then taken over from the
+        memory-mapped checkpoint files rather than copied (see `models.utils.load_weights`), so loading is quick and
+        the weights are never held twice. With `lazy_ve`, the voice encoder is only loaded when conditionals are
+        first built from reference audio, e.g. never if all requests use the built-in or cached voices.
+        """
         ckpt_dir = Path(ckpt_dir)
+        if isinstance(dtype, str):
+            dtype = getattr(torch, dtype)
 
         # Always load to CPU first for non-CUDA devices to handle CUDA-saved models
         if device in ["cpu", "mps"]:
@@ -135,24 +273,34 @@ class ChatterboxTTS:
         else:
             map_location = None
 
-        ve = VoiceEncoder()
-        ve.load_state_dict(
-            load_file(ckpt_dir / "ve.safetensors")
-        )
-        ve.to(device).eval()
-
-        t3 = T3()
-        t3_state = load_file(ckpt_dir / "t3_cfg.safetensors")
-        if "model" in t3_state.keys():
-            t3_state = t3_state["model"][0]
-        t3.load_state_dict(t3_state)
-        t3.to(device).eval()
-
-        s3gen = S3Gen()
-        s3gen.load_state_dict(
-            load_file(ckpt_dir / "s3gen.safetensors"), strict=False
-        )
+        def load_ve():
+            with init_empty_weights():
+                ve = VoiceEncoder()
+            load_weights(ve, load_file(ckpt_dir / "ve.safetensors"))
+            return ve.to(device).eval()
+
+        ve = load_ve if lazy_ve else load_ve()
+
+        with init_empty_weights():
+            t3 = T3()
+        if t3_int8:
+            assert device == "cpu" and dtype in (None, torch.float32), "int8 T3 runs on CPU, in fp32"
+        if t3_int8 and (t3_int8_fpath := ckpt_dir / "t3_cfg_int8.safetensors").exists():
+            t3.quantize_int8(load_file(t3_int8_fpath))
+        else:
+            t3_state = load_file(ckpt_dir / "t3_cfg.safetensors")
+            if "model" in t3_state.keys():
+                t3_state = t3_state["model"][0]
+            load_weights(t3, t3_state)
+            if t3_int8:
+                t3.quantize_int8()
+        t3.to(device=device, dtype=dtype).eval()
+
+        with init_empty_weights():
+            s3gen = S3Gen()
+        load_weights(s3gen, load_file(ckpt_dir / "s3gen.safetensors"), strict=False)
         s3gen.to(device).eval()
+        s3gen.flow.to(dtype=dtype)
 
         tokenizer = EnTokenizer(
             str(ckpt_dir / "tokenizer.json")
@@ -165,7 +313,7 @@ class ChatterboxTTS:
         return cls(t3, s3gen, ve, tokenizer, device, conds=conds)
 
     @classmethod
-    def from_pretrained(cls, device) -> 'ChatterboxTTS':
+    def from_pretrained(cls, device, dtype=None, t3_int8=False, lazy_ve=False) -> 'ChatterboxTTS':
         # Check if MPS is available on macOS
         if device == "mps" and not torch.backends.mps.is_available():
             if not torch.backends.mps.is_built():
@@ -177,11 +325,30 @@ class ChatterboxTTS:
         for fpath in ["ve.safetensors", "t3_cfg.safetensors", "s3gen.safetensors", "tokenizer.json", "conds.pt"]:
             local_path = hf_hub_download(repo_id=REPO_ID, filename=fpath)
 
-        return cls.from_local(Path(local_path).parent, device)
+        return cls.from_local(Path(local_path).parent, device, dtype=dtype, t3_int8=t3_int8, lazy_ve=lazy_ve)
 
     def prepare_conditionals(self, wav_fpath, exaggeration=0.5):
+        self.conds = self.get_conditionals(wav_fpath, exaggeration=exaggeration)
+
+    def get_conditionals(self, wav_fpath, exaggeration=0.5) -> Conditionals:
+        """
+        Builds the conditionals for a reference voice without storing them on the model, so that several voices
+        can be served concurrently (see `chatterbox.scheduler`). Repeated voices are served from `self.conds_cache`.
+        `wav_fpath` may also be the contents of an audio file, e.g. an upload, which is then decoded in memory.
+        """
+        key = None
+        if self.conds_cache is not None:
+            key = self.conds_cache.key(
+                wav_fpath if isinstance(wav_fpath, bytes) else Path(wav_fpath).read_bytes(),
+                enc_cond_len=self.ENC_COND_LEN,
+                dec_cond_len=self.DEC_COND_LEN,
+                speech_cond_prompt_len=self.t3.hp.speech_cond_prompt_len,
+            )
+            if (conds := self.conds_cache.get(key, device=self.device)) is not None:
+                return Conditionals(self._with_exaggeration(conds.t3, exaggeration), conds.gen)
+
         ## Load reference wav
-        s3gen_ref_wav, _sr = librosa.load(wav_fpath, sr=S3GEN_SR)
+        s3gen_ref_wav, _sr = load_audio(wav_fpath, sr=S3GEN_SR)
 
         ref_16k_wav = librosa.resample(s3gen_ref_wav, orig_sr=S3GEN_SR, target_sr=S3_SR)
 
@@ -203,48 +370,120 @@ class ChatterboxTTS:
             cond_prompt_speech_tokens=t3_cond_prompt_tokens,
             emotion_adv=exaggeration * torch.ones(1, 1, 1),
         ).to(device=self.device)
-        self.conds = Conditionals(t3_cond, s3gen_ref_dict)
+        conds = Conditionals(t3_cond, s3gen_ref_dict)
+        if key is not None:
+            self.conds_cache.put(key, conds)
+        return Conditionals(conds.t3, conds.gen)
+
+    def get_conditionals_batch(self, wav_fpaths, exaggeration=0.5) -> List[Conditionals]:
+        """
+        Batched version of `get_conditionals` for many reference voices (see `VoiceLibrary.ingest`): the voice
+        encoder, CAMPPlus and the S3 tokenizer each run once over the whole list. Like there, the entries may also
+        be audio file contents.
+        """
+        s3gen_ref_wavs = [load_audio(wav_fpath, sr=S3GEN_SR)[0] for wav_fpath in wav_fpaths]
+        ref_16k_wavs = [librosa.resample(wav, orig_sr=S3GEN_SR, target_sr=S3_SR) for wav in s3gen_ref_wavs]
+
+        s3gen_ref_dicts = self.s3gen.embed_refs(
+            [wav[:self.DEC_COND_LEN] for wav in s3gen_ref_wavs], S3GEN_SR, device=self.device,
+        )
 
-    def generate(
-        self,
-        text,
-        repetition_penalty=1.2,
-        min_p=0.05,
-        top_p=1.0,
-        audio_prompt_path=None,
-        exaggeration=0.5,
-        cfg_weight=0.5,
-        temperature=0.8,
-    ):
-        if audio_prompt_path:
-            self.prepare_conditionals(audio_prompt_path, exaggeration=exaggeration)
-        else:
-            assert self.conds is not None, "Please `prepare_conditionals` first or specify `audio_prompt_path`"
+        # Speech cond prompt tokens
+        plen = self.t3.hp.speech_cond_prompt_len
+        t3_cond_prompt_tokens, t3_cond_prompt_lens = self.s3gen.tokenizer.forward(
+            [wav[:self.ENC_COND_LEN] for wav in ref_16k_wavs], max_len=plen,
+        )
 
-        # Update exaggeration if needed
-        if exaggeration != self.conds.t3.emotion_adv[0, 0, 0]:
-            _cond: T3Cond = self.conds.t3
-            self.conds.t3 = T3Cond(
-                speaker_emb=_cond.speaker_emb,
-                cond_prompt_speech_tokens=_cond.cond_prompt_speech_tokens,
+        # Voice-encoder speaker embeddings
+        ve_embeds = torch.from_numpy(self.ve.embeds_from_wavs(ref_16k_wavs, sample_rate=S3_SR))
+
+        conds = []
+        for i, s3gen_ref_dict in enumerate(s3gen_ref_dicts):
+            t3_cond = T3Cond(
+                speaker_emb=ve_embeds[i:i + 1],
+                cond_prompt_speech_tokens=t3_cond_prompt_tokens[i:i + 1, :t3_cond_prompt_lens[i]],
                 emotion_adv=exaggeration * torch.ones(1, 1, 1),
             ).to(device=self.device)
+            conds.append(Conditionals(t3_cond, s3gen_ref_dict))
+        return conds
 
-        # Norm and tokenize text
-        text = punc_norm(text)
-        text_tokens = self.tokenizer.text_to_tokens(text).to(self.device)
+    def _prepare_text_and_conds(self, text, audio_prompt_path, exaggeration, cfg_weight, voice_id=None, conds=None):
+        """
+        Shared setup for `generate` and `generate_stream`: resolves the request's conditionals and returns them
+        with the padded (and CFG-duplicated) text tokens. The voice is taken from `conds`, else `voice_id` (see
+        `self.voices`), else `audio_prompt_path`, else the default `self.conds`.
+
+        Nothing is written to the model, so one model can serve concurrent requests with different voices.
+        """
+        conds = self._resolve_conds(audio_prompt_path, exaggeration, voice_id=voice_id, conds=conds)
 
+        text_tokens = self._tokenize_text(text)
         if cfg_weight > 0.0:
             text_tokens = torch.cat([text_tokens, text_tokens], dim=0)  # Need two seqs for CFG
+        return conds, text_tokens
+
+    def _resolve_conds(self, audio_prompt_path, exaggeration, voice_id=None, conds=None) -> Conditionals:
+        "The voice of a request (see `_prepare_text_and_conds`), with the given exaggeration."
+        if conds is None:
+            if voice_id is not None:
+                assert self.voices is not None, "Please attach a `VoiceLibrary` to `self.voices` to use `voice_id`"
+                conds = self.voices.get(voice_id, exaggeration=exaggeration)
+            elif audio_prompt_path:
+                conds = self.get_conditionals(audio_prompt_path, exaggeration=exaggeration)
+            else:
+                assert self.conds is not None, "Please `prepare_conditionals` first or specify `audio_prompt_path`"
+                conds = self.conds
+
+        # Update exaggeration if needed
+        return Conditionals(self._with_exaggeration(conds.t3, exaggeration), conds.gen)
+
+    def _tokenize_text(self, text):
+        "Normalize and tokenize text, and add the start / stop text tokens. Returns a (1, T) tensor."
+        text = punc_norm(text)
+        text_tokens = self.tokenizer.text_to_tokens(text).to(self.device)
 
         sot = self.t3.hp.start_text_token
         eot = self.t3.hp.stop_text_token
         text_tokens = F.pad(text_tokens, (1, 0), value=sot)
         text_tokens = F.pad(text_tokens, (0, 1), value=eot)
+        return text_tokens
+
+    def generate(
+        self,
+        text,
+        repetition_penalty=1.2,
+        min_p=0.05,
+        top_p=1.0,
+        audio_prompt_path=None,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        voice_id=None,
+        conds=None,
+        cfg_tokens=None,
+        flow_cfg_rate=None,
+        flow_cfg_steps=None,
+        flow_steps=10,
+        flow_solver=None,
+    ):
+        """
+        Synthesizes `text` and returns a watermarked (1, T) waveform at `self.sr`.
+
+        Classifier-free guidance doubles the batch of both stages, and can be scheduled to trade some guidance
+        for speed: `cfg_tokens` only guides the first T3 tokens (`cfg_weight` sets the strength), and
+        `flow_cfg_steps` only the first S3Gen flow steps (`flow_cfg_rate` sets the strength, 0.7 by default).
+        `cfg_weight=0, flow_cfg_rate=0` is the guidance-free fast mode.
+
+        S3Gen's cost is dominated by its flow decoder, which runs `flow_steps` ODE steps with `flow_solver` (see
+        `ConditionalCFM.solve`; defaults to euler). E.g. `flow_steps=5, flow_solver="multistep"` halves it.
+        """
+        conds, text_tokens = self._prepare_text_and_conds(
+            text, audio_prompt_path, exaggeration, cfg_weight, voice_id=voice_id, conds=conds,
+        )
 
         with torch.inference_mode():
             speech_tokens = self.t3.inference(
-                t3_cond=self.conds.t3,
+                t3_cond=conds.t3,
                 text_tokens=text_tokens,
                 max_new_tokens=1000,  # TODO: use the value in config
                 temperature=temperature,
@@ -252,6 +491,7 @@ class ChatterboxTTS:
                 repetition_penalty=repetition_penalty,
                 min_p=min_p,
                 top_p=top_p,
+                cfg_tokens=cfg_tokens,
             )
             # Extract only the conditional batch.
             speech_tokens = speech_tokens[0]
@@ -265,8 +505,270 @@ class ChatterboxTTS:
 
             wav, _ = self.s3gen.inference(
                 speech_tokens=speech_tokens,
-                ref_dict=self.conds.gen,
+                ref_dict=conds.gen,
+                n_timesteps=flow_steps,
+                solver=flow_solver,
+                cfg_rate=flow_cfg_rate,
+                cfg_steps=flow_cfg_steps,
+            )
+            wav = wav.squeeze(0).detach().cpu().numpy()
+            watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=self.sr)
+        return torch.from_numpy(watermarked_wav).unsqueeze(0)
+
+    def generate_batch(
+        self,
+        texts,
+        conds=None,
+        repetition_penalty=1.2,
+        min_p=0.05,
+        top_p=1.0,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        cfg_tokens=None,
+        flow_cfg_rate=None,
+        flow_cfg_steps=None,
+        flow_steps=10,
+        flow_solver=None,
+    ):
+        """
+        Batched version of `generate`: synthesizes N texts with a single batched T3 decoding pass, then a single
+        batched S3Gen pass (see `S3Gen.inference_batch`).
+
+        Args:
+            texts: list of N strings.
+            conds: optional list of N `Conditionals` (one voice per text); defaults to `self.conds` for all.
+        Returns:
+            list of N watermarked (1, T) waveforms.
+        """
+        if conds is None:
+            assert self.conds is not None, "Please `prepare_conditionals` first or specify `conds`"
+            conds = [self.conds] * len(texts)
+        assert len(conds) == len(texts), "need exactly one Conditionals per text"
+
+        with torch.inference_mode():
+            batch_speech_tokens = self.t3.inference_batch(
+                t3_conds=[self._with_exaggeration(cond.t3, exaggeration) for cond in conds],
+                text_tokens=[self._tokenize_text(text)[0] for text in texts],
+                max_new_tokens=1000,  # TODO: use the value in config
+                temperature=temperature,
+                cfg_weight=cfg_weight,
+                repetition_penalty=repetition_penalty,
+                min_p=min_p,
+                top_p=top_p,
+                cfg_tokens=cfg_tokens,
+            )
+            return self._tokens_to_wav_batch(
+                batch_speech_tokens, [cond.gen for cond in conds],
+                n_timesteps=flow_steps, solver=flow_solver, cfg_rate=flow_cfg_rate, cfg_steps=flow_cfg_steps,
+            )
+
+    def generate_long(
+        self,
+        text,
+        repetition_penalty=1.2,
+        min_p=0.05,
+        top_p=1.0,
+        audio_prompt_path=None,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        voice_id=None,
+        conds=None,
+        cfg_tokens=None,
+        flow_cfg_rate=None,
+        flow_cfg_steps=None,
+        flow_steps=10,
+        flow_solver=None,
+        max_chunk_chars=300,
+        batch_size=8,
+        vocode_workers=2,
+        crossfade_ms=50,
+    ):
+        """
+        Synthesizes text of any length, e.g. a book chapter, which `generate` can't since T3 stops after 1000
+        tokens (~40 s of speech).
+
+        The text is split into chunks of whole sentences of up to `max_chunk_chars` characters (see
+        `split_sentences`), whose speech tokens are sampled by batched T3 passes over `batch_size` chunks. Each
+        batch is vocoded in one batched S3Gen pass, by one of `vocode_workers` threads while the next batch decodes,
+        and the chunks are joined with `crossfade_ms` cross-fades. The other arguments are the same as in
+        `generate`.
+
+        Returns one watermarked (1, T) waveform.
+        """
+        chunks = split_sentences(text, max_chunk_chars)
+        assert chunks, "text is empty"
+        conds = self._resolve_conds(audio_prompt_path, exaggeration, voice_id=voice_id, conds=conds)
+        flow_kwargs = dict(n_timesteps=flow_steps, solver=flow_solver, cfg_rate=flow_cfg_rate, cfg_steps=flow_cfg_steps)
+
+        with torch.inference_mode(), ThreadPoolExecutor(vocode_workers, thread_name_prefix="chatterbox-s3gen") as pool:
+            wav_futures = []
+            for start in range(0, len(chunks), batch_size):
+                batch = chunks[start:start + batch_size]
+                batch_speech_tokens = self.t3.inference_batch(
+                    t3_conds=[conds.t3] * len(batch),
+                    text_tokens=[self._tokenize_text(chunk)[0] for chunk in batch],
+                    max_new_tokens=1000,  # TODO: use the value in config
+                    temperature=temperature,
+                    cfg_weight=cfg_weight,
+                    repetition_penalty=repetition_penalty,
+                    min_p=min_p,
+                    top_p=top_p,
+                    cfg_tokens=cfg_tokens,
+                )
+                wav_futures.append(pool.submit(
+                    self._tokens_to_wav_batch, batch_speech_tokens, [conds.gen] * len(batch), **flow_kwargs,
+                ))
+            wavs = [wav for future in wav_futures for wav in future.result()]
+        return crossfade_join(wavs, int(crossfade_ms * self.sr / 1000))
+
+    def _with_exaggeration(self, t3_cond: T3Cond, exaggeration) -> T3Cond:
+        "Returns `t3_cond` with the given exaggeration, without touching the caller's conditionals."
+        if exaggeration == t3_cond.emotion_adv[0, 0, 0]:
+            return t3_cond
+        return T3Cond(
+            speaker_emb=t3_cond.speaker_emb,
+            cond_prompt_speech_tokens=t3_cond.cond_prompt_speech_tokens,
+            emotion_adv=exaggeration * torch.ones(1, 1, 1),
+        ).to(device=self.device)
+
+    @torch.inference_mode()
+    def _tokens_to_wav(self, speech_tokens, ref_dict, n_timesteps=10, solver=None, cfg_rate=None, cfg_steps=None):
+        """
+        Vocodes the speech tokens predicted by T3 for one utterance and returns the watermarked (1, T) waveform.
+        The other arguments are the flow decoder settings (`flow_*` in `generate`).
+        """
+        speech_tokens = drop_invalid_tokens(speech_tokens)
+        speech_tokens = speech_tokens[speech_tokens < 6561]
+        speech_tokens = speech_tokens.to(self.device)
+
+        wav, _ = self.s3gen.inference(
+            speech_tokens=speech_tokens,
+            ref_dict=ref_dict,
+            n_timesteps=n_timesteps,
+            solver=solver,
+            cfg_rate=cfg_rate,
+            cfg_steps=cfg_steps,
+        )
+        wav = wav.squeeze(0).detach().cpu().numpy()
+        watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=self.sr)
+        return torch.from_numpy(watermarked_wav).unsqueeze(0)
+
+    @torch.inference_mode()
+    def _tokens_to_wav_batch(self, batch_speech_tokens, ref_dicts, n_timesteps=10, solver=None, cfg_rate=None,
+                             cfg_steps=None):
+        """
+        Batched version of `_tokens_to_wav` for N utterances, each with its own `ref_dict`; S3Gen runs once over
+        the padded batch. Returns the N watermarked (1, T) waveforms.
+        """
+        batch_speech_tokens = [drop_invalid_tokens(speech_tokens) for speech_tokens in batch_speech_tokens]
+        batch_speech_tokens = [speech_tokens[speech_tokens < 6561] for speech_tokens in batch_speech_tokens]
+
+        wavs = self.s3gen.inference_batch(
+            speech_tokens=batch_speech_tokens,
+            ref_dicts=ref_dicts,
+            n_timesteps=n_timesteps,
+            solver=solver,
+            cfg_rate=cfg_rate,
+            cfg_steps=cfg_steps,
+        )
+        watermarked_wavs = []
+        for wav in wavs:
+            wav = wav.squeeze(0).detach().cpu().numpy()
+            watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=self.sr)
+            watermarked_wavs.append(torch.from_numpy(watermarked_wav).unsqueeze(0))
+        return watermarked_wavs
+
+    def generate_stream(
+        self,
+        text,
+        repetition_penalty=1.2,
+        min_p=0.05,
+        top_p=1.0,
+        audio_prompt_path=None,
+        exaggeration=0.5,
+        cfg_weight=0.5,
+        temperature=0.8,
+        chunk_size=25,
+        voice_id=None,
+        conds=None,
+        cfg_tokens=None,
+        flow_cfg_rate=None,
+        flow_cfg_steps=None,
+        flow_steps=10,
+        flow_solver=None,
+        flow_incremental=False,
+    ):
+        """
+        Streaming version of `generate`. Yields watermarked (1, T) waveform chunks at `self.sr` as speech
+        tokens are sampled, so the first audio is available after `chunk_size` tokens (25 tokens = 1 s of
+        speech, less the vocoder's lookahead) rather than after the whole utterance.
+
+        Chunks are stitched by `S3Gen.stream_inference`; concatenating them gives the full utterance. See
+        `generate` for the guidance and flow decoder settings. With `flow_incremental`, S3Gen only processes
+        the new tokens of each chunk instead of all tokens so far (see `S3Gen.stream_inference`), which keeps the
+        cost of a chunk constant on long utterances.
+        """
+        lookahead = self.s3gen.flow.pre_lookahead_len
+
+        conds, text_tokens = self._prepare_text_and_conds(
+            text, audio_prompt_path, exaggeration, cfg_weight, voice_id=voice_id, conds=conds,
+        )
+
+        @torch.inference_mode()
+        def _vocode(speech_tokens, token_offset, cache, finalize):
+            speech_tokens = torch.cat(speech_tokens).unsqueeze(0).to(self.device)
+            wav, cache = self.s3gen.stream_inference(
+                speech_tokens=speech_tokens,
+                ref_dict=conds.gen,
+                token_offset=token_offset,
+                cache=cache,
+                finalize=finalize,
+                n_timesteps=flow_steps,
+                solver=flow_solver,
+                cfg_rate=flow_cfg_rate,
+                cfg_steps=flow_cfg_steps,
+                incremental=flow_incremental,
             )
+            if wav.size(1) == 0:  # the chunk is shorter than the vocoder's lookahead
+                return wav.cpu(), cache
             wav = wav.squeeze(0).detach().cpu().numpy()
             watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=self.sr)
-        return torch.from_numpy(watermarked_wav).unsqueeze(0)
\ No newline at end of file
+            return torch.from_numpy(watermarked_wav).unsqueeze(0), cache
+
+        # T3 (`inference_stream`) and `_vocode` run in inference mode; the chunks are yielded outside of it, so it
+        # doesn't leak into the caller's code while the generator is suspended
+        speech_tokens = []
+        token_offset = 0
+        cache = None
+        for next_token in self.t3.inference_stream(
+            t3_cond=conds.t3,
+            text_tokens=text_tokens,
+            max_new_tokens=1000,  # TODO: use the value in config
+            temperature=temperature,
+            cfg_weight=cfg_weight,
+            repetition_penalty=repetition_penalty,
+            min_p=min_p,
+            top_p=top_p,
+            cfg_tokens=cfg_tokens,
+        ):
+            # Extract only the conditional batch, and skip SoS / EoS
+            next_token = next_token[0]
+            if next_token.item() >= SPEECH_VOCAB_SIZE:
+                continue
+            speech_tokens.append(next_token)
+
+            # Wait for the lookahead tokens that the flow encoder needs before vocoding a chunk
+            if len(speech_tokens) - token_offset >= chunk_size + lookahead:
+                wav, cache = _vocode(
+                    speech_tokens[:token_offset + chunk_size + lookahead], token_offset, cache, finalize=False,
+                )
+                token_offset += chunk_size
+                if wav.size(1) > 0:
+                    yield wav
+
+        if speech_tokens:
+            wav, _ = _vocode(speech_tokens, token_offset, cache, finalize=True)
+            if wav.size(1) > 0:
+                yield wav
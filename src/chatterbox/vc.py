@@ -2,12 +2,12 @@ from pathlib import Path
 
 import librosa
 import torch
-import perth
 from huggingface_hub import hf_hub_download
 from safetensors.torch import load_file
 
 from .models.s3tokenizer import S3_SR
 from .models.s3gen import S3GEN_SR, S3Gen
+from .models.utils import init_empty_weights, load_weights
 
 
 REPO_ID = "ResembleAI/chatterbox"
@@ -26,6 +26,7 @@ class ChatterboxVC:
         self.sr = S3GEN_SR
         self.s3gen = s3gen
         self.device = device
+        import perth  # see ChatterboxTTS.__init__
         self.watermarker = perth.PerthImplicitWatermarker()
         if ref_dict is None:
             self.ref_dict = None
@@ -36,8 +37,11 @@ class ChatterboxVC:
             }
 
     @classmethod
-    def from_local(cls, ckpt_dir, device) -> 'ChatterboxVC':
+    def from_local(cls, ckpt_dir, device, dtype=None) -> 'ChatterboxVC':
+        "Loads the model from a checkpoint directory; see `ChatterboxTTS.from_local` for `dtype`."
         ckpt_dir = Path(ckpt_dir)
+        if isinstance(dtype, str):
+            dtype = getattr(torch, dtype)
         
         # Always load to CPU first for non-CUDA devices to handle CUDA-saved models
         if device in ["cpu", "mps"]:
@@ -50,16 +54,16 @@ class ChatterboxVC:
             states = torch.load(builtin_voice, map_location=map_location)
             ref_dict = states['gen']
 
-        s3gen = S3Gen()
-        s3gen.load_state_dict(
-            load_file(ckpt_dir / "s3gen.safetensors"), strict=False
-        )
+        with init_empty_weights():
+            s3gen = S3Gen()
+        load_weights(s3gen, load_file(ckpt_dir / "s3gen.safetensors"), strict=False)
         s3gen.to(device).eval()
+        s3gen.flow.to(dtype=dtype)
 
         return cls(s3gen, device, ref_dict=ref_dict)
 
     @classmethod
-    def from_pretrained(cls, device) -> 'ChatterboxVC':
+    def from_pretrained(cls, device, dtype=None) -> 'ChatterboxVC':
         # Check if MPS is available on macOS
         if device == "mps" and not torch.backends.mps.is_available():
             if not torch.backends.mps.is_built():
@@ -71,24 +75,35 @@ class ChatterboxVC:
         for fpath in ["s3gen.safetensors", "conds.pt"]:
             local_path = hf_hub_download(repo_id=REPO_ID, filename=fpath)
 
-        return cls.from_local(Path(local_path).parent, device)
+        return cls.from_local(Path(local_path).parent, device, dtype=dtype)
 
     def set_target_voice(self, wav_fpath):
+        self.ref_dict = self.get_target_voice(wav_fpath)
+
+    def get_target_voice(self, wav_fpath):
+        "Like `set_target_voice`, but returns the reference embedding instead of storing it on the model."
         ## Load reference wav
         s3gen_ref_wav, _sr = librosa.load(wav_fpath, sr=S3GEN_SR)
 
         s3gen_ref_wav = s3gen_ref_wav[:self.DEC_COND_LEN]
-        self.ref_dict = self.s3gen.embed_ref(s3gen_ref_wav, S3GEN_SR, device=self.device)
+        return self.s3gen.embed_ref(s3gen_ref_wav, S3GEN_SR, device=self.device)
 
     def generate(
         self,
         audio,
         target_voice_path=None,
+        ref_dict=None,
     ):
-        if target_voice_path:
-            self.set_target_voice(target_voice_path)
-        else:
-            assert self.ref_dict is not None, "Please `prepare_conditionals` first or specify `target_voice_path`"
+        """
+        Converts `audio` to the target voice: `ref_dict` (see `get_target_voice`), else `target_voice_path`,
+        else the voice set by `set_target_voice`. Nothing is written to the model, so concurrent calls are safe.
+        """
+        if ref_dict is None:
+            if target_voice_path:
+                ref_dict = self.get_target_voice(target_voice_path)
+            else:
+                assert self.ref_dict is not None, "Please `prepare_conditionals` first or specify `target_voice_path`"
+                ref_dict = self.ref_dict
 
         with torch.inference_mode():
             audio_16, _ = librosa.load(audio, sr=S3_SR)
@@ -97,7 +112,7 @@ class ChatterboxVC:
             s3_tokens, _ = self.s3gen.tokenizer(audio_16)
             wav, _ = self.s3gen.inference(
                 speech_tokens=s3_tokens,
-                ref_dict=self.ref_dict,
+                ref_dict=ref_dict,
             )
             wav = wav.squeeze(0).detach().cpu().numpy()
             watermarked_wav = self.watermarker.apply_watermark(wav, sample_rate=self.sr)
@@ -0,0 +1,116 @@
+import json
+import logging
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+from .models.t3.modules.cond_enc import T3Cond
+from .tts import ChatterboxTTS, Conditionals
+
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".m4a", ".ogg")
+VOICE_ID_PATTERN = re.compile(r"[\w\-]+")
+
+
+class VoiceLibrary:
+    """
+    A registry of pre-processed voices, so that requests can select a voice by id without any audio decoding or
+    reference processing.
+
+    Each voice is stored in `voice_dir` as a small `{voice_id}.safetensors` record holding the tensors of its
+    `Conditionals` (without the exaggeration, which is chosen per request). Records are memory-mapped when the
+    library is opened, and a voice's tensors are only read and moved to the device on first use.
+    """
+
+    def __init__(self, voice_dir, device="cpu"):
+        self.voice_dir = Path(voice_dir)
+        self.voice_dir.mkdir(parents=True, exist_ok=True)
+        self.device = device
+        self._records: Dict[str, 'safe_open'] = {}
+        self._loaded: Dict[str, Conditionals] = {}
+        self._lock = threading.Lock()
+        for fpath in sorted(self.voice_dir.glob("*.safetensors")):
+            self._records[fpath.stem] = safe_open(fpath, framework="pt", device="cpu")
+
+    def __contains__(self, voice_id):
+        return voice_id in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def ids(self) -> List[str]:
+        return sorted(self._records)
+
+    def get(self, voice_id, exaggeration=0.5) -> Conditionals:
+        "Returns the conditionals of a registered voice, with the given exaggeration."
+        assert voice_id in self._records, f"unknown voice: {voice_id}"
+        with self._lock:
+            if voice_id not in self._loaded:
+                self._loaded[voice_id] = self._read(self._records[voice_id])
+            conds = self._loaded[voice_id]
+        t3_cond = T3Cond(
+            speaker_emb=conds.t3.speaker_emb,
+            cond_prompt_speech_tokens=conds.t3.cond_prompt_speech_tokens,
+            emotion_adv=exaggeration * torch.ones(1, 1, 1),
+        ).to(device=self.device)
+        return Conditionals(t3_cond, conds.gen)
+
+    def _read(self, record) -> Conditionals:
+        meta = record.metadata()
+        t3, gen = {}, dict.fromkeys(json.loads(meta["gen_keys"]))
+        for name in record.keys():
+            group, key = name.split(".", 1)
+            (t3 if group == "t3" else gen)[key] = record.get_tensor(name)
+        return Conditionals(T3Cond(**t3), gen).to(self.device)
+
+    def add(self, voice_id: str, conds: Conditionals):
+        "Registers (or replaces) a voice and persists its record."
+        assert VOICE_ID_PATTERN.fullmatch(voice_id), f"invalid voice id: {voice_id!r}"
+        tensors = {}
+        for key, value in conds.t3.__dict__.items():
+            if torch.is_tensor(value) and key != "emotion_adv":
+                tensors[f"t3.{key}"] = value.detach().cpu().contiguous()
+        for key, value in conds.gen.items():
+            if torch.is_tensor(value):
+                tensors[f"gen.{key}"] = value.detach().cpu().contiguous()
+        fpath = self.voice_dir / f"{voice_id}.safetensors"
+        # A temporary file of its own, so that concurrent adds of the same id can't interleave their writes
+        with tempfile.NamedTemporaryFile(dir=self.voice_dir, prefix=f"{voice_id}.", suffix=".tmp", delete=False) as f:
+            tmp_fpath = Path(f.name)
+        try:
+            save_file(tensors, tmp_fpath, metadata={"gen_keys": json.dumps(list(conds.gen))})
+            tmp_fpath.replace(fpath)
+        except BaseException:
+            tmp_fpath.unlink(missing_ok=True)
+            raise
+
+        with self._lock:
+            self._records[voice_id] = safe_open(fpath, framework="pt", device="cpu")
+            self._loaded.pop(voice_id, None)
+
+    def ingest(self, model: ChatterboxTTS, audio_dir, batch_size=16) -> List[str]:
+        """
+        Registers every audio file in `audio_dir` under its file stem, processing the references in batches
+        (see `ChatterboxTTS.get_conditionals_batch`). Files whose stem isn't a valid voice id are skipped. Returns the
+        ids of the registered voices, including the ones that replaced an existing voice.
+        """
+        fpaths = []
+        for fpath in sorted(p for p in Path(audio_dir).iterdir() if p.suffix.lower() in AUDIO_EXTENSIONS):
+            if VOICE_ID_PATTERN.fullmatch(fpath.stem):
+                fpaths.append(fpath)
+            else:
+                logger.warning(f"skipping {fpath.name}: {fpath.stem!r} is not a valid voice id")
+        for i in range(0, len(fpaths), batch_size):
+            batch = fpaths[i:i + batch_size]
+            for fpath, conds in zip(batch, model.get_conditionals_batch(batch)):
+                self.add(fpath.stem, conds)
+            logger.info(f"ingested {min(i + batch_size, len(fpaths))}/{len(fpaths)} voices")
+        return [fpath.stem for fpath in fpaths]